@@ -0,0 +1,128 @@
+"""
+File bench_bot.py
+
+Benchmarks diddlebot's on_message end to end without discord or a real ritdl-ws: the discord client is
+replaced with a recording fake, the api with the local stand-in server and email with the local SMTP sink.
+Reports throughput and p50/p99 on_message latency for each scripted workload.
+
+    python -m bench.bench_bot [messages per workload] [concurrency] [api latency] [smtp latency] [discord latency]
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from bench import fake_client
+from bench.fake_client import FakeServer, FakeChannel, FakeUser, FakeMessage
+from bench.smtp_sink import SmtpSink
+from bench.standin import StandInServer
+from bench.stats import summary_line
+from bench.workloads import WORKLOADS, CHAN_GENERAL
+
+# Install the fake client before importing anything else from src.
+client = fake_client.install()
+
+from src import CHAN_ATTENDANCE, CHAN_ANNOUNCEMENTS, attendance, diddlebot, diddlemail, outbound, replica, state, util
+
+# Keep the replica and the shared state in a scratch directory, so a benchmark run from the bot's directory never
+# touches the live quips, cancellations or excuse journal.
+scratch = tempfile.TemporaryDirectory(prefix="diddlebot-bench-")
+replica.REPLICA_FILE = os.path.join(scratch.name, "replica.db")
+if state.STATE_FILE:
+    state.STATE_FILE = os.path.join(scratch.name, os.path.basename(state.STATE_FILE))
+    state.set_backend(state.SqliteBackend(state.STATE_FILE))
+
+# The fake client has no rate limits, and every workload sends to a single channel, which would otherwise measure
+# nothing but discord's 5 messages per 5 seconds.
+outbound.CHANNEL_BURST = outbound.GLOBAL_BURST = 10 ** 6
+outbound.CHANNEL_RATE = outbound.GLOBAL_RATE = 10.0 ** 6
+
+
+async def run_workload(messages, concurrency):
+    """
+    Feeds messages through on_message, at most concurrency at a time.
+    :param messages: A list of FakeMessages.
+    :param concurrency: How many messages may be handled at once.
+    :return: (list of per-message latencies, elapsed wall clock seconds)
+    """
+
+    samples = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(message):
+        async with semaphore:
+            start = time.perf_counter()
+            await diddlebot.on_message(message)
+            samples.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one(message) for message in messages])
+    return samples, time.perf_counter() - start
+
+
+async def run(count, concurrency, api_latency, smtp_latency, send_latency):
+    client.send_latency = send_latency
+
+    api = StandInServer(latency=api_latency)
+    await api.start()
+    util.API_BASE_URL = api.base_url
+
+    sink = SmtpSink(latency=smtp_latency)
+    await sink.start()
+    diddlemail.SMTP_SERVER = sink.host
+    diddlemail.PORT = sink.port
+    diddlemail.EMAIL = "diddlebot@localhost"
+    diddlemail.EMAIL_PASSWORD = "hunter2"
+    diddlemail.CLUB_EMAIL = "club@localhost"
+    diddlemail.USE_STARTTLS = False
+
+    server = FakeServer("drumline")
+    channels = dict((name, FakeChannel(name, server)) for name in (CHAN_GENERAL, CHAN_ATTENDANCE, CHAN_ANNOUNCEMENTS))
+    client.servers.append(server)
+    util.build_channel_index()
+    authors = [FakeUser("member" + str(i)) for i in range(20)]
+
+    print("%d messages per workload, concurrency %d, api %.0f ms, smtp %.0f ms, discord %.0f ms\n" % (
+        count, concurrency, api_latency * 1000, smtp_latency * 1000, send_latency * 1000))
+
+    for (name, workload) in WORKLOADS:
+        messages = [FakeMessage(channels[chan], text, authors[i % len(authors)])
+                    for (i, (chan, text)) in enumerate(workload(count))]
+        api_before = api.requests
+
+        samples, elapsed = await run_workload(messages, concurrency)
+        print(summary_line(name, samples, elapsed) + "   api requests %d" % (api.requests - api_before))
+
+        if name == "attendance":
+            start = time.perf_counter()
+            for queue in attendance._excuse_queues:
+                await queue.join()
+            drained = elapsed + time.perf_counter() - start
+            print("%-22s %6d msgs %9.1f msg/s   smtp sessions %d, emails %d" % (
+                "attendance (recorded)", len(messages), len(messages) / drained, sink.connections,
+                len(sink.messages)))
+
+    # Stop the background workers so they don't outlive the event loop.
+    for task in attendance._excuse_workers + [diddlemail._outbox_task]:
+        if task is not None:
+            task.cancel()
+
+    await api.stop()
+    await sink.stop()
+    util.close_http_session()
+
+
+def main():
+    args = sys.argv[1:]
+    count = int(args[0]) if len(args) > 0 else 200
+    concurrency = int(args[1]) if len(args) > 1 else 20
+    api_latency = float(args[2]) if len(args) > 2 else 0.02
+    smtp_latency = float(args[3]) if len(args) > 3 else 0.002
+    send_latency = float(args[4]) if len(args) > 4 else 0.005
+    asyncio.get_event_loop().run_until_complete(run(count, concurrency, api_latency, smtp_latency, send_latency))
+
+
+if __name__ == "__main__":
+    main()
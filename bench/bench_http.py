@@ -0,0 +1,68 @@
+"""
+File bench_http.py
+
+Measures ritdl-ws client latency under concurrent load against the local stand-in server.
+
+    python -m bench.bench_http [requests] [concurrency] [server latency seconds]
+"""
+
+import asyncio
+import sys
+import time
+
+from bench.standin import StandInServer
+from bench.stats import percentile
+from src import util
+
+
+async def run(total, concurrency, latency):
+    server = StandInServer(latency=latency)
+    await server.start()
+    util.API_BASE_URL = server.base_url
+
+    samples = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            res = await util.http_get("/quip")
+            samples.append(time.perf_counter() - start)
+            assert res.status_code == 200
+
+    # Meanwhile, make sure the event loop keeps ticking while requests are outstanding.
+    stalls = []
+
+    async def heartbeat():
+        while True:
+            before = time.perf_counter()
+            await asyncio.sleep(0.01)
+            stalls.append(time.perf_counter() - before - 0.01)
+
+    beat = asyncio.ensure_future(heartbeat())
+    start = time.perf_counter()
+    await asyncio.gather(*[one() for _ in range(total)])
+    elapsed = time.perf_counter() - start
+    beat.cancel()
+
+    await server.stop()
+    util.close_http_session()
+
+    samples.sort()
+    print("requests:        " + str(total) + " (concurrency " + str(concurrency) + ")")
+    print("throughput:      %.1f req/s" % (total / elapsed))
+    print("latency p50:     %.2f ms" % (percentile(samples, 50) * 1000))
+    print("latency p99:     %.2f ms" % (percentile(samples, 99) * 1000))
+    print("connections:     " + str(server.connections))
+    print("max loop stall:  %.2f ms" % (max(stalls or [0]) * 1000))
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else util.API_MAX_CONNECTIONS
+    latency = float(sys.argv[3]) if len(sys.argv) > 3 else 0.02
+    asyncio.get_event_loop().run_until_complete(run(total, concurrency, latency))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+File bench_mail.py
+
+Measures email throughput and SMTP connection counts against the local SMTP sink.
+
+    python -m bench.bench_mail [emails] [sink latency seconds]
+"""
+
+import asyncio
+import sys
+import time
+
+from bench.smtp_sink import SmtpSink
+from src import diddlemail
+
+
+async def run(total, latency):
+    sink = SmtpSink(latency=latency)
+    await sink.start()
+
+    diddlemail.SMTP_SERVER = sink.host
+    diddlemail.PORT = sink.port
+    diddlemail.EMAIL = "diddlebot@localhost"
+    diddlemail.EMAIL_PASSWORD = "hunter2"
+    diddlemail.CLUB_EMAIL = "club@localhost"
+    diddlemail.USE_STARTTLS = False
+
+    start = time.perf_counter()
+    queued = [diddlemail.queue_email_to_club("Excuse number " + str(i), "Excuse " + str(i)) for i in range(total)]
+    enqueue_time = time.perf_counter() - start
+    results = await asyncio.gather(*queued)
+    elapsed = time.perf_counter() - start
+
+    await sink.stop()
+
+    print("emails:          " + str(total) + " (" + str(results.count(True)) + " sent)")
+    print("enqueue time:    %.2f ms" % (enqueue_time * 1000))
+    print("throughput:      %.1f emails/s" % (total / elapsed))
+    print("smtp sessions:   " + str(sink.connections) + " (" + str(sink.logins) + " logins)")
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.005
+    asyncio.get_event_loop().run_until_complete(run(total, latency))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+File fake_client.py
+
+A stand-in for the discord client that records what diddlebot sends instead of talking to discord, plus
+the bare minimum of fake servers, channels, users and messages to drive on_message.
+
+install() has to be called before any other src module is imported, because those modules grab
+src.client when they are imported.
+"""
+
+import asyncio
+import itertools
+
+_ids = itertools.count(1000)
+
+
+class FakeServer:
+    def __init__(self, name):
+        self.id = str(next(_ids))
+        self.name = name
+        self.channels = []
+        self.roles = []
+        self.members = []
+
+
+class FakeChannel:
+    def __init__(self, name, server):
+        self.id = str(next(_ids))
+        self.name = name
+        self.server = server
+        self.is_private = False
+        server.channels.append(self)
+
+
+class FakeUser:
+    def __init__(self, name):
+        self.id = str(next(_ids))
+        self.name = name
+        self.roles = []
+
+
+class FakeMessage:
+    def __init__(self, channel, content, author):
+        self.id = str(next(_ids))
+        self.channel = channel
+        self.server = channel.server
+        self.content = content
+        self.author = author
+
+
+class FakeClient:
+    """
+    Records every send and edit. send_latency simulates how long discord takes to answer.
+    """
+
+    def __init__(self, send_latency=0.0):
+        self.send_latency = send_latency
+        self.user = FakeUser("diddlebot")
+        self.servers = []
+        self.sent = []
+        self.edited = []
+        self.loop = None
+
+    def event(self, coro):
+        setattr(self, coro.__name__, coro)
+        return coro
+
+    def get_all_channels(self):
+        for server in self.servers:
+            for channel in server.channels:
+                yield channel
+
+    async def send_message(self, channel, content):
+        if self.send_latency:
+            await asyncio.sleep(self.send_latency)
+        message = FakeMessage(channel, content, self.user)
+        self.sent.append(message)
+        return message
+
+    async def edit_message(self, message, new_content):
+        if self.send_latency:
+            await asyncio.sleep(self.send_latency)
+        message.content = new_content
+        self.edited.append(message)
+        return message
+
+
+def install(send_latency=0.0):
+    """
+    Replaces src.client with a FakeClient.
+    :param send_latency: Seconds every send/edit takes.
+    :return: The FakeClient.
+    """
+
+    import src
+    src.client = FakeClient(send_latency)
+    return src.client
@@ -0,0 +1,78 @@
+"""
+File smtp_sink.py
+
+A local SMTP server that accepts and counts everything sent to it, for benchmarking diddlemail without
+a real mail server. It advertises AUTH PLAIN/LOGIN and accepts any credentials, but does not do STARTTLS,
+so diddlemail.USE_STARTTLS has to be turned off when talking to it.
+"""
+
+import asyncio
+
+
+class SmtpSink:
+    """
+    An asyncio SMTP server that swallows mail.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0):
+        """
+        :param host: The interface to listen on.
+        :param port: The port to listen on, 0 picks a free one.
+        :param latency: Seconds every command waits before it is answered.
+        """
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.connections = 0
+        self.logins = 0
+        self.messages = []
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _reply(self, writer, text):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        writer.write((text + "\r\n").encode("ascii"))
+        await writer.drain()
+
+    async def _handle_connection(self, reader, writer):
+        self.connections += 1
+        try:
+            await self._reply(writer, "220 smtp-sink ready")
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+
+                verb = line.decode("ascii", "replace").strip().split(" ", 1)[0].upper()
+                if verb in ("EHLO", "HELO"):
+                    await self._reply(writer, "250-smtp-sink\r\n250-AUTH PLAIN LOGIN\r\n250 8BITMIME")
+                elif verb == "AUTH":
+                    self.logins += 1
+                    await self._reply(writer, "235 ok")
+                elif verb == "DATA":
+                    await self._reply(writer, "354 go ahead")
+                    data = []
+                    while True:
+                        body_line = await reader.readline()
+                        if body_line in (b".\r\n", b".\n", b""):
+                            break
+                        data.append(body_line)
+                    self.messages.append(b"".join(data))
+                    await self._reply(writer, "250 queued")
+                elif verb == "QUIT":
+                    await self._reply(writer, "221 bye")
+                    break
+                else:
+                    await self._reply(writer, "250 ok")
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,146 @@
+"""
+File standin.py
+
+A small in-process stand-in for the ritdl-ws rest api. It speaks just enough HTTP/1.1 (with keep-alive) to
+serve the endpoints diddlebot uses, with a configurable artificial latency, and counts the connections
+and requests it receives so benchmarks can check connection reuse. GETs get an ETag, and conditional GETs for
+a body that hasn't changed are answered 304.
+"""
+
+import asyncio
+import json
+import random
+import urllib.parse
+import zlib
+
+
+class StandInServer:
+    """
+    An asyncio HTTP server that mimics the ritdl-ws endpoints under /api.
+    """
+
+    def __init__(self, latency=0.0, host="127.0.0.1", port=0):
+        """
+        :param latency: Seconds every request waits before it is answered.
+        :param host: The interface to listen on.
+        :param port: The port to listen on, 0 picks a free one.
+        """
+        self.latency = latency
+        self.host = host
+        self.port = port
+        self.quips = ["You call that a flam?", "Sticks up!", "Who rushed?"]
+        self.cancellations = []
+        self.excuses = []
+        self.connections = 0
+        self.requests = 0
+        self.not_modified = 0
+        self._server = None
+
+    @property
+    def base_url(self):
+        return "http://" + self.host + ":" + str(self.port) + "/api"
+
+    async def start(self):
+        """
+        Starts listening. When port was 0, self.port is updated with the port that was picked.
+        :return: None
+        """
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        """
+        Stops listening and waits for the server to close.
+        :return: None
+        """
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle_connection(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, _, value = line.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+
+                body = b""
+                if "content-length" in headers:
+                    body = await reader.readexactly(int(headers["content-length"]))
+
+                self.requests += 1
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+
+                status, payload = self.route(method, path, body)
+
+                etag = ""
+                if method == "GET" and status == 200:
+                    etag = '"%08x"' % zlib.crc32(payload)
+                    if headers.get("if-none-match") == etag:
+                        self.not_modified += 1
+                        status, payload = 304, b""
+                    etag = "ETag: " + etag + "\r\n"
+
+                writer.write(("HTTP/1.1 " + str(status) + " X\r\n"
+                              "Content-Type: text/plain; charset=utf-8\r\n"
+                              "Content-Length: " + str(len(payload)) + "\r\n" + etag +
+                              "Connection: keep-alive\r\n\r\n").encode("latin-1") + payload)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def route(self, method, path, body):
+        """
+        Answers a single request.
+        :param method: The HTTP method
+        :param path: The request path, including the /api prefix.
+        :param body: The raw request body.
+        :return: A (status code, body bytes) tuple.
+        """
+        path = path.split("?", 1)[0]
+        if not path.startswith("/api/"):
+            return 404, b"not found"
+        path = path[4:]
+
+        if method == "GET" and path == "/quip":
+            return 200, random.choice(self.quips).encode("utf-8")
+        if method == "GET" and path == "/quips":
+            return 200, json.dumps(self.quips).encode("utf-8")
+        if method == "PUT" and path == "/quip":
+            self.quips.append(body.decode("utf-8"))
+            return 200, b"OK"
+        if method == "GET" and path == "/cancellations":
+            return 200, json.dumps(sorted(self.cancellations)).encode("utf-8")
+        if method == "GET" and path.startswith("/cancellations/is/cancelled/"):
+            return 200, json.dumps(path.rsplit("/", 1)[1] in self.cancellations).encode("utf-8")
+        if method == "POST" and path.startswith("/cancellations/cancel/"):
+            self.cancellations.append(path.rsplit("/", 1)[1])
+            return 200, b"OK"
+        if method == "POST" and path.startswith("/cancellations/uncancel/"):
+            date = path.rsplit("/", 1)[1]
+            if date in self.cancellations:
+                self.cancellations.remove(date)
+            return 200, b"OK"
+        if method == "POST" and path == "/attendance/excuse":
+            fields = urllib.parse.parse_qs(body.decode("utf-8"), keep_blank_values=True)
+            self.excuses.append(json.dumps(dict((name, values[0]) for (name, values) in fields.items())))
+            return 200, b"OK"
+        if method == "GET" and path == "/attendance/excuses":
+            return 200, ("[" + ",".join(self.excuses) + "]").encode("utf-8")
+        if method == "POST" and path == "/attendance/excuses":
+            self.excuses.extend(json.dumps(excuse) for excuse in json.loads(body.decode("utf-8"))["excuses"])
+            return 200, b"OK"
+
+        return 404, b"not found"
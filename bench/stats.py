@@ -0,0 +1,27 @@
+"""
+File stats.py
+
+Small helpers for summarizing benchmark timings.
+"""
+
+
+def percentile(samples, pct):
+    """
+    :param samples: A sorted list of numbers.
+    :param pct: The percentile to find, 0-100.
+    :return: The nearest-rank percentile of the samples.
+    """
+    index = max(0, int(round(pct / 100.0 * len(samples))) - 1)
+    return samples[index]
+
+
+def summary_line(label, samples, elapsed):
+    """
+    :param label: What was measured.
+    :param samples: A list of latencies in seconds.
+    :param elapsed: Wall clock seconds the whole run took.
+    :return: A one line summary with throughput and p50/p99 latency.
+    """
+    samples = sorted(samples)
+    return "%-22s %6d msgs %9.1f msg/s   p50 %8.2f ms   p99 %8.2f ms" % (
+        label, len(samples), len(samples) / elapsed, percentile(samples, 50) * 1000, percentile(samples, 99) * 1000)
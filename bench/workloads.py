@@ -0,0 +1,56 @@
+"""
+File workloads.py
+
+Scripted message workloads for the bot benchmark. Each workload is a list of (channel name, text) pairs.
+"""
+
+import itertools
+
+from src import CHAN_ATTENDANCE
+
+# Channel that general chatter, commands and quips are sent in.
+CHAN_GENERAL = "general"
+
+
+def command_workload(count):
+    """
+    :param count: How many messages.
+    :return: A mix of cheap and api backed commands.
+    """
+    texts = itertools.cycle(["$db help", "$db version", "$db cancellations", "$db addquip that flam was clean"])
+    return [(CHAN_GENERAL, next(texts)) for _ in range(count)]
+
+
+def quip_workload(count):
+    """
+    :param count: How many messages.
+    :return: A storm of messages mentioning diddlebot.
+    """
+    return [(CHAN_GENERAL, "lol diddlebot say something #" + str(i)) for i in range(count)]
+
+
+def attendance_workload(count):
+    """
+    :param count: How many messages.
+    :return: Excuses for a rotating set of names and dates.
+    """
+    kinds = itertools.cycle(["absent", "late"])
+    return [(CHAN_ATTENDANCE, next(kinds) + " 3/" + str(i % 28 + 1) + " Drummer" + str(i % 25) + " Section " +
+             "car trouble") for i in range(count)]
+
+
+def chatter_workload(count):
+    """
+    :param count: How many messages.
+    :return: Messages diddlebot should ignore, to measure how quickly it rejects them.
+    """
+    return [(CHAN_GENERAL, "anyone know what time the bus leaves on saturday? #" + str(i)) for i in range(count)]
+
+
+# Every workload by the name it is reported under.
+WORKLOADS = [
+    ("chatter", chatter_workload),
+    ("command", command_workload),
+    ("quip", quip_workload),
+    ("attendance", attendance_workload),
+]
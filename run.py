@@ -3,8 +3,23 @@
 run.py
 An easy way to run diddlebot and ignore stupid ImportErrors.
 
+To run one shard of several: python run.py [shard id] [shard count]
+
 """
 
+import time
+
+# Noted first thing, so the startup time report includes the imports.
+started = time.perf_counter()
+
+import os
+import sys
+
+# The shard has to be known before src creates the client.
+if len(sys.argv) == 3:
+    os.environ["DIDDLEBOT_SHARD_ID"] = sys.argv[1]
+    os.environ["DIDDLEBOT_SHARD_COUNT"] = sys.argv[2]
+
 from src import diddlebot
 
-diddlebot.start()
+diddlebot.start(started)
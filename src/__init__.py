@@ -2,13 +2,24 @@
 File __init__.py
 """
 
+import os
+
 import discord
 
 # A version string that uniquely identifies the build.
 VERSION = '3/27/2019 11:01:13 AM'
 
+# Which shard this process is and how many there are. Every shard is its own process and discord gives each one
+# a share of the servers. Set with the DIDDLEBOT_SHARD_ID and DIDDLEBOT_SHARD_COUNT environment variables, or
+# the arguments to run.py.
+SHARD_ID = int(os.environ.get("DIDDLEBOT_SHARD_ID", "0"))
+SHARD_COUNT = int(os.environ.get("DIDDLEBOT_SHARD_COUNT", "1"))
+
 # Client object used for all discord calls
-client = discord.Client()
+if SHARD_COUNT > 1:
+    client = discord.Client(shard_id=SHARD_ID, shard_count=SHARD_COUNT)
+else:
+    client = discord.Client()
 
 # Channel name string of the eboard text channel.
 CHAN_EBOARD = "eboard"
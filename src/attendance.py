@@ -3,15 +3,24 @@ File attendance.py
 
 includes all of the functionality for attendance taking.
 
+A message can hold several excuses, one per line, and each can cover a range of dates. Excuses are acknowledged
+as soon as they are understood. Emailing and recording them is left to a pool of
+background workers, which edit the acknowledgement with the final status once they are done. All
+excuses from the same author go to the same worker, so they are recorded in the order they were sent.
+
 :author Sam Kuzio
 """
 
 from src import client, CHAN_ATTENDANCE, CHAN_DB_TEST
-from src import diddlemail
-from src.util import http_post
+from src import diddlemail, log, outbound, replica, scheduler, util
+from src.util import http_post, http_post_json
 
+import asyncio
+import collections
 import datetime
+import functools
 
+logger = log.get_logger("attendance")
 
 # How we expect people to format their dates.
 USER_DATE_FORMAT = "%m/%d"
@@ -23,12 +32,31 @@ DB_DATE_FORMAT = "%Y-%m-%d"
 FORMAT_HELP_TEXT = "This channel is used to get an absence/late arrival to practice excused and I couldn't " \
                    "understand your message. Type a message in the following format to be excused:\n\n" \
                    "[late/absent] [MM/DD or today/tonight] [First] [Last] <Optional Reason>\n\n" \
+                   "Use MM/DD-MM/DD to be excused for several days, and put each excuse on its own line to send " \
+                   "several at once.\n\n" \
                    "Example messages:\n" \
                    "Late 2/4 Paul Rennick\n" \
                    "absent 10/11 Sam Kuzio\n" \
                    "absent today George Hopkins I'm going to prison\n" \
                    "Late tonight Marc Garside Van broke down"
 
+# Reply for excuses that were understood but could not be recorded.
+FAILURE_TEXT = "I understood your message, but something went wrong while recording it. " \
+               "Tell someone to check my error log!"
+
+# The longest range of dates one excuse line may cover.
+MAX_RANGE_DAYS = 14
+
+# The most lines of a message that are read as excuses.
+MAX_EXCUSE_LINES = 20
+
+# The longest a piece of a message may be when it's repeated back in a reply. Together with MAX_EXCUSE_LINES this
+# keeps replies to one discord message, so the acknowledgement can be edited with the final status.
+MAX_ECHO_LENGTH = 40
+
+# ritdl-ws endpoint that records a list of excuses in one request.
+EXCUSE_BATCH_ENDPOINT = "/attendance/excuses"
+
 # Parsing string constants.
 ABSENT = "absent"
 LATE = "late"
@@ -39,112 +67,627 @@ TONIGHT = "tonight"
 EXCUSED = "excused"
 UNEXCUSED = "unexcused"
 
+# Number of background workers that email and record excuses.
+EXCUSE_WORKERS = 4
+
+# How many excuses may wait for each worker before new excuses have to wait to be queued.
+EXCUSE_QUEUE_SIZE = 50
+
+# Seconds a worker waits for an excuse's email before it edits the acknowledgement anyway. The email keeps
+# being sent in the background.
+EMAIL_ACK_TIMEOUT = 60
+
+# One queue per worker. Excuses are assigned to a queue by their author.
+_excuse_queues = []
+_excuse_workers = []
+
+# Set to False the first time ritdl-ws answers 404 to EXCUSE_BATCH_ENDPOINT.
+_batch_supported = True
+
+# When True, excuses are not emailed as they come in. They are collected per practice date and sent as one digest
+# email at that practice's cutoff. Excuses that come in after the cutoff, or for days without scheduled practice,
+# are still emailed right away.
+DIGEST_MODE = False
+
+# The time of day each practice's digest is sent, by weekday of the practice. Weekdays that aren't listed use
+# DIGEST_DEFAULT_CUTOFF. Saturday practice is in the morning, so its digest goes out before then.
+DIGEST_CUTOFFS = {5: "08:00"}
+DIGEST_DEFAULT_CUTOFF = "18:00"
+
+# How long to wait before trying a digest email again if it couldn't be sent.
+DIGEST_RETRY_DELAY = datetime.timedelta(minutes=5)
+
+# One excuse for one day. The date is a MM/DD string.
+Excuse = collections.namedtuple("Excuse", ["absence", "date", "first", "last", "reason"])
+
 
 async def excuse(message):
     """
     Handles an excuse message. This method assumes that the given message was sent to CHAN_ATTENDANCE!
+    A message may hold several excuses, one per line.
     :param message: The message to handle.
     :return:
     """
 
     # Parse the message data and metadata
     in_test_channel = message.channel.name == CHAN_DB_TEST
-    (absence, date, first, last, reason) = parse_message(message.content)
-
-    # Validate the message contents.
-    valid = absence is not None and date is not None and first is not None and last is not None
+    (accepted, rejected, ignored) = parse_excuses(message.content, in_test_channel)
 
-    if in_test_channel:
-        # When we're in the test channel we only want to handle messages that begin with absent/late
-        if absence is not None and valid:
-            await handle_valid_message(absence, date, first, last, reason, message.channel)
-        elif absence is not None and not valid:
-            await client.send_message(message.channel, FORMAT_HELP_TEXT)
+    # In the test channel, only lines that begin with absent/late are for diddlebot. Anywhere else a message with
+    # nothing in it to parse - an attachment, say - still gets the format help.
+    if not accepted and not rejected and in_test_channel:
+        return
 
-    # If we're in the attendance channel, we should handle the message normally without any special steps.
+    if not accepted:
+        await outbound.send_message(message.channel, FORMAT_HELP_TEXT)
     else:
-        if not valid:
-            await client.send_message(message.channel, FORMAT_HELP_TEXT)
-            return
+        await handle_valid_lines(accepted, rejected, message.channel, message.author, ignored)
+
+
+def parse_excuses(content, in_test_channel=False, today=None):
+    """
+    Parses every line of an excuse message.
+    :param content: The text of the message.
+    :param in_test_channel: Whether the message is from the test channel, where lines that don't begin with
+                            absent/late are skipped instead of rejected.
+    :param today: The date "today" and "tonight" refer to, if not the current date.
+    :return: A tuple of the accepted lines, as a list with a list of Excuses (one per day) for each line that was
+             understood, the rejected lines, as a list of the lines that weren't understood, and the number of lines
+             past MAX_EXCUSE_LINES that were ignored.
+    """
+
+    accepted = []
+    rejected = []
+
+    lines = [line.strip() for line in content.split("\n") if line.strip()]
+    for line in lines[:MAX_EXCUSE_LINES]:
+        (absence, date, first, last, reason) = parse_message(line, today)
+
+        # When we're in the test channel we only want to handle lines that begin with absent/late
+        if in_test_channel and absence is None:
+            continue
+
+        # Validate the line contents.
+        dates = expand_dates(date, (today or datetime.date.today()).year)
+        if absence is None or not dates or first is None or last is None:
+            rejected.append(line)
         else:
-            await handle_valid_message(absence, date, first, last, reason, message.channel)
+            accepted.append([Excuse(absence, day, first, last, reason) for day in dates])
+
+    return accepted, rejected, max(0, len(lines) - MAX_EXCUSE_LINES)
 
 
-async def handle_valid_message(absence, date, first, last, reason, channel):
+async def handle_valid_lines(accepted, rejected, channel, author, ignored=0):
     """
-    Given the parts of a valid message, attempts to take the correct actions to record the absence/tardy
-    :param absence: Absent/Late string
-    :param date: The date of the absence
-    :param first: First name
-    :param last: Last name
-    :param reason: Reason, or none
+    Given the excuses in a message, acknowledges them in one reply and queues the work to record them.
+    :param accepted: A list with a list of Excuses (one per day) for each line that was understood.
+    :param rejected: A list of the lines that weren't understood.
     :param channel: the channel the attendance message was received in.
+    :param author: the user who sent the attendance message.
+    :param ignored: The number of lines that were ignored for being past MAX_EXCUSE_LINES.
     :return: None
     """
 
-    email_sent = send_excuse_email(first, last, absence, date, reason)
-    data_posted = add_excuse_record(absence, date, first, last, reason)
+    # The acknowledgement is edited later, so it mustn't be merged with other messages. The excuses are recorded
+    # even if it can't be sent.
+    try:
+        ack = await outbound.send_message(channel, describe_lines(accepted, rejected, ignored=ignored),
+                                          coalesce=False)
+    except Exception as e:
+        logger.warning("could not send acknowledgement", guild=log.guild_of(channel), error=repr(e))
+        ack = None
+
+    if not _excuse_queues:
+        start_excuse_workers()
+
+    # Always use the same queue for the same author, so their excuses are handled in order.
+    queue = _excuse_queues[hash(author.id) % len(_excuse_queues)]
+    await queue.put((accepted, rejected, ignored, ack))
+
+
+def _clip(text):
+    """
+    :param text: Text from a message.
+    :return: The text, shortened to MAX_ECHO_LENGTH characters if it's longer.
+    """
+
+    return text if len(text) <= MAX_ECHO_LENGTH else text[:MAX_ECHO_LENGTH - 3] + "..."
+
+
+def describe_lines(accepted, rejected, statuses=None, ignored=0):
+    """
+    Builds the reply to an excuse message, with a line of feedback for each line of the message. Text repeated
+    from the message is clipped, so the reply always fits in one discord message.
+    :param accepted: A list with a list of Excuses for each line that was understood.
+    :param rejected: A list of the lines that weren't understood.
+    :param statuses: A list with whether each accepted line was recorded, or None if they're still being recorded.
+    :param ignored: The number of lines that were ignored for being past MAX_EXCUSE_LINES.
+    :return: The reply text.
+    """
+
+    def dates_of(excuses):
+        return excuses[0].date if len(excuses) == 1 else excuses[0].date + "-" + excuses[-1].date
+
+    # The simple case of one excuse gets one sentence.
+    if len(accepted) == 1 and not rejected and not ignored:
+        excuses = accepted[0]
+        (absence, date, first, last, reason) = excuses[0]
+        name = _clip(first + " " + last)
+        if statuses is None:
+            return "Got it! Recording " + name + "'s excuse for " + dates_of(excuses) + "..."
+        elif not statuses[0]:
+            return FAILURE_TEXT
+        else:
+            return "Got it! " + name + " will be excused on " + dates_of(excuses) + " with " + \
+                   ("no reason given" if reason is None else "reason '" + _clip(reason) + "'")
+
+    lines = ["Got it! Here's what I understood:"]
+    for (index, excuses) in enumerate(accepted):
+        name = _clip(excuses[0].first + " " + excuses[0].last)
+        if statuses is None:
+            lines.append("- Recording " + name + " " + excuses[0].absence + " on " + dates_of(excuses) + "...")
+        elif statuses[index]:
+            lines.append("- " + name + " will be excused on " + dates_of(excuses))
+        else:
+            lines.append("- I couldn't record " + name + " on " + dates_of(excuses) + " - check my error log!")
+
+    for line in rejected:
+        lines.append("- I couldn't understand '" + _clip(line) + "'")
+
+    if ignored:
+        lines.append("- I only read the first " + str(MAX_EXCUSE_LINES) + " lines, so I ignored the other " +
+                     str(ignored) + ". Send them in another message.")
+
+    if rejected:
+        lines.append("Use [late/absent] [MM/DD, MM/DD-MM/DD or today] [First] [Last] <Optional Reason> on each line.")
+
+    # Only very long names on every line get this far, but an edit longer than discord allows would fail.
+    text = "\n".join(lines)
+    if len(text) > outbound.MAX_MESSAGE_LENGTH:
+        text = text[:outbound.MAX_MESSAGE_LENGTH - 3] + "..."
+
+    return text
+
+
+def start_excuse_workers():
+    """
+    Starts the background workers that record excuses.
+    :return: None
+    """
+
+    for _ in range(EXCUSE_WORKERS):
+        queue = asyncio.Queue(maxsize=EXCUSE_QUEUE_SIZE)
+        _excuse_queues.append(queue)
+        _excuse_workers.append(asyncio.ensure_future(run_excuse_worker(queue)))
+
+
+async def run_excuse_worker(queue):
+    """
+    Records the excuse messages in the given queue one at a time, forever.
+    :param queue: The queue of (accepted, rejected, ignored, acknowledgement message or None) tuples to handle.
+    :return: None
+    """
+
+    while True:
+        (accepted, rejected, ignored, ack) = await queue.get()
+        try:
+            await record_excuses(accepted, rejected, ack, ignored)
+        except Exception:
+            logger.exception("failed to record excuses", excuses=accepted, guild=log.guild_of(ack))
+            await _edit_quietly(ack, describe_lines(accepted, rejected, [False] * len(accepted), ignored))
+        finally:
+            queue.task_done()
+
+
+async def _edit_quietly(ack, text):
+    """
+    Edits an acknowledgement, only logging if that fails.
+    :param ack: The acknowledgement message, or None if it couldn't be sent, in which case there is nothing to edit.
+    :param text: The new text.
+    :return: None
+    """
+
+    if ack is None:
+        return
+
+    try:
+        await client.edit_message(ack, text)
+    except Exception as e:
+        logger.warning("could not edit acknowledgement", error=repr(e))
+
+
+async def record_excuses(accepted, rejected, ack, ignored=0):
+    """
+    Emails and records the excuses from one message, then edits its acknowledgement with how that went.
+    All of the excuses are written in one batch and covered by one email.
+    :param accepted: A list with a list of Excuses for each line that was understood.
+    :param rejected: A list of the lines that weren't understood.
+    :param ack: The acknowledgement message that was sent for the excuses, or None if it couldn't be sent.
+    :param ignored: The number of lines that were ignored for being past MAX_EXCUSE_LINES.
+    :return: None
+    """
+
+    excuses = [excuse for line in accepted for excuse in line]
+
+    email_sent = queue_excuses_email(excuses)
+    try:
+        posted = await add_excuse_records(excuses)
+    finally:
+        email_sent = await _wait_for_email(email_sent)
+
+    # A line only counts as recorded if every one of its days was.
+    statuses = []
+    index = 0
+    for line in accepted:
+        statuses.append(email_sent and all(posted[index:index + len(line)]))
+        index += len(line)
+
+    await _edit_quietly(ack, describe_lines(accepted, rejected, statuses, ignored))
+
+
+async def _wait_for_email(email_sent):
+    """
+    Waits up to EMAIL_ACK_TIMEOUT seconds for excuses to be emailed, so a slow mail server can't hold up the
+    excuse workers.
+    :param email_sent: The future from queue_excuses_email.
+    :return: Its result, or True if the email is still on its way. A failure after that is logged by the outbox.
+    """
+
+    try:
+        return await asyncio.wait_for(asyncio.shield(email_sent), EMAIL_ACK_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning("excuse email is still being sent, not waiting for it", timeout=EMAIL_ACK_TIMEOUT)
+        return True
+
+
+def queue_excuses_email(excuses):
+    """
+    Emails excuses, or in DIGEST_MODE adds them to their practices' digests. Returns without waiting for
+    anything to be sent.
+    :param excuses: A list of Excuses.
+    :return: A future whose result is True iff the excuses were emailed or added to a digest, false otherwise.
+    """
+
+    if not DIGEST_MODE:
+        return send_excuses_email(excuses)
+
+    now = datetime.datetime.now()
+    later = []
+    right_away = []
+    for excuse in excuses:
+        # Days without scheduled practice have no digest. Practice may still be held that day - an extra one, or
+        # one that gets uncancelled - so those are emailed right away too.
+        day = excuse_day(excuse.date)
+        (later if util.is_practice_on(day) and digest_cutoff(day) > now else right_away).append(excuse)
+
+    futures = []
+    if later:
+        futures.append(asyncio.ensure_future(add_to_digests(later)))
+    if right_away:
+        futures.append(send_excuses_email(right_away))
+
+    return asyncio.ensure_future(_all_succeeded(futures))
+
+
+async def _all_succeeded(futures):
+    """
+    :param futures: A list of futures whose results are True or False.
+    :return: True iff every one of the futures succeeded.
+    """
+
+    return all(await asyncio.gather(*futures))
+
+
+def excuse_day(date):
+    """
+    :param date: A MM/DD date string - year will be assumed to be the current year.
+    :return: The date.
+    """
+
+    return datetime.datetime.strptime(date, USER_DATE_FORMAT).replace(year=datetime.date.today().year).date()
 
-    if not email_sent or not data_posted:
-        await client.send_message(channel, "I understood your message, but something went wrong "
-                                             "while recording it. Tell someone to check my error log!")
-    else:
-        await client.send_message(channel, "Got it! " + first + " " + last + " will be excused on " + date +
-                            " with " + ("no reason given" if reason is None else "reason '" + reason + "'"))
+
+def digest_cutoff(day):
+    """
+    :param day: The date of a practice.
+    :return: The datetime at which the practice's digest is sent.
+    """
+
+    cutoff = datetime.datetime.strptime(DIGEST_CUTOFFS.get(day.weekday(), DIGEST_DEFAULT_CUTOFF), "%H:%M").time()
+    return datetime.datetime.combine(day, cutoff)
+
+
+async def add_to_digests(excuses):
+    """
+    Adds excuses to the digests of their practices, and schedules each digest to be sent.
+    :param excuses: A list of Excuses.
+    :return: True iff the excuses were added, false otherwise.
+    """
+
+    by_day = collections.defaultdict(list)
+    for excuse in excuses:
+        by_day[excuse_day(excuse.date)].append(list(excuse))
+
+    try:
+        for (day, day_excuses) in by_day.items():
+            await replica.add_to_digest(day.strftime(DB_DATE_FORMAT), day_excuses)
+            schedule_digest(day)
+    except Exception:
+        logger.exception("could not add excuses to a digest")
+        return False
+
+    return True
+
+
+def schedule_digest(day, at=None):
+    """
+    Schedules the digest for a practice. A digest that is already scheduled is moved to the new time.
+    :param day: The date of the practice.
+    :param at: The datetime to send the digest, or None for the practice's cutoff. Times that have passed mean
+               one second from now.
+    :return: None
+    """
+
+    if at is None:
+        at = digest_cutoff(day)
+    at = max(at, datetime.datetime.now() + datetime.timedelta(seconds=1))
+
+    scheduler.add_job("excuse digest " + day.strftime(DB_DATE_FORMAT), scheduler.Once(at),
+                      functools.partial(send_digest, day))
+
+
+async def schedule_pending_digests():
+    """
+    Schedules the digests that were waiting when diddlebot last stopped. Digests whose cutoff passed while
+    diddlebot was down are sent right away.
+    :return: None
+    """
+
+    for date in await replica.digest_dates():
+        schedule_digest(datetime.datetime.strptime(date, DB_DATE_FORMAT).date())
+
+
+async def send_digest(day):
+    """
+    Emails every excuse waiting for a practice's digest in one email, sorted by type and name. The excuses are
+    only dropped from the replica once the email is sent, and if it can't be sent the digest is tried again later.
+    :param day: The date of the practice.
+    :return: None
+    """
+
+    date = day.strftime(DB_DATE_FORMAT)
+    rows = await replica.digest_excuses(date)
+    if not rows:
+        return
+
+    excuses = sorted((Excuse(*excuse) for (_, excuse) in rows), key=lambda e: (e.absence, e.last, e.first))
+
+    subject = "Excuses for practice on " + day.strftime(USER_DATE_FORMAT) + " (" + str(len(excuses)) + ")"
+
+    message = "Hello,\n\nThe following people will be absent or late to practice on " + \
+              day.strftime("%A ") + day.strftime(USER_DATE_FORMAT) + ":\n\n"
+    for (absence, _, first, last, reason) in excuses:
+        message += "- " + first + " " + last + " will be " + absence + " because: " + \
+                   (reason if reason else "<no reason given>") + "\n"
+    message += "\nSincerely,\nDiddlebot"
+
+    if not await diddlemail.queue_email_to_club(message, subject):
+        logger.warning("could not send the excuse digest, trying again later", date=date,
+                       retry_in=DIGEST_RETRY_DELAY)
+        schedule_digest(day, datetime.datetime.now() + DIGEST_RETRY_DELAY)
+        return
+
+    await replica.forget_digest([digest_id for (digest_id, _) in rows])
+
+
+def send_excuses_email(excuses):
+    """
+    Queues one email covering all of the given excuses. Returns without waiting for the email to be sent.
+    :param excuses: A list of Excuses.
+    :return: A future whose result is True iff sending of the email succeeded, false otherwise.
+    """
+
+    if len(excuses) == 1:
+        (absence, date, first, last, reason) = excuses[0]
+        return send_excuse_email(first, last, absence, date, reason)
+
+    subject = str(len(excuses)) + " absences/late arrivals"
+
+    message = "Hello,\n\nThe following people will be absent or late:\n\n"
+    for (absence, date, first, last, reason) in sorted(excuses, key=lambda e: (e.date, e.last, e.first)):
+        message += "- " + first + " " + last + " will be " + absence + " on " + date + " because: " + \
+                   (reason if reason else "<no reason given>") + "\n"
+    message += "\nSincerely,\nDiddlebot"
+
+    return diddlemail.queue_email_to_club(message, subject)
 
 
 def send_excuse_email(first, last, absence, date, reason):
     """
-    Attempts to send the attendance excuse email.
+    Queues the attendance excuse email. Returns without waiting for the email to be sent.
     :param first: The first name
     :param last: The last name
     :param absence: Whether they are late/absent
     :param date: date string on which the person will be absent
     :param reason: A reason they may have given.
-    :return: True iff sending of the email succeeded, false otherwise.
+    :return: A future whose result is True iff sending of the email succeeded, false otherwise.
     """
     subject = first + " " + last + " " + ("late arrival" if absence == LATE else "absence") + " on " + date
 
     message = "Hello,\n\n" + first + " " + last + " will be " + absence + " on " + date + " because:\n" + \
               (reason if reason else "<no reason given>") + "\n\nSincerely,\nDiddlebot"
 
-    return diddlemail.send_email_to_club(message, subject)
+    return diddlemail.queue_email_to_club(message, subject)
 
 
-def add_excuse_record(absence_type, date, first, last, reason):
+def excuse_record(absence_type, date, first, last, reason, year=None):
     """
-    Adds a record to the database for an excuse.
+    Formats an excuse for the database.
     :param absence_type: The type of excuse - late/absent
-    :param date: The date on which the excuse is for - formatted as MM/DD - year will be assumed to be the current year.
+    :param date: The date on which the excuse is for - formatted as MM/DD.
     :param first: The first name
     :param last: The last name
     :param reason: The reason, or None if no reason was given.
-    :return: True iff the excuse record was created.
+    :param year: The year of the date, if not the current year.
+    :return: A dict of the fields ritdl-ws expects for an excuse.
     """
 
-    # Format some of the fields for easy db insertion later.
     name = first + " " + last
     date = datetime.datetime.strptime(date, USER_DATE_FORMAT)\
-        .replace(year=datetime.date.today().year).strftime(DB_DATE_FORMAT)
+        .replace(year=year or datetime.date.today().year).strftime(DB_DATE_FORMAT)
+
+    return {"absence_type": absence_type, "name": name, "date": date, "reason": reason}
+
+
+async def add_excuse_records(excuses):
+    """
+    Adds records to the database for several excuses in one request. If ritdl-ws can't be reached, the records
+    are journaled in the local replica instead, and pushed by push_journal once it is back.
+    :param excuses: A list of Excuses.
+    :return: A list with True for every excuse record that was created or journaled and False for every one that
+             wasn't.
+    """
+
+    return await save_excuse_records([excuse_record(*excuse) for excuse in excuses])
+
+
+async def save_excuse_records(records):
+    """
+    Posts excuse records to ritdl-ws, or journals them in the local replica if ritdl-ws can't be reached.
+    :param records: A list of excuse record dicts, as made by excuse_record.
+    :return: A list with True for every excuse record that was created or journaled and False for every one that
+             wasn't.
+    """
+
+    try:
+        results = await post_excuse_records(records)
+    except OSError as e:
+        logger.warning("ritdl-ws is unreachable", error=repr(e))
+        results = [None] * len(records)
+
+    # Only the records that never reached ritdl-ws are journaled, so none of them are pushed twice.
+    unreachable = [record for (record, result) in zip(records, results) if result is None]
+    if unreachable:
+        logger.warning("journaling excuses", count=len(unreachable))
+        await replica.journal_excuses(unreachable)
+
+    return [result is not False for result in results]
+
+
+async def post_excuse_records(records):
+    """
+    Posts excuse records to ritdl-ws in one request. Falls back on one request per excuse if ritdl-ws doesn't
+    have the batch endpoint.
+    :param records: A list of excuse record dicts, as made by excuse_record.
+    :return: A list with True for every excuse record that was created, False for every one ritdl-ws refused and
+             None for every one that couldn't be sent because ritdl-ws couldn't be reached.
+    :raises OSError: If ritdl-ws couldn't be reached for the batch request, so none of them were sent.
+    """
+
+    global _batch_supported
+
+    if _batch_supported:
+        post_data = {"excuses": records}
+        res = await http_post_json(EXCUSE_BATCH_ENDPOINT, post_data)
+
+        if res.status_code == 200:
+            return [True] * len(records)
+        elif res.status_code == 404:
+            logger.info("batch endpoint is not available, falling back to one request per excuse",
+                        endpoint=EXCUSE_BATCH_ENDPOINT)
+            _batch_supported = False
+        else:
+            logger.error("unexpected status code", endpoint=EXCUSE_BATCH_ENDPOINT, status=res.status_code,
+                         body=res.content.decode("utf-8"), data=post_data)
+            return [False] * len(records)
+
+    return list(await asyncio.gather(*[_post_if_reachable(record) for record in records]))
+
+
+async def _post_if_reachable(post_data):
+    """
+    Posts a single excuse record to ritdl-ws.
+    :param post_data: An excuse record dict, as made by excuse_record.
+    :return: True iff the excuse record was created, or None if ritdl-ws couldn't be reached.
+    """
+
+    try:
+        return await post_excuse_record(post_data)
+    except OSError as e:
+        logger.info("could not post excuse, ritdl-ws is unreachable", error=repr(e), sample=0.1)
+        return None
+
+
+async def push_journal():
+    """
+    Pushes the excuses that were journaled while ritdl-ws was unreachable.
+    :return: The number of excuses that were pushed.
+    """
+
+    pending = await replica.pending_excuses()
+    if not pending:
+        return 0
+
+    results = await post_excuse_records([record for (_, record) in pending])
+    pushed = [journal_id for ((journal_id, _), created) in zip(pending, results) if created]
+    await replica.forget_excuses(pushed)
+
+    logger.info("pushed journaled excuses", pushed=len(pushed), pending=len(pending))
+    return len(pushed)
+
+
+async def post_excuse_record(post_data):
+    """
+    Posts a single excuse record to ritdl-ws.
+    :param post_data: An excuse record dict, as made by excuse_record.
+    :return: True iff the excuse record was created.
+    """
 
     # POST it to the web service which manages the database.
-    post_data = {"absence_type": absence_type, "name": name, "date": date, "reason": reason}
-    res = http_post('/attendance/excuse', post_data)
+    res = await http_post('/attendance/excuse', post_data)
 
     # Handle the post response, failing if something went wrong.
     if res.status_code == 200:
         return True
     else:
-        print("attendance: unexpected status code " + res.status_code + " posting /api/attendance/excuse: " +
-              res.content.decode("utf-8") + "\nData submitted = " + str(post_data))
+        logger.error("unexpected status code", endpoint="/attendance/excuse", status=res.status_code,
+                     body=res.content.decode("utf-8"), data=post_data)
         return False
 
 
-def parse_message(text):
+def expand_dates(date, year=None):
+    """
+    Turns the date from a parsed message into the days it covers.
+    :param date: A MM/DD string, a MM/DD-MM/DD range, or None.
+    :param year: The year of the dates, if not the current year.
+    :return: A list of MM/DD strings, one per day, or an empty list if the date is missing, backwards or covers
+             more than MAX_RANGE_DAYS days.
+    """
+
+    if date is None:
+        return []
+
+    if "-" not in date:
+        return [date]
+
+    year = year or datetime.date.today().year
+    (start, end) = [datetime.datetime.strptime(part, USER_DATE_FORMAT).date().replace(year=year)
+                    for part in date.split("-", 1)]
+
+    days = (end - start).days + 1
+    if days < 1 or days > MAX_RANGE_DAYS:
+        return []
+
+    return [(start + datetime.timedelta(days=offset)).strftime(USER_DATE_FORMAT) for offset in range(days)]
+
+
+def parse_message(text, today=None):
     """
     Parses the contents of an absence message.
     :param text: The text of a message
-    :return: A tuple containing the type of absence, the date, the firstname, lastname and reason.
+    :param today: The date "today" and "tonight" refer to, if not the current date.
+    :return: A tuple containing the type of absence, the date, the firstname, lastname and reason. The date is a
+             MM/DD string, or a MM/DD-MM/DD string for a range of dates.
     """
 
     parts = text.split()
@@ -166,7 +709,15 @@ def parse_message(text):
     if len(parts) >= 2:
         # If they said today/tonight, turn that into MM/DD
         if parts[1].lower() == TODAY or parts[1].lower() == TONIGHT:
-            date = datetime.date.today().strftime(USER_DATE_FORMAT)
+            date = (today or datetime.date.today()).strftime(USER_DATE_FORMAT)
+
+        # A range of dates, like 3/4-3/8
+        elif "-" in parts[1]:
+            try:
+                date = "-".join(datetime.datetime.strptime(part, USER_DATE_FORMAT).strftime(USER_DATE_FORMAT)
+                                for part in parts[1].split("-", 1))
+            except ValueError:
+                date = None
 
         # Otherwise try to parse the time they gave as a MM/DD string.
         else:
@@ -0,0 +1,240 @@
+"""
+File backfill.py
+
+Rebuilds excuse records in ritdl-ws from the history of the attendance channel, for when the database loses
+data or is seeded for a new semester. History is read one page at a time, oldest first, and every message is
+parsed the same way a live excuse is. Excuses that ritdl-ws already has are skipped, and the rest are written
+in batches, a few at a time. After every page the id of the last message is saved to a checkpoint file, so a
+backfill that stops part way picks up where it left off.
+"""
+
+import asyncio
+import datetime
+import json
+import os
+
+import discord
+
+from src import client, attendance, replica, util
+
+# How many messages are read from discord at a time.
+PAGE_SIZE = 100
+
+# How many excuses go in one write, and how many writes may be in flight at once.
+BATCH_SIZE = 25
+WRITE_CONCURRENCY = 4
+
+# Where the checkpoints are kept, in the current working directory. It maps channel ids to the id of the last
+# message that was backfilled.
+CHECKPOINT_FILE = "backfill_checkpoint.json"
+
+# The running backfill, if any.
+_backfill_task = None
+
+# Why backfill can't run against a ritdl-ws that doesn't list excuses.
+_NO_LISTING_TEXT = "ritdl-ws can't list the excuses it has (404 from " + attendance.EXCUSE_BATCH_ENDPOINT + \
+                   "), so I can't tell which ones are missing - not backfilling, so nothing is recorded twice"
+
+# Set to False the first time ritdl-ws answers 404 to the excuse listing, attendance.EXCUSE_BATCH_ENDPOINT.
+_listing_supported = True
+
+
+class BackfillError(Exception):
+    """
+    Raised when a backfill can't go on, including when ritdl-ws or discord can't be reached. Everything up to
+    the last checkpoint has been written.
+    """
+    pass
+
+
+def is_running():
+    """
+    :return: True iff a backfill is running.
+    """
+
+    return _backfill_task is not None and not _backfill_task.done()
+
+
+def start_backfill(channel, restart=False):
+    """
+    Starts backfilling from a channel in the background.
+    :param channel: The attendance Channel to read history from.
+    :param restart: Whether to ignore the checkpoint and start from the beginning of the semester.
+    :return: The backfill task, whose result is the number of messages read and excuses written.
+    """
+
+    global _backfill_task
+
+    _backfill_task = asyncio.ensure_future(backfill(channel, restart))
+    return _backfill_task
+
+
+async def backfill(channel, restart=False):
+    """
+    Backfills excuse records from a channel's history.
+    :param channel: The attendance Channel to read history from.
+    :param restart: Whether to ignore the checkpoint and start from the beginning of the semester.
+    :return: A tuple of the number of messages read and the number of excuses written.
+    """
+
+    checkpoints = load_checkpoints()
+    if restart:
+        checkpoints.pop(channel.id, None)
+
+    if channel.id in checkpoints:
+        after = discord.Object(id=checkpoints[channel.id])
+    else:
+        after = datetime.datetime.combine(util.SEMESTER_START_DATE, datetime.time())
+
+    existing = await get_existing_excuses()
+    limit = asyncio.Semaphore(WRITE_CONCURRENCY)
+
+    read = 0
+    written = 0
+
+    while True:
+        page = await _fetch_page(channel, after)
+        if not page:
+            break
+
+        records = []
+        for message in page:
+            if message.author == client.user:
+                continue
+
+            # Dates in the message mean the day and year it was sent where the club is, not in UTC.
+            sent_on = local_date(message.timestamp)
+            (accepted, _, _) = attendance.parse_excuses(message.content, today=sent_on)
+            for excuse in [excuse for line in accepted for excuse in line]:
+                record = attendance.excuse_record(*excuse, year=sent_on.year)
+                key = _record_key(record)
+                if key not in existing:
+                    existing.add(key)
+                    records.append(record)
+
+        batches = [records[i:i + BATCH_SIZE] for i in range(0, len(records), BATCH_SIZE)]
+        results = await asyncio.gather(*[_write_batch(batch, limit) for batch in batches])
+
+        failed = sum(result.count(False) for result in results)
+        if failed:
+            raise BackfillError(str(failed) + " excuses could not be written - stopped after " + str(read) +
+                                " messages, run the backfill again to retry")
+
+        read += len(page)
+        written += len(records)
+
+        after = page[-1]
+        checkpoints[channel.id] = after.id
+        save_checkpoints(checkpoints)
+
+    return read, written
+
+
+async def _fetch_page(channel, after):
+    """
+    Reads the next page of a channel's history.
+    :param channel: The Channel.
+    :param after: The Message (or discord.Object) to read after, or a datetime.
+    :return: A list of up to PAGE_SIZE Messages, oldest first.
+    """
+
+    page = []
+    try:
+        async for message in client.logs_from(channel, limit=PAGE_SIZE, after=after):
+            page.append(message)
+    except discord.HTTPException as e:
+        raise BackfillError("Couldn't read the channel history from discord (" + str(e) + ") - run the backfill "
+                            "again to pick up where it stopped")
+
+    page.sort(key=lambda message: message.timestamp)
+    return page
+
+
+async def _write_batch(batch, limit):
+    """
+    Writes a batch of excuse records once there is room for another write.
+    :param batch: A list of excuse record dicts.
+    :param limit: The Semaphore that bounds how many writes are in flight.
+    :return: A list with True for every excuse that was written and False for every one that wasn't.
+    """
+
+    async with limit:
+        return await attendance.save_excuse_records(batch)
+
+
+async def get_existing_excuses():
+    """
+    Gets the excuses ritdl-ws already has or will have, so they aren't written twice. Only excuses from the
+    semester on are kept, since backfilled excuses can't be any older.
+    :return: A set of (absence type, name, YYYY-MM-DD date) tuples.
+    """
+
+    global _listing_supported
+
+    if not _listing_supported:
+        raise BackfillError(_NO_LISTING_TEXT)
+
+    try:
+        # A plain GET rather than http_get_json, so the listing isn't kept around for conditional GETs.
+        res = await util.http_get(attendance.EXCUSE_BATCH_ENDPOINT)
+    except OSError as e:
+        raise BackfillError("Couldn't reach ritdl-ws (" + str(e) + ") - not backfilling, so nothing is recorded "
+                            "twice")
+
+    if res.status_code == 404:
+        _listing_supported = False
+        raise BackfillError(_NO_LISTING_TEXT)
+    if res.status_code != 200:
+        raise BackfillError("Couldn't get the existing excuses from ritdl-ws (status " + str(res.status_code) +
+                            ") - not backfilling, so nothing is recorded twice")
+
+    start = util.SEMESTER_START_DATE.strftime(attendance.DB_DATE_FORMAT)
+    existing = set(_record_key(record) for record in json.loads(res.content.decode("utf-8"))
+                   if record["date"] >= start)
+
+    # Excuses journaled while ritdl-ws was down will be pushed soon, so they count as existing too.
+    existing.update(_record_key(record) for (_, record) in await replica.pending_excuses())
+    return existing
+
+
+def _record_key(record):
+    """
+    :param record: An excuse record dict.
+    :return: The record as a (absence type, name, YYYY-MM-DD date) tuple, to compare with existing records.
+    """
+
+    return record["absence_type"], record["name"], record["date"]
+
+
+def local_date(timestamp):
+    """
+    :param timestamp: A naive UTC datetime, like Message.timestamp.
+    :return: The date it was in the local time zone.
+    """
+
+    return timestamp.replace(tzinfo=datetime.timezone.utc).astimezone().date()
+
+
+def load_checkpoints():
+    """
+    :return: A dict of channel ids to the id of the last message that was backfilled.
+    """
+
+    try:
+        with open(CHECKPOINT_FILE, 'r') as checkpoint_file:
+            return json.load(checkpoint_file)
+    except FileNotFoundError:
+        return {}
+
+
+def save_checkpoints(checkpoints):
+    """
+    Saves the checkpoints.
+    :param checkpoints: A dict of channel ids to the id of the last message that was backfilled.
+    :return: None
+    """
+
+    # Write a new file and swap it in, so a crash never leaves a half written checkpoint.
+    with open(CHECKPOINT_FILE + ".tmp", 'w') as checkpoint_file:
+        json.dump(checkpoints, checkpoint_file)
+    os.replace(CHECKPOINT_FILE + ".tmp", CHECKPOINT_FILE)
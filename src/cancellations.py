@@ -3,13 +3,20 @@ File cancellations.py
 
 Contains methods for handling practice cancellations.
 
+Cancellations are answered from a local copy that is reloaded from ritdl-ws in the background, and kept in the
+local replica so there is something to answer from right after a restart or while ritdl-ws is down.
+
 :author Sam Kuzio
 """
 
+import asyncio
+import bisect
 import datetime
-import json
+import time
+
+from src import CHAN_ANNOUNCEMENTS, log, outbound, util, state, replica
 
-from src import client, CHAN_ANNOUNCEMENTS, util
+logger = log.get_logger("cancellations")
 
 # Help text for the cancellation commands.
 CANCEL_HELP_TEXT = "usage: $db cancel YYYY-MM-DD\n\nThis cancels practice on the given date. Dates must be zero-" \
@@ -21,6 +28,33 @@ UNCANCEL_HELP_TEXT = "usage: $db cancel YYYY-MM-DD\n\nThis uncancels practice on
 # The format we expect dates in.
 DATE_FORMAT = "%Y-%m-%d"
 
+# How long, in seconds, the local copy of the cancellations is trusted before it is reloaded from ritdl-ws.
+CACHE_TTL = 300
+
+# When True, a stale local copy keeps answering questions while a reload runs in the background, so a slow
+# ritdl-ws never holds up a reminder or command. When False, a stale copy is reloaded before answering.
+STALE_WHILE_REVALIDATE = True
+
+# Sorted list of the cancelled dates as DATE_FORMAT strings, or None until it has been loaded once.
+# DATE_FORMAT strings sort in date order, so they can be searched with bisect.
+_cancelled_dates = None
+
+# time.monotonic() of the last successful load of _cancelled_dates.
+_loaded_at = 0
+
+# The reload in progress, if any. Concurrent readers share it rather than starting their own.
+_refresh_task = None
+
+# Shared state key counting changes to the cancellations made by any shard, and its value when the local copy
+# was loaded. When another shard changes a cancellation the count moves on and the local copy is reloaded.
+VERSION_KEY = "cancellations:version"
+_loaded_version = 0
+
+# Changes made by this bot, as date -> (write number, cancelled). A reload that started before one of these
+# writes may not include it, so they are replayed on top of every reload.
+_recent_writes = {}
+_write_count = 0
+
 
 def parse_date(date):
     """
@@ -34,170 +68,352 @@ def parse_date(date):
         return None
 
 
-def get_cancellations():
+async def refresh_cancellations():
+    """
+    Reloads the local copy of the cancellations from ritdl-ws in a single bulk request.
+    :return: True iff the cancellations were reloaded.
+    """
+
+    global _cancelled_dates
+    global _loaded_at
+    global _loaded_version
+
+    started_at = _write_count
+    version = await state.get(VERSION_KEY) or 0
+    (res, dates) = await util.http_get_json('/cancellations')
+
+    if dates is not None:
+        _cancelled_dates = sorted(set(dates))
+        _loaded_at = time.monotonic()
+        _loaded_version = version
+        util.set_cancelled_days(_to_days(_cancelled_dates))
+
+        for date, (write, cancelled) in list(_recent_writes.items()):
+            if write > started_at:
+                _apply_cached(date, cancelled)
+            else:
+                del _recent_writes[date]
+
+        # A 304 means ritdl-ws has nothing new since the replica was last saved.
+        if res.status_code != 304:
+            await replica.save_cancellations(_cancelled_dates)
+        return True
+    else:
+        logger.error("unexpected status code", endpoint="/cancellations", status=res.status_code,
+                     body=res.content.decode("utf-8"))
+        return False
+
+
+def start_refresh():
+    """
+    Starts a reload of the cancellations unless one is already running.
+    :return: The task (future) doing the reload.
+    """
+
+    global _refresh_task
+
+    if _refresh_task is None or _refresh_task.done():
+        _refresh_task = asyncio.ensure_future(refresh_cancellations())
+        _refresh_task.add_done_callback(_report_refresh_error)
+
+    return _refresh_task
+
+
+def _report_refresh_error(task):
+    """
+    Done callback for reloads, so that a failed background reload still gets logged.
+    :param task: The finished reload task.
+    :return: None
+    """
+
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("failed to reload cancellations", error=repr(task.exception()))
+
+
+async def load_cancellations():
+    """
+    Makes sure the local copy of the cancellations is usable, reloading it if it has expired.
+    :return: True iff there is a local copy to answer from.
+    """
+
+    # Start from the replica, which is treated as stale so it gets reloaded.
+    if _cancelled_dates is None:
+        await load_local_cancellations()
+
+    # A copy from before another shard changed something is never good enough.
+    usable = _cancelled_dates is not None and (await state.get(VERSION_KEY) or 0) == _loaded_version
+
+    if usable and time.monotonic() - _loaded_at < CACHE_TTL:
+        return True
+
+    # Stale but present: answer from what we have and reload behind the scenes.
+    if usable and STALE_WHILE_REVALIDATE:
+        start_refresh()
+        return True
+
+    # If ritdl-ws can't be reached, whatever copy there is will have to do.
+    try:
+        await asyncio.shield(start_refresh())
+    except OSError as e:
+        logger.warning("could not reload cancellations, answering from the local copy", error=repr(e))
+
+    return _cancelled_dates is not None
+
+
+async def load_local_cancellations():
+    """
+    Fills the local copy of the cancellations from the replica, if the replica has them.
+    :return: True iff the local copy was filled.
+    """
+
+    global _cancelled_dates
+    global _loaded_at
+    global _loaded_version
+
+    dates = await replica.load_cancellations()
+
+    # A reload may have finished while the replica was being read.
+    if dates is None or _cancelled_dates is not None:
+        return False
+
+    _cancelled_dates = dates
+    _loaded_at = -CACHE_TTL
+    _loaded_version = await state.get(VERSION_KEY) or 0
+    util.set_cancelled_days(_to_days(_cancelled_dates))
+    return True
+
+
+async def get_cancellations():
     """
     Gets a list of all of the cancellations.
     :return: A list of all the dates on which practice is cancelled. Dates in this list are Strings.
     """
 
-    res = util.http_get('/cancellations')
-
-    if res.status_code == 200:
-        return json.loads(res.content.decode("utf-8"))
-    else:
-        print("Something went wrong when getting /api/cancellations: " +
-              str(res.status_code) + "\n" + res.content.decode("utf-8"))
+    if not await load_cancellations():
         return None
 
+    return list(_cancelled_dates)
+
+
+def _set_cached(date, cancelled):
+    """
+    Updates the local copy of the cancellations after a successful change in ritdl-ws.
+    :param date: A string in the format DATE_FORMAT.
+    :param cancelled: Whether practice is now cancelled on the date.
+    :return: None
+    """
+
+    global _write_count
+
+    _write_count += 1
+    _recent_writes[date] = (_write_count, cancelled)
+    _apply_cached(date, cancelled)
+
+
+async def _announce_change():
+    """
+    Tells the other shards that the cancellations changed, so they reload them.
+    :return: None
+    """
+
+    global _loaded_version
+
+    version = await state.incr(VERSION_KEY)
+
+    # If nobody else changed anything since our copy was loaded, our copy already has this change.
+    if version == _loaded_version + 1:
+        _loaded_version = version
+
+
+def _apply_cached(date, cancelled):
+    """
+    Adds or removes a date in the sorted local copy of the cancellations, if it has been loaded.
+    :param date: A string in the format DATE_FORMAT.
+    :param cancelled: Whether practice is cancelled on the date.
+    :return: None
+    """
+
+    if _cancelled_dates is None:
+        return
+
+    index = bisect.bisect_left(_cancelled_dates, date)
+    present = index < len(_cancelled_dates) and _cancelled_dates[index] == date
+
+    if cancelled and not present:
+        _cancelled_dates.insert(index, date)
+    elif not cancelled and present:
+        del _cancelled_dates[index]
+
+    util.set_cancelled(parse_date(date).date(), cancelled)
+
+
+def _to_days(dates):
+    """
+    :param dates: A list of strings in the format DATE_FORMAT.
+    :return: A list of the valid ones as dates, for the semester calendar.
+    """
+
+    return [day.date() for day in map(parse_date, dates) if day is not None]
+
 
-def cancel_on_day(date):
+async def cancel_on_day(date):
     """
     Cancels practice on the given date.
     :param date: A string in the format DATE_FORMAT.
     :return: True iff practice has been registered as cancelled.
     """
 
-    res = util.http_post("/cancellations/cancel/" + date, {})
+    res = await util.http_post("/cancellations/cancel/" + date, {})
     if res.status_code == 200:
+        _set_cached(date, True)
+        await replica.set_cancelled(date, True)
+        await _announce_change()
         return True
     else:
-        print("Something went wrong when trying to cancel practice on '" + date + "' " +
-              str(res.status_code) + ":\n" + res.content.decode("utf-8"))
+        logger.error("could not cancel practice", date=date, status=res.status_code,
+                     body=res.content.decode("utf-8"))
         return False
 
 
-def uncancel_on_date(date):
+async def uncancel_on_date(date):
     """
     If practice is cancelled on the given date, this will uncancel it.
     :param date: The date to uncancel it. It is assumed this date is in DATE_FORMAT.
     :return: True iff the update operation was successful, false if not.
     """
 
-    res = util.http_post("/cancellations/uncancel/" + date, {})
+    res = await util.http_post("/cancellations/uncancel/" + date, {})
     if res.status_code == 200:
+        _set_cached(date, False)
+        await replica.set_cancelled(date, False)
+        await _announce_change()
         return True
     else:
-        print("Something went wrong when trying to uncancel practice on '" + date + "' " +
-              str(res.status_code) + ":\n" + res.content.decode("utf-8"))
+        logger.error("could not uncancel practice", date=date, status=res.status_code,
+                     body=res.content.decode("utf-8"))
         return False
 
 
-def is_cancelled_on(date):
+async def is_cancelled_on(date):
     """
     Determines if practice is cancelled on the given date.
     :param date: A String in the format YYYY-MM-DD.
-    :return: True if practice is cancelled on the given date, False if not.
+    :return: True if practice is cancelled on the given date, False if not, None if the cancellations could
+             not be loaded.
     """
 
-    res = util.http_get("/cancellations/is/cancelled/" + date)
-
-    if res.status_code == 200:
-        # The response will just be true or false.
-        return json.loads(res.content.decode("utf-8"))
-    else:
-        print("Something went wrong when trying to determine if practice is cancelled " +
-              "on " + date + ":\n" + res.content.decode("utf-8"))
+    if not await load_cancellations():
+        logger.warning("could not determine if practice is cancelled, cancellations are not loaded", date=date)
         return None
 
+    day = parse_date(date)
+    return day is not None and util.get_day(day.date()).cancelled
 
-def is_cancelled_today():
+
+async def is_cancelled_today():
     """
     Determines if practice is cancelled today.
     :return: True if today is in the CANCELLATION_DATES list, false if not
     """
 
     date = datetime.datetime.today().strftime(DATE_FORMAT)
-    return is_cancelled_on(date)
+    return await is_cancelled_on(date)
 
 
-def is_cancelled_tomorrow():
+async def is_cancelled_tomorrow():
     """
     Determines if practice is cancelled tomorrow.
     :return: True if tomorrow is in the cancellation_dates list, false if not
     """
 
     tomorrow = (datetime.datetime.today() + datetime.timedelta(days=1)).strftime(DATE_FORMAT)
-    return is_cancelled_on(tomorrow)
+    return await is_cancelled_on(tomorrow)
 
 
 async def handle_cancel_command(message, args):
     """
-    Cancels practice on a certain day.
+    Cancels practice on a certain day. Only eboard may do this, which the command registry checks.
     :param message: The message used to issue the command
     :param args: Arguments issued. The only argument should be a date string formatted YYYY-MM-DD
     :return: None
     """
 
-    # Only eboard should be able to cancel practice
-    if not util.is_member_eboard(message.author):
-        await client.send_message(message.channel, "You're not in eboard... trying to stage a coup?")
-        return
-
     # Handle the help case
     if args is None or len(args) != 1 or args[0].lower() == "help":
-        await client.send_message(message.channel, CANCEL_HELP_TEXT)
+        await outbound.send_message(message.channel, CANCEL_HELP_TEXT)
         return
 
     # Parse & verify the date is in a valid format
     dt = parse_date(args[0])
     if dt is None:
-        await client.send_message(message.channel, "Could not parse date - make sure the day and month are 2 digits "
-                                                   "(e.g. 2019-01-02 for January 2nd)")
+        await outbound.send_message(message.channel, "Could not parse date - make sure the day and month are 2 digits "
+                                                     "(e.g. 2019-01-02 for January 2nd)")
         return
 
     # Check if already cancelled.
-    if is_cancelled_on(args[0]):
-        await client.send_message(message.channel, "Practice is already cancelled on " + args[0] + ". " +
-                                  "Use $db uncancel YYYY-MM-DD if you wish to reschedule practice.")
+    if await is_cancelled_on(args[0]):
+        await outbound.send_message(message.channel, "Practice is already cancelled on " + args[0] + ". " +
+                                    "Use $db uncancel YYYY-MM-DD if you wish to reschedule practice.")
+        return
 
     # If not cancelled, we try cancelling on the date
-    elif cancel_on_day(args[0]):
-        await client.send_message(message.channel, "Practice has been cancelled on " + dt.strftime("%B %d, %Y") + ".")
-        await client.send_message(util.get_first_channel_by_name(CHAN_ANNOUNCEMENTS),
-                                  "Notice: Practice has been cancelled on " +
-                                  dt.strftime("%A %B %d, %Y"))
+    try:
+        cancelled = await cancel_on_day(args[0])
+    except OSError as e:
+        logger.warning("could not cancel practice, ritdl-ws is unreachable", date=args[0], error=repr(e))
+        await outbound.send_message(message.channel, util.API_DOWN_TEXT)
+        return
+
+    if cancelled:
+        await outbound.send_message(message.channel, "Practice has been cancelled on " + dt.strftime("%B %d, %Y") + ".")
+        await outbound.send_message(util.get_channel_by_name(message.server, CHAN_ANNOUNCEMENTS),
+                                    "Notice: Practice has been cancelled on " +
+                                    dt.strftime("%A %B %d, %Y"))
 
     # And if something went wrong with that, report a failure.
     else:
-        await client.send_message(message.channel, "Something went wrong! Practice has not been cancelled...")
+        await outbound.send_message(message.channel, "Something went wrong! Practice has not been cancelled...")
 
 
 async def handle_uncancel_command(message, args):
     """
-    Attempts to uncancel a practice that was cancelled on a certain date.
+    Attempts to uncancel a practice that was cancelled on a certain date. Only eboard may do this, which the
+    command registry checks.
     :param message: The message used to issue the command
     :param args: Arguments issued. The argument should be a date string in format YYYY-MM-DD
     :return:
     """
 
-    # Only eboard should be able to cancel practice
-    if not util.is_member_eboard(message.author):
-        await client.send_message(message.channel, "You're not in eboard... trying to stage a coup?")
-        return
-
     # Handle the help case
     if args is None or len(args) != 1 or args[0].lower() == "help":
-        await client.send_message(message.channel, UNCANCEL_HELP_TEXT)
+        await outbound.send_message(message.channel, UNCANCEL_HELP_TEXT)
         return
 
     # Otherwise attempt to cancel practice on that day.
     dt = parse_date(args[0])
     if dt is None:
-        await client.send_message(message.channel, "Could not parse date - make sure the day and month are 2 digits "
-                                                   "(e.g. 2019-01-02 for January 2nd)")
+        await outbound.send_message(message.channel, "Could not parse date - make sure the day and month are 2 digits "
+                                                     "(e.g. 2019-01-02 for January 2nd)")
         return
 
     # If already cancelled, do uncancelling.
-    if is_cancelled_on(args[0]):
-        if uncancel_on_date(args[0]):
-            await client.send_message(message.channel, "Practice has been uncancelled on " + dt.strftime("%B %d, %Y"))
-            await client.send_message(util.get_first_channel_by_name(CHAN_ANNOUNCEMENTS),
-                                      "Notice: Practice, which was previously cancelled on "
-                                      + dt.strftime("%A %B %d, %Y") + " has been rescheduled for the same time - "
-                                                                      "sorry for any inconvenience.")
+    if await is_cancelled_on(args[0]):
+        try:
+            uncancelled = await uncancel_on_date(args[0])
+        except OSError as e:
+            logger.warning("could not uncancel practice, ritdl-ws is unreachable", date=args[0], error=repr(e))
+            await outbound.send_message(message.channel, util.API_DOWN_TEXT)
+            return
+
+        if uncancelled:
+            await outbound.send_message(message.channel, "Practice has been uncancelled on " + dt.strftime("%B %d, %Y"))
+            await outbound.send_message(util.get_channel_by_name(message.server, CHAN_ANNOUNCEMENTS),
+                                        "Notice: Practice, which was previously cancelled on "
+                                        + dt.strftime("%A %B %d, %Y") + " has been rescheduled for the same time - "
+                                                                        "sorry for any inconvenience.")
         else:
-            await client.send_message(message.channel, "Failed to uncancel practice on " + args[0] +
-                                      " - something went wrong.")
+            await outbound.send_message(message.channel, "Failed to uncancel practice on " + args[0] +
+                                        " - something went wrong.")
     else:
-        await client.send_message(message.channel, "Practice was not cancelled on " + args[0] +
-                                  " so it can't be uncancelled.")
+        await outbound.send_message(message.channel, "Practice was not cancelled on " + args[0] +
+                                    " so it can't be uncancelled.")
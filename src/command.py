@@ -6,23 +6,120 @@ All commands are messages received in the following format:
 
 $db [command] [optional args list]
 
+Commands register themselves with the @command decorator, which describes their name, aliases, arguments
+and who may use them. The help text is generated from those registrations.
+
 :author Sam Kuzio
 """
 
 import random
 import datetime
 
-from src import client, VERSION, reminders, cancellations
+from src import VERSION, CHAN_ATTENDANCE, reminders, cancellations, util, metrics, outbound, backfill
 from src.quip import add_quip
 
-# Help text to display when issuing the response to the help command.
-HELP_TEXT = "Hi, I'm diddlebot! I mostly annoy everyone here but sometimes have helpful reminders.\n"
-HELP_TEXT += "Have a look at my brain - https://github.com/samkuzio/diddlebot\n\n"
-HELP_TEXT += "Here are some helpful commands:\n"
-HELP_TEXT += "$db addquip [text]\n"
-HELP_TEXT += "$db cancel (eboard only)\n"
-HELP_TEXT += "$db uncancel (eboard only)\n"
-HELP_TEXT += "$db cancellations"
+# The start of the help text. A line for every command that isn't hidden gets added after this.
+HELP_INTRO = "Hi, I'm diddlebot! I mostly annoy everyone here but sometimes have helpful reminders.\n"
+HELP_INTRO += "Have a look at my brain - https://github.com/samkuzio/diddlebot\n\n"
+HELP_INTRO += "Here are some helpful commands:\n"
+
+# Reply to people who aren't on eboard but use an eboard only command.
+NOT_EBOARD_TEXT = "You're not in eboard... trying to stage a coup?"
+
+# Every registered command, by name and by each of its aliases.
+COMMANDS = {}
+
+# Registered commands in the order they were registered, for the help text.
+_command_list = []
+
+# The generated help text, or None if it has to be generated again.
+_help_text = None
+
+
+class Command:
+    """
+    A registered command. How often it is used and how long it takes is recorded in metrics.COMMAND_SECONDS.
+    """
+
+    def __init__(self, name, handler, aliases, min_args, max_args, arg_checks, arg_help, usage, eboard_only,
+                 hidden):
+        self.name = name
+        self.handler = handler
+        self.aliases = aliases
+        self.min_args = min_args
+        self.max_args = max_args
+        self.arg_checks = arg_checks
+        self.arg_help = arg_help
+        self.usage = usage
+        self.eboard_only = eboard_only
+        self.hidden = hidden
+
+    def accepts(self, args):
+        """
+        :param args: A list of argument strings, or None if no arguments were given.
+        :return: True iff the arguments fit this command's argument count and checks.
+        """
+        args = args or []
+        if len(args) < self.min_args or (self.max_args is not None and len(args) > self.max_args):
+            return False
+        return all(check(arg) for (check, arg) in zip(self.arg_checks, args))
+
+    def help_line(self):
+        """
+        :return: The line describing this command in the help text.
+        """
+        line = "$db " + self.name
+        if self.arg_help:
+            line += " " + self.arg_help
+        if self.eboard_only:
+            line += " (eboard only)"
+        return line
+
+
+def command(name, aliases=(), min_args=0, max_args=None, arg_checks=(), arg_help="", usage=None, eboard_only=False,
+            hidden=False):
+    """
+    Decorator that registers a coroutine function as a command. The function is called with the message and
+    a list of argument strings, or None if no arguments were given.
+    :param name: The command string, e.g. "cancel" for "$db cancel"
+    :param aliases: Other command strings that run the same command.
+    :param min_args: The fewest arguments the command accepts.
+    :param max_args: The most arguments the command accepts, or None for no limit.
+    :param arg_checks: A function for each leading argument, in order, that takes the argument string and returns
+                       True if it is acceptable. Arguments past the last check aren't checked.
+    :param arg_help: A short description of the arguments for the help text, e.g. "[text]"
+    :param usage: Text sent back when the arguments don't fit the command. Defaults to the help line.
+    :param eboard_only: True if only eboard members may use the command.
+    :param hidden: True to leave the command out of the help text.
+    :return: The decorator.
+    """
+
+    def register(handler):
+        global _help_text
+
+        cmd = Command(name, handler, tuple(aliases), min_args, max_args, tuple(arg_checks), arg_help, usage,
+                      eboard_only, hidden)
+        for key in (name,) + cmd.aliases:
+            COMMANDS[key] = cmd
+        _command_list.append(cmd)
+        _help_text = None
+
+        return handler
+
+    return register
+
+
+def get_help_text():
+    """
+    :return: The help text, listing every command that isn't hidden.
+    """
+
+    global _help_text
+
+    if _help_text is None:
+        _help_text = HELP_INTRO + "\n".join(cmd.help_line() for cmd in _command_list if not cmd.hidden)
+
+    return _help_text
 
 
 async def handle_incoming_command(message):
@@ -32,56 +129,47 @@ async def handle_incoming_command(message):
     :return: None.
     """
 
+    # Remove the $db from the command string and split it up into the command and its arguments.
+    tokens = message.content[4:].split()
+
     # If the user only sent '$db ' or '$db' with no arguments, ignore their request.
-    if len(message.content) <= 4:
+    if not tokens:
         return
 
-    # Remove the $db from the command string
-    command_string = message.content[4:]
-
-    # Get the command portion, the first token in the command string
-    command = command_string.split()[0].lower()
-
-    # Get the list of arguments. If any are present make a list, otherwise we pass None to the command.
-    args = command_string.split()[1:] if len(command_string.split()) > 1 else None
-
     # Execute it, son
-    await execute_command(message, command, args)
+    await execute_command(message, tokens[0].lower(), tokens[1:] or None)
 
 
-async def execute_command(message, command, args):
+async def execute_command(message, command_name, args):
     """
     Attempts to execute the given command with the given arguments.
 
     :param message: The message object given by discord.
-    :param command: The string containing the command.
+    :param command_name: The string containing the command.
     :param args: A list of args as strings, or None if no args were provided.
     :return: None
     """
 
-    if command == "addquip":
-        await cmd_add_quip(message, args)
+    cmd = COMMANDS.get(command_name)
 
-    elif command == "cancel":
-        await cmd_cancel(message, args)
-
-    elif command == "uncancel":
-        await cmd_uncancel(message, args)
+    if cmd is None:
+        await outbound.send_message(message.channel, "I don't have a '" + command_name + "' command")
+        return
 
-    elif command == "cancellations":
-        await cmd_cancellations(message)
+    if cmd.eboard_only and not util.is_member_eboard(message.author):
+        await outbound.send_message(message.channel, NOT_EBOARD_TEXT)
+        return
 
-    elif command == "help":
-        await cmd_help(message)
+    if not cmd.accepts(args):
+        await outbound.send_message(message.channel, cmd.usage if cmd.usage else "usage: " + cmd.help_line())
+        return
 
-    elif command == "version":
-        await cmd_version(message)
+    with metrics.Timer(metrics.COMMAND_SECONDS, command=cmd.name):
+        await cmd.handler(message, args)
 
-    else:
-        await client.send_message(message.channel, "I don't have a '" + command + "' command")
 
-
-async def cmd_version(message):
+@command("version", hidden=True)
+async def cmd_version(message, args):
     """
     Displays version info about diddlebot
     :param message: The message that requested version info
@@ -97,18 +185,21 @@ async def cmd_version(message):
     ]
 
     text = random.choice(strings)
-    await client.send_message(message.channel, text)
+    await outbound.send_message(message.channel, text)
 
 
-async def cmd_help(message):
+@command("help", hidden=True)
+async def cmd_help(message, args):
     """
     Returns the help message. Takes no arguments
     :param message: The message that contained the help command.
+    :param args: Ignored.
     :return:
     """
-    await client.send_message(message.channel, HELP_TEXT)
+    await outbound.send_message(message.channel, get_help_text())
 
 
+@command("addquip", arg_help="[text]")
 async def cmd_add_quip(message, args):
     """
     Handles all commands issued with the addquip command string.
@@ -118,19 +209,28 @@ async def cmd_add_quip(message, args):
     """
 
     if args is None:
-        await client.send_message(message.channel, "That's not a very funny quip. I don't think I'll use it.")
+        await outbound.send_message(message.channel, "That's not a very funny quip. I don't think I'll use it.")
         return
 
     newquip = ""
     for arg in args:
         newquip += arg + " "
-    if add_quip(newquip):
+    try:
+        added = await add_quip(newquip)
+    except OSError:
+        # ritdl-ws couldn't be reached, or the circuit breaker is open.
+        added = None
+
+    if added is None:
+        response = util.API_DOWN_TEXT
+    elif added:
         response = "Nice one! I'll remember that!"
     else:
         response = "Congratulations! You've found the diddlebug in diddlebot. Tell someone to check my logs."
-    await client.send_message(message.channel, response)
+    await outbound.send_message(message.channel, response)
 
 
+@command("cancel", max_args=1, usage=cancellations.CANCEL_HELP_TEXT, eboard_only=True)
 async def cmd_cancel(message, args):
     """
     Cancels practice on a certain day.
@@ -142,6 +242,7 @@ async def cmd_cancel(message, args):
     await cancellations.handle_cancel_command(message, args)
 
 
+@command("uncancel", max_args=1, usage=cancellations.UNCANCEL_HELP_TEXT, eboard_only=True)
 async def cmd_uncancel(message, args):
     """
     Attempts to uncancel a practice that was cancelled on a certain date.
@@ -153,21 +254,23 @@ async def cmd_uncancel(message, args):
     await cancellations.handle_uncancel_command(message, args)
 
 
-async def cmd_cancellations(message):
+@command("cancellations")
+async def cmd_cancellations(message, args):
     """
     Displays all of the known cancellations
     :param message: The message sent
+    :param args: Ignored.
     :return:
     """
 
-    dates = cancellations.get_cancellations()
+    dates = await cancellations.get_cancellations()
 
     if dates is None:
-        await client.send_message(message.channel, "Something went wrong when doing that - Sorry!")
+        await outbound.send_message(message.channel, "Something went wrong when doing that - Sorry!")
         return
 
     if len(dates) == 0:
-        await client.send_message(message.channel, "There are no current practice cancellations")
+        await outbound.send_message(message.channel, "There are no current practice cancellations")
         return
 
     text = "Practice is cancelled on the following date(s):\n\n"
@@ -175,4 +278,83 @@ async def cmd_cancellations(message):
     for day in dates:
         text += datetime.datetime.strptime(day, reminders.DATE_FORMAT).strftime("%A %B %d, %Y") + "\n"
 
-    await client.send_message(message.channel, text)
+    await outbound.send_message(message.channel, text)
+
+
+@command("practices")
+async def cmd_practices(message, args):
+    """
+    Lists the next few practices that haven't been cancelled.
+    :param message: The message sent
+    :param args: Ignored.
+    :return:
+    """
+
+    await cancellations.load_cancellations()
+    days = util.next_practices(3)
+
+    if not days:
+        await outbound.send_message(message.channel, "There are no more practices this semester!")
+        return
+
+    text = "The next practices are on:\n\n" + "\n".join(day.strftime("%A %B %d, %Y") for day in days)
+    await outbound.send_message(message.channel, text)
+
+
+@command("apistatus")
+async def cmd_api_status(message, args):
+    """
+    Reports whether ritdl-ws is up, as far as the circuit breaker can tell.
+    :param message: The message sent
+    :param args: Ignored.
+    :return:
+    """
+
+    await outbound.send_message(message.channel, util.get_api_status())
+
+
+@command("stats", eboard_only=True)
+async def cmd_stats(message, args):
+    """
+    Summarizes how busy diddlebot has been and where its time goes.
+    :param message: The message sent
+    :param args: Ignored.
+    :return:
+    """
+
+    await outbound.send_message(message.channel, metrics.summary())
+
+
+@command("backfill", max_args=1, arg_checks=(lambda arg: arg.lower() == "restart",), arg_help="<restart>",
+         eboard_only=True)
+async def cmd_backfill(message, args):
+    """
+    Rebuilds excuse records from the attendance channel's history, picking up from the last checkpoint unless
+    told to restart.
+    :param message: The message sent
+    :param args: Optionally "restart", to start over from the beginning of the semester.
+    :return:
+    """
+
+    restart = args is not None and args[0].lower() == "restart"
+    channel = util.get_channel_by_name(message.server, CHAN_ATTENDANCE)
+
+    if channel is None:
+        await outbound.send_message(message.channel, "I can't find the #" + CHAN_ATTENDANCE + " channel here.")
+        return
+
+    if backfill.is_running():
+        await outbound.send_message(message.channel, "A backfill is already running, hang tight.")
+        return
+
+    await outbound.send_message(message.channel, "Backfilling excuses from #" + CHAN_ATTENDANCE + "...")
+
+    try:
+        (read, written) = await backfill.start_backfill(channel, restart)
+    except (backfill.BackfillError, OSError) as e:
+        # An OSError here is the checkpoint file - ritdl-ws and discord errors come as BackfillErrors.
+        await outbound.send_message(message.channel, "Backfill stopped: " + str(e))
+        return
+
+    await outbound.send_message(message.channel, "Backfill done! Read " + str(read) + " messages and recorded " +
+                                str(written) + " excuses that were missing.")
@@ -8,12 +8,60 @@ Contains all discord client event handlers.
 """
 
 
-from src import client, CHAN_ATTENDANCE, CHAN_DB_TEST
+import asyncio
+
+from src import client, CHAN_ATTENDANCE, CHAN_DB_TEST, ROLE_EBOARD, SHARD_ID, SHARD_COUNT
 import src.quip
 import src.command
 import src.reminders
 import src.attendance
 import src.diddlemail
+import src.util
+import src.metrics
+import src.cancellations
+from src import log, outbound, replica, startup
+from src.triggers import Rule, TriggerTable
+
+logger = log.get_logger("diddlebot")
+
+
+async def send_respects(message):
+    """
+    Press f to pay respects
+    :param message: The message that said f.
+    :return: None
+    """
+
+    await outbound.send_message(message.channel, 'f')
+
+
+async def send_quip(message):
+    """
+    When the diddlebot is mentioned it should chime in with sass or humor or whatever
+    :param message: The message that mentioned diddlebot.
+    :return: None
+    """
+
+    await src.quip.send_quip(message.channel)
+
+
+# What diddlebot reacts to, highest priority first. Rules without text (like attendance) run for every message
+# in their channels. Of the rest, only the first one that matches runs, so quips etc. aren't sent in response
+# to a command.
+TRIGGERS = TriggerTable([
+    # Channels where users solely interact with diddlebot, like #attendance. We don't need commands here bc it's
+    # assumed every message will be an attendance excuse.
+    Rule("attendance", src.attendance.excuse, channels=(CHAN_ATTENDANCE, CHAN_DB_TEST)),
+
+    # General messages that may occur in any channel that are not specific-use channels.
+    Rule("command", src.command.handle_incoming_command, prefix="$db ", exclude_channels=(CHAN_ATTENDANCE,)),
+    Rule("quip", send_quip, keyword="diddlebot", exclude_channels=(CHAN_ATTENDANCE,)),
+    Rule("respects", send_respects, exact="f", exclude_channels=(CHAN_ATTENDANCE,)),
+])
+
+
+# Time every discord send, whichever module it comes from.
+src.metrics.instrument_client(client)
 
 
 @client.event
@@ -28,26 +76,26 @@ async def on_message(message):
     if message.author == client.user:
         return
 
-    # Before handling commands, we handle channels where users solely interact with
-    # diddlebot, like #attendance. We don't need commands here bc it's assumed every
-    # message will be an attendance excuse.
-    if message.channel.name == CHAN_ATTENDANCE or message.channel.name == CHAN_DB_TEST:
-        await src.attendance.excuse(message)
+    rules = TRIGGERS.match(message.channel.name, message.content)
+    if not rules:
+        src.metrics.MESSAGES.inc(rule="none")
+        return
 
-    # Now handle general messages that may occur in any channel that are not specific-use channels.
-    if message.channel.name != CHAN_ATTENDANCE:
-        # Now handle commands. We don't want quips, etc. to be sent
-        # in response to a command.
-        if message.content.lower().startswith('$db '):
-            await src.command.handle_incoming_command(message)
+    for rule in rules:
+        src.metrics.MESSAGES.inc(rule=rule.name)
+        with src.metrics.Timer(src.metrics.HANDLER_SECONDS, rule=rule.name):
+            await rule.handler(message)
 
-        # When the diddlebot is mentioned it should chime in with sass or humor or whatever
-        elif "diddlebot" in message.content.lower():
-            await src.quip.send_quip(message.channel)
 
-        # Press f to pay respects
-        elif message.content.lower() == 'f':
-            await client.send_message(message.channel, 'f')
+@client.event
+async def on_error(event, *args, **kwargs):
+    """
+    Called when an event handler raises. Logs the error instead of letting discord.py print it.
+    :param event: The name of the event, e.g. "on_message".
+    :return: None
+    """
+
+    logger.exception("event handler failed", event=event, guild=log.guild_of(args[0]) if args else None)
 
 
 @client.event
@@ -57,29 +105,206 @@ async def on_ready():
     :return: None
     """
 
-    print("Logged in as:")
-    print(client.user.name)
-    print(client.user.id)
-    print('-------------')
+    logger.info("logged in", user=client.user.name, user_id=client.user.id,
+                shard=str(SHARD_ID + 1) + "/" + str(SHARD_COUNT))
+
+    startup.end_phase("gateway")
+
+    # Index the channels we can see so that reminders and announcements can find them quickly.
+    src.util.build_channel_index()
+
+    await src.metrics.start_server()
+
+    # Keep the local replica in sync with ritdl-ws.
+    replica.start_sync([src.attendance.push_journal, src.quip.start_refill, src.cancellations.start_refresh])
+
+    # Excuse digests that were waiting when the bot last stopped still have to go out.
+    await src.attendance.schedule_pending_digests()
+
+    startup.end_phase("ready")
+    breakdown = startup.report()
+    if breakdown is not None:
+        logger.info(breakdown)
 
     # Begin awaiting the reminders.
     await src.reminders.init()
 
 
-def start():
+@client.event
+async def on_channel_create(channel):
+    """
+    Called when a channel is created. Keeps the channel name index up to date.
+    :param channel: The new Channel.
+    :return: None
+    """
+
+    src.util.index_channel(channel)
+
+
+@client.event
+async def on_channel_delete(channel):
+    """
+    Called when a channel is deleted. Keeps the channel name index up to date.
+    :param channel: The deleted Channel.
+    :return: None
+    """
+
+    src.util.unindex_channel(channel)
+
+
+@client.event
+async def on_channel_update(before, after):
+    """
+    Called when a channel is changed, e.g. renamed. Keeps the channel name index up to date.
+    :param before: The Channel before the change.
+    :param after: The Channel after the change.
+    :return: None
+    """
+
+    src.util.unindex_channel(before)
+    src.util.index_channel(after)
+
+
+@client.event
+async def on_server_join(server):
+    """
+    Called when the bot joins a server. Indexes the server's channels.
+    :param server: The Server.
+    :return: None
+    """
+
+    src.util.index_server(server)
+
+
+@client.event
+async def on_server_remove(server):
+    """
+    Called when the bot leaves a server. Removes its channels from the index.
+    :param server: The Server.
+    :return: None
+    """
+
+    src.util.unindex_server(server)
+    src.util.invalidate_eboard_cache(server)
+
+
+@client.event
+async def on_server_available(server):
+    """
+    Called when a server that was unavailable comes back. Indexes the server's channels again.
+    :param server: The Server.
+    :return: None
+    """
+
+    src.util.index_server(server)
+
+
+@client.event
+async def on_server_unavailable(server):
     """
-    Starts diddlebot!
+    Called when a server becomes unavailable. Removes its channels from the index until it comes back.
+    :param server: The Server.
+    :return: None
+    """
+
+    src.util.unindex_server(server)
+    src.util.invalidate_eboard_cache(server)
+
+
+@client.event
+async def on_member_update(before, after):
+    """
+    Called when a member changes, e.g. their roles. Keeps the eboard cache up to date.
+    :param before: The Member before the change.
+    :param after: The Member after the change.
+    :return: None
+    """
+
+    src.util.update_eboard_member(after)
+
+
+@client.event
+async def on_member_remove(member):
+    """
+    Called when a member leaves a server. Keeps the eboard cache up to date.
+    :param member: The Member who left.
+    :return: None
+    """
+
+    src.util.remove_eboard_member(member)
+
+
+@client.event
+async def on_server_role_create(role):
+    """
+    Called when a role is created. A new eboard role means the eboard cache has to be resolved again.
+    :param role: The new Role.
+    :return: None
+    """
+
+    if role.name == ROLE_EBOARD:
+        src.util.invalidate_eboard_cache(role.server)
+
+
+@client.event
+async def on_server_role_delete(role):
+    """
+    Called when a role is deleted. Losing the eboard role means the eboard cache has to be resolved again.
+    :param role: The deleted Role.
+    :return: None
+    """
+
+    if role.name == ROLE_EBOARD:
+        src.util.invalidate_eboard_cache(role.server)
+
+
+@client.event
+async def on_server_role_update(before, after):
+    """
+    Called when a role changes. Renaming a role to or from the eboard role name means the eboard cache has to be
+    resolved again.
+    :param before: The Role before the change.
+    :param after: The Role after the change.
+    :return: None
+    """
+
+    if before.name != after.name and ROLE_EBOARD in (before.name, after.name):
+        src.util.invalidate_eboard_cache(after.server)
+
+
+def start(started=None):
+    """
+    Starts diddlebot! Anything that doesn't need discord - the email config, the cancellations and the quip
+    pool - is loaded while the gateway connects, and a breakdown of how long each part of startup took is
+    logged once the bot is ready.
+    :param started: The perf_counter() from when the process started, so that imports count towards startup.
     :return: The auth token.
     """
 
+    startup.begin(started)
+    log.setup()
+    startup.end_phase("imports")
+
     # load the auth token from the auth file so the bot can log in
     with open('auth','r') as auth_file:
         bot_token = auth_file.read().strip()
 
-    # load the email credentials
-    src.diddlemail.load_creds()
+    startup.end_phase("auth")
+
+    loop = asyncio.get_event_loop()
+
+    # load the email credentials and warm the caches while logging in
+    startup.track("email config", loop.run_in_executor(None, src.diddlemail.load_creds))
+    startup.track("cancellations", src.cancellations.start_refresh())
+    startup.track("quips", src.quip.start_refill())
 
-    print("\nLogging in...")
+    logger.info("logging in")
 
     # Start the discord client
-    client.run(bot_token)
+    try:
+        loop.run_until_complete(client.start(bot_token))
+    except KeyboardInterrupt:
+        loop.run_until_complete(client.logout())
+    finally:
+        loop.close()
+        log.shutdown()
@@ -5,10 +5,21 @@ Contains all the stuff you need to send an email as diddlebot, minus the credent
 Password for the email is stored similar to the discord auth token, in a file called
 email in the directory diddlebot runs within.
 
+Emails are put in an outbox and sent by a background worker that keeps one authenticated SMTP
+session open, so each email does not pay for its own connect/STARTTLS/login handshake. smtplib and ssl are
+only imported once the first email is sent, to keep them out of startup.
+
 :author Sam Kuzio
 """
 
-import smtplib, ssl, os.path
+import os.path
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src import log, metrics
+
+logger = log.get_logger("diddlemail")
 
 CRED_FILE = "email"
 PORT = 587
@@ -17,6 +28,28 @@ EMAIL_PASSWORD = None
 SMTP_SERVER = None
 CLUB_EMAIL = None
 
+# Whether to upgrade the SMTP connection with STARTTLS. Only meant to be turned off for local test servers.
+USE_STARTTLS = True
+
+# The most queued emails that are sent back to back in one go over the session.
+MAX_BATCH = 10
+
+# Seconds the session may sit unused before it is closed with QUIT.
+IDLE_TIMEOUT = 60
+
+# Seconds to wait on the SMTP server for any one step - connecting, a reply, a send - before giving up on the
+# session. Without it a server that stops answering would hold the SMTP thread, and every email, forever.
+SMTP_TIMEOUT = 30
+
+# Queue of (message, subject, future) tuples waiting to be sent, and the worker that sends them.
+_outbox = None
+_outbox_task = None
+
+# The open SMTP session. It is only ever used from the single _smtp_executor thread.
+_smtp = None
+_smtp_executor = None
+_ssl_context = None
+
 
 def load_creds():
     """
@@ -41,52 +74,182 @@ def load_creds():
         EMAIL_PASSWORD = None
         SMTP_SERVER = None
         CLUB_EMAIL = None
-        print("No email file present - email functionality will not work. To fix this, ensure the email file exists in"
-              " the current working directory with the email account password.")
+        logger.warning("No email file present - email functionality will not work. To fix this, ensure the email file "
+                       "exists in the current working directory with the email account password.")
         return
 
     if EMAIL is None or EMAIL == "":
         EMAIL = None
-        print("Warning: No diddlebot email was found in the email file. Email functionality will not work!")
+        logger.warning("No diddlebot email was found in the email file. Email functionality will not work!")
     elif EMAIL_PASSWORD is None or EMAIL_PASSWORD == "":
         EMAIL_PASSWORD = None
-        print("Warning: No password was found in the email file. Email functionality will not work!")
+        logger.warning("No password was found in the email file. Email functionality will not work!")
     elif SMTP_SERVER is None or SMTP_SERVER == "":
         SMTP_SERVER = None
-        print("Warning: No SMTP server was found in the email file. Email functionality will not work!")
+        logger.warning("No SMTP server was found in the email file. Email functionality will not work!")
     elif CLUB_EMAIL is None or CLUB_EMAIL == "":
         CLUB_EMAIL = None
-        print("Warning: No club email was found in the email file. Email functionality will not work!")
+        logger.warning("No club email was found in the email file. Email functionality will not work!")
     else:
-        print("Loaded email configuration")
+        logger.info("Loaded email configuration")
 
-def send_email_to_club(message, subject):
+def queue_email_to_club(message, subject):
     """
-    Sends a plain text email message to the club email account.
+    Puts a plain text email to the club email account in the outbox and returns right away.
     :param message: The body text of the message
     :param subject: The subject line of the message
-    :return: True iff the email was sent successfully, or if email is not configured. False if an error
-             occurs when sending an email.
+    :return: A future whose result is True iff the email was sent successfully, or if email is not configured.
+             False if an error occurs when sending the email.
     """
 
+    global _outbox
+    global _outbox_task
+
+    future = asyncio.get_event_loop().create_future()
+
     if EMAIL_PASSWORD is None:
-        print("Warning: Cannot send email - no email password is loaded!")
+        # This is not considered a failure, rather a misconfiguration. Notifying via logs is ok here, and it
+        # happens for every email, so only some of them are logged.
+        logger.warning("Cannot send email - no email password is loaded!", subject=subject, sample=0.1)
+        future.set_result(True)
+        return future
+
+    if _outbox is None:
+        _outbox = asyncio.Queue()
+
+    if _outbox_task is None or _outbox_task.done():
+        _outbox_task = asyncio.ensure_future(run_outbox())
+
+    queued_at = time.perf_counter()
+    future.add_done_callback(lambda done: _record_email(done, queued_at))
+
+    _outbox.put_nowait((message, subject, future))
+    return future
+
+
+def _record_email(future, queued_at):
+    """
+    Done callback for queued emails that records how long they took and whether they were sent.
+    :param future: The email's finished future.
+    :param queued_at: time.perf_counter() when the email was queued.
+    :return: None
+    """
+
+    sent = not future.cancelled() and future.exception() is None and future.result()
+    metrics.EMAIL_SECONDS.observe(time.perf_counter() - queued_at)
+    metrics.EMAILS.inc(outcome="sent" if sent else "failed")
+
+
+async def run_outbox():
+    """
+    Drains the outbox forever. Emails queued back to back are sent together over the open session, and the
+    session is closed after IDLE_TIMEOUT seconds without any email to send.
+    :return: None
+    """
+
+    global _smtp_executor
+
+    if _smtp_executor is None:
+        _smtp_executor = ThreadPoolExecutor(max_workers=1)
+
+    loop = asyncio.get_event_loop()
+
+    while True:
+        try:
+            batch = [await asyncio.wait_for(_outbox.get(), IDLE_TIMEOUT)]
+        except asyncio.TimeoutError:
+            await loop.run_in_executor(_smtp_executor, _close_session)
+            continue
+
+        while len(batch) < MAX_BATCH and not _outbox.empty():
+            batch.append(_outbox.get_nowait())
 
-        # This is not considered a failure, rather a misconfiguration. Notifying via logs is ok here.
-        return True
+        results = await loop.run_in_executor(_smtp_executor, _deliver, [(m, s) for (m, s, _) in batch])
 
-    # as called for by the basic smtp protocol, append the subject line before the message
-    message = "Subject: " + subject + "\n\n" + message
+        for (_, _, future), sent in zip(batch, results):
+            if not future.done():
+                future.set_result(sent)
 
-    context = ssl.create_default_context()
+
+def _open_session():
+    """
+    Connects and logs in to the SMTP server. Runs on the SMTP thread.
+    :return: None
+    """
+
+    global _smtp
+    global _ssl_context
+
+    import smtplib
+    import ssl
+
+    server = smtplib.SMTP(SMTP_SERVER, PORT, timeout=SMTP_TIMEOUT)
     try:
-        server = smtplib.SMTP(SMTP_SERVER, PORT)
-        server.ehlo()
-        server.starttls(context=context)
         server.ehlo()
+        if USE_STARTTLS:
+            if _ssl_context is None:
+                _ssl_context = ssl.create_default_context()
+            server.starttls(context=_ssl_context)
+            server.ehlo()
         server.login(EMAIL, EMAIL_PASSWORD)
-        server.sendmail(EMAIL, CLUB_EMAIL, message)
-        return True
-    except Exception as e:
-        print(e)
-        return False
+    except Exception:
+        server.close()
+        raise
+
+    _smtp = server
+
+
+def _close_session():
+    """
+    Says goodbye to the SMTP server, if a session is open. Runs on the SMTP thread.
+    :return: None
+    """
+
+    global _smtp
+
+    if _smtp is None:
+        return
+
+    try:
+        _smtp.quit()
+    except Exception:
+        _smtp.close()
+
+    _smtp = None
+
+
+def _deliver(batch):
+    """
+    Sends a batch of emails over the open session, opening one first if needed. If the session turns out
+    to be broken, it is reopened once and the email is retried. Runs on the SMTP thread.
+    :param batch: A list of (message, subject) tuples.
+    :return: A list with True for every email that was sent and False for every one that wasn't.
+    """
+
+    import smtplib
+
+    results = []
+
+    for (message, subject) in batch:
+        # as called for by the basic smtp protocol, append the subject line before the message
+        text = "Subject: " + subject + "\n\n" + message
+
+        sent = False
+        for attempt in range(2):
+            try:
+                if _smtp is None:
+                    _open_session()
+                _smtp.sendmail(EMAIL, CLUB_EMAIL, text)
+                sent = True
+                break
+            except (smtplib.SMTPServerDisconnected, smtplib.SMTPResponseException, OSError) as e:
+                # The session is no good anymore - drop it so the next attempt reconnects.
+                logger.warning("SMTP session failed", attempt=attempt + 1, subject=subject, error=repr(e))
+                _close_session()
+            except Exception:
+                logger.exception("could not send email", subject=subject)
+                break
+
+        results.append(sent)
+
+    return results
@@ -0,0 +1,231 @@
+"""
+File log.py
+
+diddlebot's logging. Modules get a logger with get_logger and log a short message plus structured fields, e.g.
+
+    log.warning("unexpected status code", endpoint="/quips", status=500)
+
+which is written as one line of key=value pairs that is easy to grep and to parse. Handing a record off costs
+the event loop a queue put: records go on a bounded queue and a background thread formats and writes them, so a
+slow terminal or disk never holds up message handling. If the queue fills up, records are dropped and counted
+instead of waited on.
+
+Noisy paths can be sampled, so they can log every time without flooding the output: SAMPLE_RATES keeps a
+fraction of the records at each level, and a single call can pass its own sample rate. Sampled records say
+what rate they were kept at.
+
+Until setup is called nothing is queued, and warnings and errors are written straight to stderr by the logging
+module, which is all scripts and tests need.
+"""
+
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+
+# The lowest level that is written.
+LOG_LEVEL = logging.INFO
+
+# Where the log is written - a file name, or None for stderr.
+LOG_FILE = None
+
+# How many records may wait for the writer before new ones are dropped.
+LOG_QUEUE_SIZE = 10000
+
+# The fraction of records that is kept at each level. Levels that aren't listed keep every record.
+SAMPLE_RATES = {logging.DEBUG: 0.1}
+
+# Every diddlebot logger is a child of this one.
+ROOT_NAME = "diddlebot"
+
+# The writer thread, while logging is set up.
+_listener = None
+_handler = None
+
+
+class Logger:
+    """
+    Logs a message with structured fields. Each method takes the message, then the fields as keyword arguments.
+    sample= overrides the level's sample rate for one call, and exc_info= attaches an exception.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._logger = logging.getLogger(ROOT_NAME + "." + name)
+
+    def log(self, level, message, exc_info=None, sample=None, **fields):
+        if not self._logger.isEnabledFor(level):
+            return
+        self._logger.log(level, message, exc_info=exc_info, extra={"fields": fields, "sample": sample})
+
+    def debug(self, message, **fields):
+        self.log(logging.DEBUG, message, **fields)
+
+    def info(self, message, **fields):
+        self.log(logging.INFO, message, **fields)
+
+    def warning(self, message, **fields):
+        self.log(logging.WARNING, message, **fields)
+
+    def error(self, message, **fields):
+        self.log(logging.ERROR, message, **fields)
+
+    def exception(self, message, **fields):
+        """
+        Logs an error with the exception being handled.
+        """
+        self.log(logging.ERROR, message, exc_info=True, **fields)
+
+
+def get_logger(name):
+    """
+    :param name: The name of the module that logs, e.g. "attendance".
+    :return: A Logger.
+    """
+
+    return Logger(name)
+
+
+def guild_of(obj):
+    """
+    :param obj: A discord Message or Channel.
+    :return: The id of its server, for the guild field, or None for direct messages.
+    """
+
+    server = getattr(obj, "server", None)
+    return None if server is None else server.id
+
+
+class StructuredFormatter(logging.Formatter):
+    """
+    Formats a record as a timestamp, level, module and message followed by its fields as key=value pairs.
+    """
+
+    def format(self, record):
+        module = record.name[len(ROOT_NAME) + 1:] if record.name.startswith(ROOT_NAME + ".") else record.name
+
+        text = self.formatTime(record) + " " + record.levelname + " module=" + module + \
+            " msg=" + _quote(record.getMessage())
+
+        for (key, value) in sorted(getattr(record, "fields", {}).items()):
+            text += " " + key + "=" + _quote(value)
+
+        rate = _sample_rate(record)
+        if rate < 1:
+            text += " sampled=" + str(rate)
+
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            text += "\n" + record.exc_text
+
+        return text
+
+
+def _quote(value):
+    """
+    :param value: A field value.
+    :return: The value as a string, quoted if it has spaces, quotes or newlines in it.
+    """
+
+    text = str(value)
+    if text == "" or any(c in text for c in ' "=\n'):
+        text = '"' + text.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+    return text
+
+
+def _sample_rate(record):
+    """
+    :param record: A LogRecord.
+    :return: The fraction of records like this one that are kept.
+    """
+
+    rate = getattr(record, "sample", None)
+    return SAMPLE_RATES.get(record.levelno, 1) if rate is None else rate
+
+
+class _SamplingFilter(logging.Filter):
+    """
+    Keeps records at their sample rate. Runs before a record is queued, so dropped records cost almost nothing.
+    """
+
+    def filter(self, record):
+        rate = _sample_rate(record)
+        return rate >= 1 or random.random() < rate
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to the writer thread without ever waiting on it.
+    """
+
+    def prepare(self, record):
+        # Only merge the arguments and render the traceback, which can't wait for the writer because the frames
+        # may be gone by then. The rest of the formatting happens on the writer thread.
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Imported here, since metrics logs through this module.
+            from src import metrics
+            metrics.LOG_DROPPED.inc()
+
+
+def setup():
+    """
+    Starts the writer thread and sends every diddlebot log record through it. Does nothing if it is already
+    running.
+    :return: None
+    """
+
+    global _listener
+    global _handler
+
+    if _listener is not None:
+        return
+
+    if LOG_FILE is None:
+        output = logging.StreamHandler(sys.stderr)
+    else:
+        output = logging.FileHandler(LOG_FILE, encoding="utf-8")
+    output.setFormatter(StructuredFormatter())
+
+    records = queue.Queue(LOG_QUEUE_SIZE)
+    _handler = _QueueHandler(records)
+    _handler.addFilter(_SamplingFilter())
+
+    root = logging.getLogger(ROOT_NAME)
+    root.setLevel(LOG_LEVEL)
+    root.addHandler(_handler)
+    root.propagate = False
+
+    _listener = logging.handlers.QueueListener(records, output)
+    _listener.start()
+
+
+def shutdown():
+    """
+    Writes the records that are still queued and stops the writer thread.
+    :return: None
+    """
+
+    global _listener
+    global _handler
+
+    if _listener is None:
+        return
+
+    logging.getLogger(ROOT_NAME).removeHandler(_handler)
+    logging.getLogger(ROOT_NAME).propagate = True
+    _listener.stop()
+
+    _listener = None
+    _handler = None
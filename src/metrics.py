@@ -0,0 +1,315 @@
+"""
+File metrics.py
+
+Counters and latency histograms for diddlebot's hot paths - ritdl-ws calls, email, discord sends and
+message handling. Metrics can be scraped in the Prometheus text format from a small http endpoint that only
+listens on localhost, and summarized in chat with $db stats.
+"""
+
+import asyncio
+import time
+
+from src import SHARD_ID, log
+
+logger = log.get_logger("metrics")
+
+# Where the scrape endpoint listens. It only serves GET /metrics. Each shard listens on METRICS_PORT plus its
+# shard id, so shards on the same host don't collide.
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9187
+
+# Upper bounds, in seconds, of the histogram buckets.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Every metric by name, in the order they were created.
+_metrics = {}
+
+# The running scrape endpoint, if any.
+_server = None
+
+
+def _label_key(labels):
+    """
+    :param labels: A dict of label names to values.
+    :return: A hashable, ordered version of the labels.
+    """
+    return tuple(sorted((name, str(value)) for (name, value) in labels.items()))
+
+
+def _format_labels(key, extra=()):
+    """
+    :param key: Labels as returned by _label_key.
+    :param extra: More (name, value) pairs to add at the end.
+    :return: The labels in the Prometheus text format, e.g. {endpoint="/quip"}, or "" if there are none.
+    """
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+
+    escaped = [name + '="' + value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+               for (name, value) in pairs]
+    return "{" + ",".join(escaped) + "}"
+
+
+class Counter:
+    """
+    A number that only goes up, per set of labels.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        return [self.name + _format_labels(key) + " " + repr(value) for (key, value) in sorted(self.values.items())]
+
+
+class Histogram:
+    """
+    Counts observations (usually latencies in seconds) in buckets, per set of labels.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        # label key -> [count per bucket..., count over the last bucket]
+        self.counts = {}
+        self.sums = {}
+        self.maxes = {}
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        counts = self.counts.get(key)
+        if counts is None:
+            counts = self.counts[key] = [0] * (len(self.buckets) + 1)
+            self.sums[key] = 0.0
+            self.maxes[key] = value
+
+        index = 0
+        while index < len(self.buckets) and value > self.buckets[index]:
+            index += 1
+        counts[index] += 1
+        self.sums[key] += value
+        self.maxes[key] = max(self.maxes[key], value)
+
+    def count(self, key):
+        return sum(self.counts[key])
+
+    def quantile(self, key, q):
+        """
+        :param key: Labels as returned by _label_key.
+        :param q: The quantile, between 0 and 1.
+        :return: The upper bound of the bucket that the quantile falls in, or the max if that is smaller.
+        """
+        target = q * self.count(key)
+        seen = 0
+        for (index, bucket_count) in enumerate(self.counts[key]):
+            seen += bucket_count
+            if seen >= target and bucket_count:
+                return min(self.buckets[index], self.maxes[key]) if index < len(self.buckets) else self.maxes[key]
+        return self.maxes[key]
+
+    def render(self):
+        lines = []
+        for key in sorted(self.counts):
+            cumulative = 0
+            for (bound, bucket_count) in zip(self.buckets, self.counts[key]):
+                cumulative += bucket_count
+                lines.append(self.name + "_bucket" + _format_labels(key, [("le", repr(bound))]) + " " + str(cumulative))
+            lines.append(self.name + "_bucket" + _format_labels(key, [("le", "+Inf")]) + " " + str(self.count(key)))
+            lines.append(self.name + "_sum" + _format_labels(key) + " " + repr(self.sums[key]))
+            lines.append(self.name + "_count" + _format_labels(key) + " " + str(self.count(key)))
+        return lines
+
+
+def counter(name, help_text):
+    """
+    Gets the counter with the given name, creating it if needed.
+    :param name: The metric name.
+    :param help_text: What it counts.
+    :return: A Counter.
+    """
+    metric = _metrics.get(name)
+    if metric is None:
+        metric = _metrics[name] = Counter(name, help_text)
+    return metric
+
+
+def histogram(name, help_text, buckets=DEFAULT_BUCKETS):
+    """
+    Gets the histogram with the given name, creating it if needed.
+    :param name: The metric name.
+    :param help_text: What it measures.
+    :param buckets: Upper bounds of the buckets.
+    :return: A Histogram.
+    """
+    metric = _metrics.get(name)
+    if metric is None:
+        metric = _metrics[name] = Histogram(name, help_text, buckets)
+    return metric
+
+
+class Timer:
+    """
+    Context manager that observes how long its block took in a histogram. Works around awaits too, since it
+    only looks at the clock when the block starts and ends.
+
+        with metrics.Timer(API_SECONDS, endpoint="/quip"):
+            ...
+    """
+
+    def __init__(self, metric, **labels):
+        self.metric = metric
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metric.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+def instrument_client(client):
+    """
+    Wraps the client's send_message and edit_message so every discord send is timed. Every module shares the
+    one client object, so this covers all of them.
+    :param client: The discord Client.
+    :return: None
+    """
+
+    for (method_name, action) in (("send_message", "send"), ("edit_message", "edit")):
+        original = getattr(client, method_name)
+        setattr(client, method_name, _timed_discord_call(original, action))
+
+
+def _timed_discord_call(original, action):
+    """
+    :param original: The client method to wrap.
+    :param action: The action label to record it under.
+    :return: A coroutine function that times and counts calls to original.
+    """
+
+    async def call(*args, **kwargs):
+        outcome = "error"
+        try:
+            with Timer(DISCORD_SECONDS, action=action):
+                result = await original(*args, **kwargs)
+            outcome = "ok"
+            return result
+        finally:
+            DISCORD_CALLS.inc(action=action, outcome=outcome)
+
+    return call
+
+
+def render_prometheus():
+    """
+    :return: Every metric in the Prometheus text exposition format.
+    """
+
+    lines = []
+    for metric in _metrics.values():
+        lines.append("# HELP " + metric.name + " " + metric.help_text)
+        lines.append("# TYPE " + metric.name + " " + metric.kind)
+        lines.extend(metric.render())
+
+    return "\n".join(lines) + "\n"
+
+
+def summary():
+    """
+    :return: A short human readable summary of the latency histograms, for $db stats.
+    """
+
+    lines = []
+    for metric in _metrics.values():
+        if metric.kind != "histogram" or not metric.counts:
+            continue
+
+        lines.append(metric.help_text + ":")
+        for key in sorted(metric.counts):
+            label = ", ".join(value for (_, value) in key) or "all"
+            count = metric.count(key)
+            lines.append("  %s - %d calls, avg %.0f ms, p99 <= %.0f ms, max %.0f ms" % (
+                label, count, metric.sums[key] / count * 1000, metric.quantile(key, 0.99) * 1000,
+                metric.maxes[key] * 1000))
+
+    return "\n".join(lines) if lines else "Nothing has been measured yet."
+
+
+async def start_server():
+    """
+    Starts the scrape endpoint on METRICS_HOST, at METRICS_PORT plus the shard id, if it isn't running already.
+    :return: None
+    """
+
+    global _server
+
+    if _server is not None:
+        return
+
+    port = METRICS_PORT + SHARD_ID
+    try:
+        _server = await asyncio.start_server(_handle_scrape, METRICS_HOST, port)
+        logger.info("serving metrics", url="http://" + METRICS_HOST + ":" + str(port) + "/metrics")
+    except OSError as e:
+        logger.warning("could not start the metrics endpoint", error=str(e))
+
+
+async def _handle_scrape(reader, writer):
+    """
+    Answers a single http request to the scrape endpoint, then closes the connection.
+    """
+
+    try:
+        request_line = await reader.readline()
+
+        # Skip the headers, we don't need any of them.
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            (status, body) = ("200 OK", render_prometheus().encode("utf-8"))
+        else:
+            (status, body) = ("404 Not Found", b"not found\n")
+
+        writer.write(("HTTP/1.1 " + status + "\r\n"
+                      "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                      "Content-Length: " + str(len(body)) + "\r\n"
+                      "Connection: close\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+# The hot path metrics.
+API_SECONDS = histogram("diddlebot_api_request_seconds", "ritdl-ws request latency")
+API_RESPONSES = counter("diddlebot_api_responses_total", "ritdl-ws responses by status")
+API_RETRIES = counter("diddlebot_api_retries_total", "ritdl-ws requests retried")
+API_COALESCED = counter("diddlebot_api_coalesced_total", "ritdl-ws GETs saved by sharing a request in flight")
+API_NOT_MODIFIED = counter("diddlebot_api_not_modified_total", "ritdl-ws GETs answered 304, reusing the parsed body")
+LOG_DROPPED = counter("diddlebot_log_dropped_total", "Log records dropped because the log queue was full")
+EMAIL_SECONDS = histogram("diddlebot_email_seconds", "Email latency, from queueing to sent")
+EMAILS = counter("diddlebot_emails_total", "Emails by outcome")
+DISCORD_SECONDS = histogram("diddlebot_discord_seconds", "Discord send latency")
+DISCORD_CALLS = counter("diddlebot_discord_calls_total", "Discord sends by outcome")
+HANDLER_SECONDS = histogram("diddlebot_handler_seconds", "on_message handler latency")
+COMMAND_SECONDS = histogram("diddlebot_command_seconds", "Command latency")
+MESSAGES = counter("diddlebot_messages_total", "Messages seen, by the rules they triggered")
@@ -0,0 +1,227 @@
+"""
+File outbound.py
+
+Queues messages diddlebot sends to discord. Every channel has its own queue, drained by its own worker that
+stays inside discord's rate limits by waiting for a token before each send, instead of sending until discord
+answers 429. Messages that queue up back to back for the same channel are merged into one send, and messages
+over discord's length limit are split at line boundaries.
+"""
+
+import asyncio
+import collections
+import time
+
+from src import client, SHARD_COUNT
+
+# Discord refuses messages longer than this.
+MAX_MESSAGE_LENGTH = 2000
+
+# Discord allows 5 messages per 5 seconds in a channel...
+CHANNEL_BURST = 5
+CHANNEL_RATE = 1.0
+
+# ...and around 50 requests per second overall. That limit is for the whole bot, so every shard gets an equal
+# share of it.
+GLOBAL_BURST = max(1, 50 // SHARD_COUNT)
+GLOBAL_RATE = 50.0 / SHARD_COUNT
+
+# channel id -> deque of Outgoing messages waiting to be sent
+_queues = {}
+
+# channel id -> the task draining that channel's queue. Workers exit once their queue is empty.
+_workers = {}
+
+# channel id -> TokenBucket, and the bucket shared by every channel.
+_buckets = {}
+_global_bucket = None
+
+
+class TokenBucket:
+    """
+    Hands out permission to send at a steady rate, allowing short bursts.
+    """
+
+    def __init__(self, capacity, rate):
+        """
+        :param capacity: The most sends allowed in a burst.
+        :param rate: Sends allowed per second over time.
+        """
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def reserve(self):
+        """
+        Takes a token, going into debt if there isn't one, so that waiters are served in order.
+        :return: How many seconds to wait before using the token.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class Outgoing:
+    """
+    A message waiting to be sent.
+    """
+
+    def __init__(self, text, coalesce, future):
+        self.text = text
+        self.coalesce = coalesce
+        self.future = future
+
+
+def queue_message(channel, text, coalesce=True):
+    """
+    Queues a message for a channel and returns right away.
+    :param channel: The Channel to send the message to.
+    :param text: The text of the message.
+    :param coalesce: Whether the message may be merged with other queued messages for the channel. Turn this off
+                     for messages that will be edited later.
+    :return: A future for the discord Message that carried the text (the last one, if it had to be split). If the
+             send fails, the future has the exception instead.
+    """
+
+    future = asyncio.get_event_loop().create_future()
+
+    if channel is None:
+        future.set_exception(ValueError("Can't send '" + text[:50] + "' - there is no channel to send it to"))
+        return future
+
+    queue = _queues.get(channel.id)
+    if queue is None:
+        queue = _queues[channel.id] = collections.deque()
+
+    queue.append(Outgoing(text, coalesce, future))
+
+    if channel.id not in _workers:
+        _workers[channel.id] = asyncio.ensure_future(_drain(channel))
+
+    return future
+
+
+async def send_message(channel, text, coalesce=True):
+    """
+    Sends a message through the channel's queue and waits until it has been delivered.
+    :param channel: The Channel to send the message to.
+    :param text: The text of the message.
+    :param coalesce: Whether the message may be merged with other queued messages for the channel.
+    :return: The discord Message that carried the text.
+    """
+
+    return await queue_message(channel, text, coalesce)
+
+
+def split_message(text):
+    """
+    Splits text into pieces discord will accept, breaking at line boundaries where possible.
+    :param text: The text to split.
+    :return: A list of strings no longer than MAX_MESSAGE_LENGTH.
+    """
+
+    if len(text) <= MAX_MESSAGE_LENGTH:
+        return [text]
+
+    chunks = []
+    lines = []
+    length = 0
+
+    for line in text.split("\n"):
+        # A single line that is too long on its own gets cut wherever it has to be.
+        while len(line) > MAX_MESSAGE_LENGTH:
+            if lines:
+                chunks.append("\n".join(lines))
+                lines = []
+                length = 0
+            chunks.append(line[:MAX_MESSAGE_LENGTH])
+            line = line[MAX_MESSAGE_LENGTH:]
+
+        added = len(line) + (1 if lines else 0)
+        if lines and length + added > MAX_MESSAGE_LENGTH:
+            chunks.append("\n".join(lines))
+            lines = []
+            length = 0
+            added = len(line)
+
+        lines.append(line)
+        length += added
+
+    if lines:
+        chunks.append("\n".join(lines))
+
+    return chunks
+
+
+async def _wait_for_token(channel_id):
+    """
+    Waits until both the channel's and the global rate limit allow another send.
+    :param channel_id: The id of the channel about to be sent to.
+    :return: None
+    """
+
+    global _global_bucket
+
+    if _global_bucket is None:
+        _global_bucket = TokenBucket(GLOBAL_BURST, GLOBAL_RATE)
+
+    bucket = _buckets.get(channel_id)
+    if bucket is None:
+        bucket = _buckets[channel_id] = TokenBucket(CHANNEL_BURST, CHANNEL_RATE)
+
+    delay = max(bucket.reserve(), _global_bucket.reserve())
+    if delay > 0:
+        await asyncio.sleep(delay)
+
+
+def _take_batch(queue):
+    """
+    Takes the next message off a queue, along with any messages right behind it that can be merged into it.
+    :param queue: A deque of Outgoing messages.
+    :return: A list of Outgoing messages to send as one.
+    """
+
+    batch = [queue.popleft()]
+
+    if batch[0].coalesce:
+        length = len(batch[0].text)
+        while queue and queue[0].coalesce and length + 1 + len(queue[0].text) <= MAX_MESSAGE_LENGTH:
+            length += 1 + len(queue[0].text)
+            batch.append(queue.popleft())
+
+    return batch
+
+
+async def _drain(channel):
+    """
+    Sends everything in a channel's queue, then exits.
+    :param channel: The Channel whose queue to drain.
+    :return: None
+    """
+
+    queue = _queues[channel.id]
+
+    try:
+        while queue:
+            batch = _take_batch(queue)
+
+            try:
+                sent = None
+                for chunk in split_message("\n".join(outgoing.text for outgoing in batch)):
+                    await _wait_for_token(channel.id)
+                    sent = await client.send_message(channel, chunk)
+
+                for outgoing in batch:
+                    if not outgoing.future.done():
+                        outgoing.future.set_result(sent)
+            except Exception as e:
+                for outgoing in batch:
+                    if not outgoing.future.done():
+                        outgoing.future.set_exception(e)
+    finally:
+        del _workers[channel.id]
+        if not queue:
+            del _queues[channel.id]
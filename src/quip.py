@@ -3,28 +3,213 @@ File quip.py
 
 The quips module of the diddlebot.
 
+Quips are served from a local pool instead of asking ritdl-ws for one on every mention. The pool is drawn
+from like a shuffle bag, so every quip is used once before any quip repeats, and it is refilled in the
+background from one bulk request whenever it runs low. Quips are also kept in the local replica, so the pool
+can be filled without ritdl-ws after a restart or while it is down.
+
 :author Sam Kuzio - sam@skuz.io
 """
 
-from src import client
-from src.util import http_get, http_put
+import asyncio
+import random
+
+from src import log, outbound, replica
+from src.util import http_get, http_get_json, http_put
+
+logger = log.get_logger("quip")
+
+# Endpoint that returns every quip as a JSON list.
+QUIPS_BULK_ENDPOINT = "/quips"
+
+# How many single quips to fetch from /quip per refill if ritdl-ws does not have the bulk endpoint.
+REFILL_SIZE = 10
+
+# A refill starts in the background once this few quips are left in the bag.
+LOW_WATERMARK = 3
+
+# Every quip known locally, and the same quips as a set for quick duplicate checks.
+_quips = []
+_known = set()
+
+# Quips that have not been used yet this round, in shuffled order. Quips are drawn from the end.
+_bag = []
+
+# The last quip that was sent, so a reshuffled bag doesn't start with a repeat.
+_last_quip = None
 
+# Set to False the first time ritdl-ws answers 404 to QUIPS_BULK_ENDPOINT.
+_bulk_supported = True
 
-def add_quip(quip):
+# The refill in progress, if any.
+_refill_task = None
+
+
+async def add_quip(quip):
     """
     Adds a given quip string to the collection of quips and adds it to the quips file.
     :param quip:  The quip string to save.
     :return: True if the quip is added, or already exists. False if an error occurs.
     """
 
-    resp = http_put("/quip", {"quip": quip})
+    resp = await http_put("/quip", {"quip": quip})
     if resp.status_code != 200:
-        print("Unexpected error code " + str(resp.status_code) + " and response body " + resp.content.decode("utf-8"))
+        logger.error("unexpected status code", endpoint="/quip", status=resp.status_code,
+                     body=resp.content.decode("utf-8"))
         return False
     else:
+        if _add_local(quip):
+            await replica.save_quips([quip])
         return True
 
 
+def _add_local(quip):
+    """
+    Adds a quip to the local pool and puts it somewhere in the current bag, so it can come up this round.
+    :param quip: The quip string.
+    :return: True if the quip was new.
+    """
+
+    if quip in _known:
+        return False
+
+    _known.add(quip)
+    _quips.append(quip)
+    _bag.insert(random.randint(0, len(_bag)), quip)
+    return True
+
+
+def _remove_local(quips):
+    """
+    Removes quips from the local pool and the current bag.
+    :param quips: A set of quip strings.
+    :return: None
+    """
+
+    global _quips
+    global _bag
+
+    _known.difference_update(quips)
+    _quips = [quip for quip in _quips if quip not in quips]
+    _bag = [quip for quip in _bag if quip not in quips]
+
+
+async def _fetch_quips():
+    """
+    Fetches quips from ritdl-ws, preferring the bulk endpoint.
+    :return: A tuple of a list of quip strings, possibly empty if something went wrong, and whether the list is
+             every quip ritdl-ws has.
+    """
+
+    global _bulk_supported
+
+    if _bulk_supported:
+        (resp, quips) = await http_get_json(QUIPS_BULK_ENDPOINT)
+        if quips is not None:
+            return quips, True
+        elif resp.status_code == 404:
+            logger.info("bulk endpoint is not available, falling back to single quip requests",
+                        endpoint=QUIPS_BULK_ENDPOINT)
+            _bulk_supported = False
+        else:
+            logger.error("unexpected status code", endpoint=QUIPS_BULK_ENDPOINT, status=resp.status_code,
+                         body=resp.content.decode("utf-8"))
+            return [], False
+
+    responses = await asyncio.gather(*[http_get("/quip") for _ in range(REFILL_SIZE)])
+    return [resp.content.decode("utf-8") for resp in responses if resp.status_code == 200], False
+
+
+async def refill_quips():
+    """
+    Fetches quips from ritdl-ws and merges any new ones into the local pool. When ritdl-ws sends every quip,
+    quips that were deleted there are dropped from the pool and the replica too.
+    :return: The number of new quips.
+    """
+
+    (quips, complete) = await _fetch_quips()
+
+    removed = _known - set(quips) if complete else set()
+    _remove_local(removed)
+    added = [quip for quip in quips if _add_local(quip)]
+
+    if removed:
+        await replica.save_quips(quips, complete=True)
+    elif added:
+        await replica.save_quips(added)
+
+    return len(added)
+
+
+async def load_local_quips():
+    """
+    Fills the pool from the local replica.
+    :return: The number of new quips.
+    """
+
+    return len([quip for quip in (await replica.load_quips() or []) if _add_local(quip)])
+
+
+def start_refill():
+    """
+    Starts a background refill of the pool unless one is already running.
+    :return: The task (future) doing the refill.
+    """
+
+    global _refill_task
+
+    if _refill_task is None or _refill_task.done():
+        _refill_task = asyncio.ensure_future(refill_quips())
+        _refill_task.add_done_callback(_report_refill_error)
+
+    return _refill_task
+
+
+def _report_refill_error(task):
+    """
+    Done callback for refills, so that a failed background refill still gets logged.
+    :param task: The finished refill task.
+    :return: None
+    """
+
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("failed to refill quips", error=repr(task.exception()))
+
+
+async def next_quip():
+    """
+    Draws the next quip from the bag. Only waits on ritdl-ws if no quips have been loaded yet and the replica
+    has none.
+    :return: A quip string, or None if there are no quips.
+    """
+
+    global _bag
+    global _last_quip
+
+    # The replica answers right away, and ritdl-ws is only waited on if the replica has nothing either.
+    if not _quips:
+        await load_local_quips()
+        if _quips:
+            start_refill()
+        else:
+            await asyncio.shield(start_refill())
+        if not _quips:
+            return None
+
+    # Start a new round once every quip has been used.
+    if not _bag:
+        _bag = list(_quips)
+        random.shuffle(_bag)
+        if len(_bag) > 1 and _bag[-1] == _last_quip:
+            _bag[0], _bag[-1] = _bag[-1], _bag[0]
+
+    if len(_bag) <= LOW_WATERMARK:
+        start_refill()
+
+    _last_quip = _bag.pop()
+    return _last_quip
+
+
 async def send_quip(channel):
     """
     Sends a random quip to the given channel.
@@ -32,10 +217,9 @@ async def send_quip(channel):
     :return:None
     """
 
-    resp = http_get("/quip")
+    quip = await next_quip()
 
-    if resp.status_code == 200:
-        quip = resp.content.decode("utf-8")
-        await client.send_message(channel, quip)
+    if quip is not None:
+        await outbound.send_message(channel, quip)
     else:
-        print("quip: Unexpected response code " + resp.status_code + " with message " + resp.content.decode("utf-8"))
+        logger.warning("no quips are available to send", guild=log.guild_of(channel))
@@ -2,22 +2,129 @@
 File reminders.py
 
 Contains functionality for sending reminders about meetings and rehearsals.
-Uses 3rd party module schedule to make scheduling super ez:
-https://github.com/dbader/schedule
+Reminders are declared in reminders.json and run by the scheduler module. Each reminder says when it goes out,
+which channel it goes to, which weeks of the semester it applies to, and what to say if practice is cancelled.
+A little before any reminder that depends on practice, the cancellations are reloaded in one request, so sending
+the reminder never has to wait for ritdl-ws.
 
 :author Sam Kuzio - sam@skuz.io
 """
 
-import schedule
 import asyncio
+import datetime
+import json
+import os
+import zlib
 
-from src import util, cancellations
-from src import CHAN_EBOARD, CHAN_PLAYGROUND, CHAN_ANNOUNCEMENTS
+from src import SHARD_ID, log, util, cancellations, scheduler, outbound, state
+from src.scheduler import Weekly, Ahead
+
+logger = log.get_logger("reminders")
 
 
 # Format that we use to store cancellation dates.
 DATE_FORMAT = "%Y-%m-%d"
 
+# How long, in seconds, a shard's claim on sending a reminder lasts. Long enough that no other shard (or a
+# restarted one) sends the same reminder to the same channel on the same day.
+REMINDER_CLAIM_TTL = 36 * 60 * 60
+
+# How many times a reminder is tried in a channel, and how many seconds apart, before the claim on it is given up.
+REMINDER_SEND_ATTEMPTS = 3
+REMINDER_RETRY_DELAY = 30
+
+# Where the reminders are declared.
+REMINDERS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "reminders.json")
+
+# How long before a reminder that depends on practice the cancellations are reloaded.
+PREFETCH_LEAD = datetime.timedelta(minutes=5)
+
+# Day names that can be used in a reminder's "when", and the weekdays they stand for.
+DAY_NAMES = {
+    "mon": [0], "tue": [1], "wed": [2], "thu": [3], "fri": [4], "sat": [5], "sun": [6],
+    "weekdays": [0, 1, 2, 3, 4], "daily": [0, 1, 2, 3, 4, 5, 6],
+}
+
+# Names of the scheduler jobs for the loaded reminders, so they can be replaced when reloading.
+_job_names = []
+
+
+class Reminder:
+    """
+    A reminder, as declared in the reminders file.
+    """
+
+    def __init__(self, name, when, channel, text, cancelled_text=None, weeks=util.ALL_WEEKS, practice_only=False,
+                 day_offset=0):
+        """
+        :param name: A unique name for the reminder.
+        :param when: A cron-like rule: comma separated day names from DAY_NAMES then a "HH:MM" time,
+                     e.g. "tue,thu 12:00".
+        :param channel: The name of the channel to send it to, in every server.
+        :param text: What to say.
+        :param cancelled_text: What to say instead if practice is cancelled on the day, or None to ignore
+                               cancellations.
+        :param weeks: Which weeks of the semester it goes out on - util.ALL_WEEKS, ODD_WEEKS or EVEN_WEEKS.
+        :param practice_only: Whether it only goes out for days with practice scheduled.
+        :param day_offset: How many days after it goes out the day it is about is, e.g. 1 for a reminder the day
+                           before.
+        """
+        (days, at) = when.split()
+        weekdays = []
+        for day in days.lower().split(","):
+            if day not in DAY_NAMES:
+                raise ValueError("Reminder '" + name + "' has an unknown day '" + day + "'")
+            weekdays.extend(DAY_NAMES[day])
+
+        if weeks not in (util.ALL_WEEKS, util.ODD_WEEKS, util.EVEN_WEEKS):
+            raise ValueError("Reminder '" + name + "' has unknown weeks '" + str(weeks) + "'")
+
+        self.name = name
+        self.rule = Weekly(sorted(set(weekdays)), at)
+        self.channel = channel
+        self.text = text
+        self.cancelled_text = cancelled_text
+        self.weeks = weeks
+        self.practice_only = practice_only
+        self.day_offset = day_offset
+
+    def depends_on_practice(self):
+        """
+        :return: True iff the reminder needs the cancellations to be current when it goes out.
+        """
+        return self.practice_only or self.cancelled_text is not None
+
+    def text_for(self, day):
+        """
+        :param day: The DayInfo of the day the reminder is about.
+        :return: What the reminder should say about the day, or None if it shouldn't go out.
+        """
+        if self.weeks == util.ODD_WEEKS and day.parity != 1:
+            return None
+        if self.weeks == util.EVEN_WEEKS and day.parity != 0:
+            return None
+        if self.practice_only and not day.practice:
+            return None
+
+        if day.cancelled and self.cancelled_text is not None:
+            return self.cancelled_text
+        return self.text
+
+    async def send(self):
+        """
+        Sends the reminder, if it applies today.
+        :return: None
+        """
+        if self.depends_on_practice():
+            # Normally answered from the copy prefetched a few minutes ago.
+            await cancellations.load_cancellations()
+
+        day = util.get_day(datetime.date.today() + datetime.timedelta(days=self.day_offset))
+        text = self.text_for(day)
+
+        if text is not None:
+            await send_to_every_server(self.channel, text)
+
 
 async def init():
     """
@@ -30,105 +137,97 @@ async def init():
     # Create the set of reminders before monitoring them.
     init_reminders()
 
-    await run_scheduler()
+    await scheduler.run()
 
 
 def init_reminders():
     """
-    Initializes the reminders. When reminders should be added or removed, declare them here.
+    Initializes the reminders from the reminders file. When reminders should be added or removed, declare them
+    there.
     :return: None
     """
 
-    # Enable for spam
-    # schedule.every(5).seconds.do(reminder_test)
-    # print("Registered test reminder. Spam incoming!")
-
-    schedule.every().monday.at("12:00").do(reminder_sports_fed_meeting)
-    print("Registered sports federation weekly reminder for every tuesday")
+    schedule_reminders(load_reminders())
 
-    schedule.every().tuesday.at("12:00").do(reminder_practice_every_other_tuesday)
-    schedule.every().thursday.at("12:00").do(reminder_practice)
-    schedule.every().friday.at("17:00").do(reminder_saturday_practice)
-    print("Registered practice reminders")
 
-
-async def run_scheduler():
+def load_reminders(path=None):
     """
-    Runs the scheduler task as a coroutine on the main thread.
-    :return:
+    Reads the reminders file.
+    :param path: The file to read, or None for REMINDERS_FILE.
+    :return: A list of Reminders.
     """
 
-    while True:
-        schedule.run_pending()
-        await asyncio.sleep(1)
+    with open(path or REMINDERS_FILE, 'r', encoding="utf-8") as reminders_file:
+        entries = json.load(reminders_file)
 
+    return [Reminder(**entry) for entry in entries]
 
-def reminder_test():
-    """
-    A test reminder.
-    :return:
-    """
-    cid = util.get_first_channel_by_name(CHAN_PLAYGROUND)
-    text = "Automated reminders test"
-    util.send_message_async(cid, text)
 
-
-def reminder_sports_fed_meeting():
+def schedule_reminders(reminders):
     """
-    Reminder for weekly sports federation meetings.
-    :return:
+    Replaces the scheduled reminders. Reminders that depend on practice also get a job that reloads the
+    cancellations PREFETCH_LEAD before they go out.
+    :param reminders: A list of Reminders.
+    :return: None
     """
-    # Sports fed meeting should only go to eboard.
-    cid = util.get_first_channel_by_name(CHAN_EBOARD)
-
-    # Reminder text
-    text = "REMINDER: The Sports Federation Meeting is scheduled for tomorrow at 11:00am."
 
-    util.send_message_async(cid, text)
+    for name in _job_names:
+        scheduler.remove_job(name)
+    del _job_names[:]
 
+    for reminder in reminders:
+        scheduler.add_job(reminder.name, reminder.rule, reminder.send)
+        _job_names.append(reminder.name)
 
-def reminder_practice_every_other_tuesday():
-    """
-    Remind about practice on odd weeks of the semester.
-    This function exists because while the scheduler can schedule events every other tuesday,
-    it does not know what week of the semester we are currently in.
-    :return:
-    """
+        if reminder.depends_on_practice():
+            name = "prefetch cancellations: " + reminder.name
+            scheduler.add_job(name, Ahead(reminder.rule, PREFETCH_LEAD), cancellations.start_refresh)
+            _job_names.append(name)
 
-    # Only remind us about this stuff on odd weeks.
-    if util.get_week_number() % 2 == 1:
-        reminder_practice()
+    logger.info("registered reminders", count=len(reminders))
 
 
-def reminder_practice():
+async def send_to_every_server(channel_name, text):
     """
-    Reminder for practices.
-    :return:
+    Sends a reminder to the channel with the given name in every server that has one. Every shard runs the
+    reminders, so each channel is claimed in the shared state first, and only the shard that claims it sends.
+    The channels are sent to at the same time, so one that fails doesn't hold up or stop the others.
+    :param channel_name: The name of the channel to send to.
+    :param text: The text of the reminder.
+    :return: None
     """
 
-    # Practice reminders go in the announcements channel
-    cid = util.get_first_channel_by_name(CHAN_ANNOUNCEMENTS)
-
-    if not cancellations.is_cancelled_today():
-        text = ":warning: Reminder: Practice tonight at 9:00! Be there or be :white_large_square:"
-    else:
-        text = "Reminder: NO PRACTICE TODAY! Enjoy your day off!"
+    today = datetime.date.today().strftime(DATE_FORMAT)
+    checksum = str(zlib.crc32(text.encode("utf-8")))
 
-    util.send_message_async(cid, text)
+    await asyncio.gather(*[_send_claimed(channel, "reminder:" + channel.id + ":" + today + ":" + checksum, text)
+                           for channel in util.get_channels_by_name(channel_name)])
 
 
-def reminder_saturday_practice():
+async def _send_claimed(channel, key, text):
     """
-    Reminder for saturday practices
-    :return:
+    Sends a reminder to one channel if this shard can claim it, trying a few times. If it can't be sent, the
+    claim is released, so it isn't counted as sent.
+    :param channel: The Channel.
+    :param key: The shared state key to claim.
+    :param text: The text of the reminder.
+    :return: True iff this shard sent the reminder.
     """
 
-    cid = util.get_first_channel_by_name(CHAN_ANNOUNCEMENTS)
-
-    if not cancellations.is_cancelled_today():
-        text = ":warning: Reminder: Practice tomorrow morning at 10am! Set your alarm now!⏰ :alarm_clock:"
-    else:
-        text = ":warning: Reminder: NO PRACTICE TOMORROW! Turn off that alarm and sleep in!"
+    owner = "shard " + str(SHARD_ID)
+    if not await state.claim(key, owner, REMINDER_CLAIM_TTL):
+        return False
 
-    util.send_message_async(cid, text)
+    for attempt in range(REMINDER_SEND_ATTEMPTS):
+        try:
+            await outbound.send_message(channel, text)
+            return True
+        except Exception as e:
+            logger.warning("could not send reminder", channel=channel.name, guild=log.guild_of(channel),
+                           attempt=attempt + 1, error=repr(e))
+        if attempt + 1 < REMINDER_SEND_ATTEMPTS:
+            await asyncio.sleep(REMINDER_RETRY_DELAY)
 
+    logger.error("gave up sending reminder", channel=channel.name, guild=log.guild_of(channel))
+    await state.release(key, owner)
+    return False
@@ -0,0 +1,332 @@
+"""
+File replica.py
+
+A local SQLite copy of the ritdl-ws state diddlebot reads - the quips and the cancellations - a journal of
+excuses that couldn't be written to ritdl-ws yet, and the excuses waiting for their practice's digest email. The
+in-memory caches in quip.py and cancellations.py are seeded from it when they are empty, so the bot can answer
+right after a restart and keep answering while ritdl-ws is down. Pulls only write the rows that changed, and
+journaled excuses are pushed to ritdl-ws as soon as it is back.
+
+All database work happens on one thread, so it never blocks the event loop.
+"""
+
+import asyncio
+import json
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src import SHARD_ID, SHARD_COUNT, log
+
+logger = log.get_logger("replica")
+
+# The database file, in the current working directory. Each shard has its own, so shards started in the same
+# directory never push the same journaled excuses.
+REPLICA_FILE = "replica.db" if SHARD_COUNT == 1 else "replica-" + str(SHARD_ID) + ".db"
+
+# Seconds between syncs with ritdl-ws.
+SYNC_INTERVAL = 60
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS quips (quip TEXT PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS cancellations (date TEXT PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS excuse_journal (id INTEGER PRIMARY KEY AUTOINCREMENT, record TEXT NOT NULL,
+                                           journaled_at REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS pulls (name TEXT PRIMARY KEY, pulled_at REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS digest (id INTEGER PRIMARY KEY AUTOINCREMENT, practice_date TEXT NOT NULL,
+                                   excuse TEXT NOT NULL);
+"""
+
+# The connection, which is only ever used from the single _db_executor thread.
+_db = None
+_db_executor = None
+
+# The sync loop, if it is running.
+_sync_task = None
+
+
+def _connect():
+    """
+    Opens the database, creating the tables if needed. Runs on the database thread.
+    :return: The connection.
+    """
+
+    global _db
+
+    if _db is None:
+        _db = sqlite3.connect(REPLICA_FILE)
+        _db.executescript(_SCHEMA)
+
+    return _db
+
+
+async def _run(func, *args):
+    """
+    Runs a function with the connection on the database thread.
+    :param func: A function that takes the connection and then args.
+    :return: Whatever func returns.
+    """
+
+    global _db_executor
+
+    if _db_executor is None:
+        _db_executor = ThreadPoolExecutor(max_workers=1)
+
+    return await asyncio.get_event_loop().run_in_executor(_db_executor, lambda: func(_connect(), *args))
+
+
+def _pulled(db, name):
+    """
+    :return: True iff the named table has been pulled from ritdl-ws at least once.
+    """
+    return db.execute("SELECT 1 FROM pulls WHERE name = ?", (name,)).fetchone() is not None
+
+
+def _mark_pulled(db, name):
+    """
+    Records that the named table has just been pulled from ritdl-ws.
+    """
+    db.execute("INSERT OR REPLACE INTO pulls (name, pulled_at) VALUES (?, ?)", (name, time.time()))
+
+
+def _load_quips(db):
+    """
+    :return: A list of the stored quips, or None if they have never been pulled.
+    """
+    if not _pulled(db, "quips"):
+        return None
+    return [row[0] for row in db.execute("SELECT quip FROM quips")]
+
+
+def _save_quips(db, quips, complete):
+    """
+    Stores quips, deleting the ones that aren't in quips if it is complete, and marks them pulled.
+    """
+    with db:
+        if complete:
+            stored = set(row[0] for row in db.execute("SELECT quip FROM quips"))
+            db.executemany("DELETE FROM quips WHERE quip = ?", [(quip,) for quip in stored - set(quips)])
+        db.executemany("INSERT OR IGNORE INTO quips (quip) VALUES (?)", [(quip,) for quip in quips])
+        _mark_pulled(db, "quips")
+
+
+def _load_cancellations(db):
+    """
+    :return: A sorted list of the stored cancelled dates, or None if they have never been pulled.
+    """
+    if not _pulled(db, "cancellations"):
+        return None
+    return [row[0] for row in db.execute("SELECT date FROM cancellations ORDER BY date")]
+
+
+def _save_cancellations(db, dates):
+    """
+    Makes the stored cancellations match dates, touching only the rows that changed, and marks them pulled.
+    """
+    with db:
+        stored = set(row[0] for row in db.execute("SELECT date FROM cancellations"))
+        dates = set(dates)
+        db.executemany("DELETE FROM cancellations WHERE date = ?", [(date,) for date in stored - dates])
+        db.executemany("INSERT INTO cancellations (date) VALUES (?)", [(date,) for date in dates - stored])
+        _mark_pulled(db, "cancellations")
+
+
+def _set_cancelled(db, date, cancelled):
+    """
+    Stores or deletes one cancelled date.
+    """
+    with db:
+        if cancelled:
+            db.execute("INSERT OR IGNORE INTO cancellations (date) VALUES (?)", (date,))
+        else:
+            db.execute("DELETE FROM cancellations WHERE date = ?", (date,))
+
+
+def _journal_excuses(db, records):
+    """
+    Adds excuse records to the journal.
+    """
+    with db:
+        db.executemany("INSERT INTO excuse_journal (record, journaled_at) VALUES (?, ?)",
+                       [(json.dumps(record), time.time()) for record in records])
+
+
+def _pending_excuses(db):
+    """
+    :return: A list of (journal id, excuse record) tuples, oldest first.
+    """
+    return [(row[0], json.loads(row[1])) for row in db.execute("SELECT id, record FROM excuse_journal ORDER BY id")]
+
+
+def _forget_excuses(db, ids):
+    """
+    Deletes excuse records from the journal by journal id.
+    """
+    with db:
+        db.executemany("DELETE FROM excuse_journal WHERE id = ?", [(journal_id,) for journal_id in ids])
+
+
+def _add_to_digest(db, practice_date, excuses):
+    """
+    Adds excuses to a practice's digest.
+    """
+    with db:
+        db.executemany("INSERT INTO digest (practice_date, excuse) VALUES (?, ?)",
+                       [(practice_date, json.dumps(excuse)) for excuse in excuses])
+
+
+def _digest_excuses(db, practice_date):
+    """
+    :return: A list of (digest id, excuse) tuples waiting for a practice's digest, in the order they were added.
+    """
+    return [(row[0], json.loads(row[1])) for row in
+            db.execute("SELECT id, excuse FROM digest WHERE practice_date = ? ORDER BY id", (practice_date,))]
+
+
+def _forget_digest(db, ids):
+    """
+    Deletes excuses from the digest by digest id.
+    """
+    with db:
+        db.executemany("DELETE FROM digest WHERE id = ?", [(digest_id,) for digest_id in ids])
+
+
+def _digest_dates(db):
+    """
+    :return: A sorted list of the practice dates that have excuses waiting for a digest.
+    """
+    return [row[0] for row in db.execute("SELECT DISTINCT practice_date FROM digest ORDER BY practice_date")]
+
+
+async def load_quips():
+    """
+    :return: A list of the quips in the replica, or None if they have never been pulled.
+    """
+    return await _run(_load_quips)
+
+
+async def save_quips(quips, complete=False):
+    """
+    Adds quips to the replica. Quips it already has are left alone.
+    :param quips: A list of quip strings.
+    :param complete: Whether quips is every quip ritdl-ws has, in which case quips that aren't in it are deleted.
+    :return: None
+    """
+    await _run(_save_quips, quips, complete)
+
+
+async def load_cancellations():
+    """
+    :return: A sorted list of the cancelled dates in the replica, or None if they have never been pulled.
+    """
+    return await _run(_load_cancellations)
+
+
+async def save_cancellations(dates):
+    """
+    Makes the replica's cancellations match a full list pulled from ritdl-ws, only touching the dates that
+    changed.
+    :param dates: A list of date strings.
+    :return: None
+    """
+    await _run(_save_cancellations, dates)
+
+
+async def set_cancelled(date, cancelled):
+    """
+    Records a single cancellation change.
+    :param date: A date string.
+    :param cancelled: Whether practice is cancelled on the date.
+    :return: None
+    """
+    await _run(_set_cancelled, date, cancelled)
+
+
+async def journal_excuses(records):
+    """
+    Keeps excuse records that couldn't be written to ritdl-ws, to be pushed later.
+    :param records: A list of excuse record dicts.
+    :return: None
+    """
+    await _run(_journal_excuses, records)
+
+
+async def pending_excuses():
+    """
+    :return: A list of (journal id, excuse record dict) tuples that haven't been pushed yet, oldest first.
+    """
+    return await _run(_pending_excuses)
+
+
+async def forget_excuses(ids):
+    """
+    Drops journaled excuses once they have been pushed.
+    :param ids: A list of journal ids.
+    :return: None
+    """
+    await _run(_forget_excuses, ids)
+
+
+async def add_to_digest(practice_date, excuses):
+    """
+    Keeps excuses until their practice's digest email goes out.
+    :param practice_date: The practice date as a YYYY-MM-DD string.
+    :param excuses: A list of excuses, each a list of fields.
+    :return: None
+    """
+    await _run(_add_to_digest, practice_date, excuses)
+
+
+async def digest_excuses(practice_date):
+    """
+    :param practice_date: The practice date as a YYYY-MM-DD string.
+    :return: A list of (digest id, excuse) tuples for the excuses waiting for the practice's digest, each excuse a
+             list of fields, in the order they were added.
+    """
+    return await _run(_digest_excuses, practice_date)
+
+
+async def forget_digest(ids):
+    """
+    Drops excuses from the digest once it has been sent.
+    :param ids: A list of digest ids.
+    :return: None
+    """
+    await _run(_forget_digest, ids)
+
+
+async def digest_dates():
+    """
+    :return: A sorted list of the YYYY-MM-DD practice dates that have excuses waiting for a digest.
+    """
+    return await _run(_digest_dates)
+
+
+def start_sync(jobs):
+    """
+    Starts syncing with ritdl-ws every SYNC_INTERVAL seconds, unless that is already happening.
+    :param jobs: A list of coroutine functions that each sync one thing, run in order.
+    :return: None
+    """
+
+    global _sync_task
+
+    if _sync_task is None or _sync_task.done():
+        _sync_task = asyncio.ensure_future(_sync_forever(jobs))
+
+
+async def _sync_forever(jobs):
+    """
+    Runs the sync jobs forever. A job that fails is reported and tried again next time.
+    :param jobs: A list of coroutine functions.
+    :return: None
+    """
+
+    while True:
+        for job in jobs:
+            try:
+                await job()
+            except Exception as e:
+                logger.warning("sync failed", job=job.__name__, error=repr(e))
+
+        await asyncio.sleep(SYNC_INTERVAL)
@@ -0,0 +1,270 @@
+"""
+File scheduler.py
+
+A small asyncio scheduler for diddlebot's reminders. Jobs are kept in a min-heap ordered by the next time
+they should run, and the scheduler sleeps until exactly that time instead of polling. Jobs are coroutine
+functions that run as tasks on the event loop, and any error they raise is reported.
+"""
+
+import asyncio
+import datetime
+import functools
+import heapq
+import itertools
+
+from src import log
+
+logger = log.get_logger("scheduler")
+
+# Weekday numbers, as used by datetime.weekday()
+MONDAY = 0
+TUESDAY = 1
+WEDNESDAY = 2
+THURSDAY = 3
+FRIDAY = 4
+SATURDAY = 5
+SUNDAY = 6
+
+# Heap of (next run datetime, sequence number, Job) tuples. The sequence number keeps ties in the order the
+# jobs were added. Removed jobs stay in the heap, marked as removed, until they reach the top.
+_heap = []
+_sequence = itertools.count()
+
+# Every scheduled job by name.
+_jobs = {}
+
+# Set whenever the heap changes so a sleeping scheduler can recalculate how long to sleep.
+_wakeup = None
+
+# The scheduler loop, and the job tasks that are currently running.
+_runner = None
+_running = set()
+
+
+class Weekly:
+    """
+    A rule for something that happens every week at the same time, on one or more days.
+    """
+
+    def __init__(self, weekday, at):
+        """
+        :param weekday: The day of the week, MONDAY through SUNDAY, or a list of them.
+        :param at: The time of day as a "HH:MM" string.
+        """
+        self.weekdays = (weekday,) if isinstance(weekday, int) else tuple(weekday)
+        (hour, minute) = at.split(":")
+        self.time = datetime.time(int(hour), int(minute))
+
+    def next_after(self, moment):
+        """
+        :param moment: A datetime.
+        :return: The first datetime strictly after moment that matches this rule.
+        """
+        candidates = []
+        for weekday in self.weekdays:
+            days_ahead = (weekday - moment.weekday()) % 7
+            candidate = datetime.datetime.combine(moment.date() + datetime.timedelta(days=days_ahead), self.time)
+
+            if candidate <= moment:
+                candidate += datetime.timedelta(days=7)
+
+            candidates.append(candidate)
+
+        return min(candidates)
+
+
+class Ahead:
+    """
+    A rule that fires a fixed amount of time before another rule does.
+    """
+
+    def __init__(self, rule, lead):
+        """
+        :param rule: The rule to run ahead of.
+        :param lead: A timedelta.
+        """
+        self.rule = rule
+        self.lead = lead
+
+    def next_after(self, moment):
+        """
+        :param moment: A datetime.
+        :return: The first datetime strictly after moment that is lead before a time matching the other rule.
+        """
+        return self.rule.next_after(moment + self.lead) - self.lead
+
+
+class Once:
+    """
+    A rule for something that happens once. The job is dropped after it runs.
+    """
+
+    def __init__(self, moment):
+        """
+        :param moment: The datetime to run at.
+        """
+        self.moment = moment
+
+    def next_after(self, moment):
+        """
+        :param moment: A datetime.
+        :return: The time to run at, or None if it isn't after moment.
+        """
+        return self.moment if self.moment > moment else None
+
+
+class Job:
+    """
+    A named coroutine function that runs whenever its rule says so.
+    """
+
+    def __init__(self, name, rule, func):
+        self.name = name
+        self.rule = rule
+        self.func = func
+        self.next_run = None
+        self.removed = False
+
+
+def add_job(name, rule, func):
+    """
+    Schedules a job. Can be called while the scheduler is running. A job that already has the same name is
+    replaced.
+    :param name: A unique name for the job.
+    :param rule: When the job should run - any object with a next_after(datetime) method, like Weekly. Once
+                 next_after returns None the job is dropped.
+    :param func: The coroutine function to run, called with no arguments.
+    :return: The Job.
+    """
+
+    remove_job(name)
+
+    job = Job(name, rule, func)
+    job.next_run = rule.next_after(datetime.datetime.now())
+    if job.next_run is None:
+        return job
+
+    _jobs[name] = job
+    heapq.heappush(_heap, (job.next_run, next(_sequence), job))
+    _wake()
+
+    return job
+
+
+def remove_job(name):
+    """
+    Unschedules a job. Can be called while the scheduler is running. A run of the job that already started
+    is allowed to finish.
+    :param name: The name of the job.
+    :return: True iff there was a job with that name.
+    """
+
+    job = _jobs.pop(name, None)
+    if job is None:
+        return False
+
+    job.removed = True
+    _wake()
+    return True
+
+
+def get_jobs():
+    """
+    :return: A list of the scheduled jobs, soonest first.
+    """
+
+    return sorted(_jobs.values(), key=lambda job: job.next_run)
+
+
+def _wake():
+    """
+    Makes a sleeping scheduler look at the heap again.
+    :return: None
+    """
+
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+async def run():
+    """
+    Runs the scheduler forever. Calling this while the scheduler is already running returns right away, so
+    it is safe to call from on_ready, which can happen more than once.
+    :return: None
+    """
+
+    global _runner
+    global _wakeup
+
+    if _runner is not None and not _runner.done():
+        return
+
+    _wakeup = asyncio.Event()
+    _runner = asyncio.ensure_future(_run_forever())
+    await _runner
+
+
+async def _run_forever():
+    """
+    The scheduler loop: sleeps until the soonest job is due or the heap changes, and runs jobs that are due.
+    :return: None
+    """
+
+    while True:
+        # Throw away removed jobs that have made it to the top.
+        while _heap and _heap[0][2].removed:
+            heapq.heappop(_heap)
+
+        _wakeup.clear()
+
+        if not _heap:
+            await _wakeup.wait()
+            continue
+
+        delay = (_heap[0][0] - datetime.datetime.now()).total_seconds()
+        if delay > 0:
+            try:
+                await asyncio.wait_for(_wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        (_, _, job) = heapq.heappop(_heap)
+        _start(job)
+
+        job.next_run = job.rule.next_after(max(job.next_run, datetime.datetime.now()))
+        if job.next_run is None:
+            if _jobs.get(job.name) is job:
+                del _jobs[job.name]
+        else:
+            heapq.heappush(_heap, (job.next_run, next(_sequence), job))
+
+
+def _start(job):
+    """
+    Runs a job as a tracked task.
+    :param job: The Job to run.
+    :return: None
+    """
+
+    task = asyncio.ensure_future(job.func())
+    _running.add(task)
+    task.add_done_callback(functools.partial(_job_done, job.name))
+
+
+def _job_done(name, task):
+    """
+    Done callback for job tasks. Reports any error the job raised.
+    :param name: The name of the job.
+    :param task: The finished task.
+    :return: None
+    """
+
+    _running.discard(task)
+
+    if task.cancelled():
+        return
+
+    error = task.exception()
+    if error is not None:
+        logger.error("job failed", job=name, exc_info=error)
@@ -0,0 +1,88 @@
+"""
+File startup.py
+
+Times diddlebot's startup, phase by phase, so slow restarts can be tracked down. Phases that run one after
+another are timed with phase(), and work that runs alongside them (like loading config while the gateway
+connects) is timed with track().
+"""
+
+import time
+
+# perf_counter() when the process started, or at least when startup began.
+_began = None
+
+# When the current sequential phase started.
+_phase_started = None
+
+# (name, seconds) of the sequential phases, and of the work that ran alongside them, in the order they ended.
+_phases = []
+_background = []
+
+# Whether the breakdown has been reported. on_ready can happen more than once, but startup only happens once.
+_reported = False
+
+
+def begin(started=None):
+    """
+    Starts timing startup.
+    :param started: The perf_counter() from when the process started, if it was noted, so that imports count.
+    :return: None
+    """
+
+    global _began
+    global _phase_started
+
+    _began = time.perf_counter() if started is None else started
+    _phase_started = _began
+
+
+def end_phase(name):
+    """
+    Ends the current sequential phase and starts the next one.
+    :param name: The name of the phase that just ended.
+    :return: None
+    """
+
+    global _phase_started
+
+    if _began is None or _reported:
+        return
+
+    now = time.perf_counter()
+    _phases.append((name, now - _phase_started))
+    _phase_started = now
+
+
+def track(name, future):
+    """
+    Times work that runs alongside the sequential phases.
+    :param name: The name of the work.
+    :param future: A future or task for the work.
+    :return: The future.
+    """
+
+    started = time.perf_counter()
+    future.add_done_callback(lambda _: _background.append((name, time.perf_counter() - started)))
+    return future
+
+
+def report():
+    """
+    Reports how long startup took, the first time it is called.
+    :return: The breakdown, or None if it has already been reported or startup wasn't timed.
+    """
+
+    global _reported
+
+    if _began is None or _reported:
+        return None
+
+    _reported = True
+
+    text = "Startup took %.0f ms: " % ((time.perf_counter() - _began) * 1000)
+    text += ", ".join("%s %.0f ms" % (name, seconds * 1000) for (name, seconds) in _phases)
+    if _background:
+        text += ". Alongside those: " + ", ".join("%s %.0f ms" % (name, seconds * 1000)
+                                                  for (name, seconds) in _background)
+
+    return text
@@ -0,0 +1,337 @@
+"""
+File state.py
+
+State shared by every shard of diddlebot. When the bot runs as several processes, one per shard group, anything
+that has to be agreed on between them - who sends a reminder, whether a cache is out of date - goes through a
+shared state backend. The backend is pluggable: MemoryBackend keeps everything in this process, which is all a
+single process (or a test) needs, and a deployment with several processes plugs in a backend every process can
+reach. SqliteBackend keeps the state in a SQLite file, which every shard process on the same host can share, and
+is used by default when there is more than one shard. Shards on different hosts need a networked backend, plugged
+in with set_backend.
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src import SHARD_COUNT
+
+# The SQLite file shards share state through, from the DIDDLEBOT_STATE_FILE environment variable. Shards share
+# state by using the same file. With more than one shard it defaults to shared_state.db in the working directory,
+# and with one shard state is only kept in memory unless a file is given.
+STATE_FILE = os.environ.get("DIDDLEBOT_STATE_FILE", "shared_state.db" if SHARD_COUNT > 1 else "")
+
+# Seconds to wait for another process to finish with the state file before giving up.
+SQLITE_TIMEOUT = 10
+
+
+class MemoryBackend:
+    """
+    Shared state kept in a dict in this process. Keys can expire.
+
+    Every backend has these coroutine methods, and each one has to be atomic across all the processes that use
+    the backend.
+    """
+
+    def __init__(self):
+        # key -> (value, monotonic expiry time or None)
+        self.values = {}
+
+    def _live(self, key):
+        """
+        :param key: The key.
+        :return: The (value, expiry) entry of a key that is set and hasn't expired, or None. Expired keys are
+                 dropped.
+        """
+        entry = self.values.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= time.monotonic():
+            del self.values[key]
+            entry = None
+        return entry
+
+    async def get(self, key):
+        """
+        :param key: The key.
+        :return: The value, or None if the key isn't set or has expired.
+        """
+        entry = self._live(key)
+        return None if entry is None else entry[0]
+
+    async def put(self, key, value, ttl=None):
+        """
+        Sets a key.
+        :param key: The key.
+        :param value: The value.
+        :param ttl: Seconds until the key expires, or None to keep it forever.
+        :return: None
+        """
+        self.values[key] = (value, None if ttl is None else time.monotonic() + ttl)
+
+    async def claim(self, key, owner, ttl):
+        """
+        Sets a key only if it isn't set yet.
+        :param key: The key.
+        :param owner: The value to set, usually who is claiming it.
+        :param ttl: Seconds until the claim expires.
+        :return: True iff the key was claimed by this call.
+        """
+        if self._live(key) is not None:
+            return False
+        self.values[key] = (owner, time.monotonic() + ttl)
+        return True
+
+    async def release(self, key, owner):
+        """
+        Gives up a claim, so the key can be claimed again.
+        :param key: The key.
+        :param owner: The value the key was claimed with. Claims held by anyone else are left alone.
+        :return: True iff the claim was released.
+        """
+        entry = self._live(key)
+        if entry is None or entry[0] != owner:
+            return False
+        del self.values[key]
+        return True
+
+    async def incr(self, key):
+        """
+        Adds one to a counter, which starts at 0.
+        :param key: The key.
+        :return: The new value.
+        """
+        entry = self._live(key)
+        value = (0 if entry is None else entry[0]) + 1
+        self.values[key] = (value, None)
+        return value
+
+
+class SqliteBackend:
+    """
+    Shared state kept in a SQLite file, so several processes on one host can share it. Each call is one
+    transaction, and calls that change anything take the file's write lock first (BEGIN IMMEDIATE), so claims
+    and counters are atomic across processes. Values are stored as JSON and expiry uses the wall clock, which
+    every process agrees on.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: The SQLite file.
+        """
+        self.path = path
+        self._db = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def _connect(self):
+        """
+        Opens the state file, creating the table if needed. Runs on the executor thread.
+        :return: The connection.
+        """
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, timeout=SQLITE_TIMEOUT, isolation_level=None)
+            self._db.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                             "expires REAL)")
+        return self._db
+
+    def _transaction(self, write, func, *args):
+        """
+        Runs a function in one transaction, rolling it back if the function raises. Runs on the executor thread.
+        :param write: Whether the function changes anything, so the write lock is taken up front.
+        :param func: A function called with the connection and args.
+        :return: What func returned.
+        """
+        db = self._connect()
+        db.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+        try:
+            result = func(db, *args)
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+        return result
+
+    async def _run(self, write, func, *args):
+        """
+        Runs a transaction on the executor thread, see _transaction.
+        :return: What func returned.
+        """
+        return await asyncio.get_event_loop().run_in_executor(
+            self._executor, lambda: self._transaction(write, func, *args))
+
+    @staticmethod
+    def _live(db, key):
+        """
+        :param db: The connection.
+        :param key: The key.
+        :return: The value of a key that is set and hasn't expired, as a one element tuple, or None.
+        """
+        row = db.execute("SELECT value, expires FROM state WHERE key = ?", (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            return None
+        return (json.loads(row[0]),)
+
+    @staticmethod
+    def _store(db, key, value, ttl):
+        """
+        Sets a key, see put.
+        :return: None
+        """
+        db.execute("INSERT OR REPLACE INTO state (key, value, expires) VALUES (?, ?, ?)",
+                   (key, json.dumps(value), None if ttl is None else time.time() + ttl))
+
+    @staticmethod
+    def _claim(db, key, owner, ttl):
+        """
+        See claim.
+        :return: True iff the key was claimed.
+        """
+        if SqliteBackend._live(db, key) is not None:
+            return False
+        SqliteBackend._store(db, key, owner, ttl)
+        return True
+
+    @staticmethod
+    def _release(db, key, owner):
+        """
+        See release.
+        :return: True iff the claim was released.
+        """
+        if SqliteBackend._live(db, key) != (owner,):
+            return False
+        db.execute("DELETE FROM state WHERE key = ?", (key,))
+        return True
+
+    @staticmethod
+    def _incr(db, key):
+        """
+        See incr.
+        :return: The new value.
+        """
+        entry = SqliteBackend._live(db, key)
+        value = (0 if entry is None else entry[0]) + 1
+        SqliteBackend._store(db, key, value, None)
+        return value
+
+    async def get(self, key):
+        """
+        :param key: The key.
+        :return: The value, or None if the key isn't set or has expired.
+        """
+        entry = await self._run(False, SqliteBackend._live, key)
+        return None if entry is None else entry[0]
+
+    async def put(self, key, value, ttl=None):
+        """
+        Sets a key.
+        :param key: The key.
+        :param value: The value. It has to be JSON serializable.
+        :param ttl: Seconds until the key expires, or None to keep it forever.
+        :return: None
+        """
+        await self._run(True, SqliteBackend._store, key, value, ttl)
+
+    async def claim(self, key, owner, ttl):
+        """
+        Sets a key only if it isn't set yet.
+        :param key: The key.
+        :param owner: The value to set, usually who is claiming it.
+        :param ttl: Seconds until the claim expires.
+        :return: True iff the key was claimed by this call.
+        """
+        return await self._run(True, SqliteBackend._claim, key, owner, ttl)
+
+    async def release(self, key, owner):
+        """
+        Gives up a claim, so the key can be claimed again.
+        :param key: The key.
+        :param owner: The value the key was claimed with. Claims held by anyone else are left alone.
+        :return: True iff the claim was released.
+        """
+        return await self._run(True, SqliteBackend._release, key, owner)
+
+    async def incr(self, key):
+        """
+        Adds one to a counter, which starts at 0.
+        :param key: The key.
+        :return: The new value.
+        """
+        return await self._run(True, SqliteBackend._incr, key)
+
+
+# The backend in use.
+_backend = SqliteBackend(STATE_FILE) if STATE_FILE else MemoryBackend()
+
+
+def set_backend(backend):
+    """
+    Replaces the shared state backend. Do this before the client starts.
+    :param backend: An object with the same coroutine methods as MemoryBackend.
+    :return: None
+    """
+
+    global _backend
+    _backend = backend
+
+
+def get_backend():
+    """
+    :return: The shared state backend in use.
+    """
+
+    return _backend
+
+
+async def get(key):
+    """
+    :param key: The key.
+    :return: The value, or None if the key isn't set or has expired.
+    """
+
+    return await _backend.get(key)
+
+
+async def put(key, value, ttl=None):
+    """
+    Sets a key.
+    :param key: The key.
+    :param value: The value. It has to be JSON serializable.
+    :param ttl: Seconds until the key expires, or None to keep it forever.
+    :return: None
+    """
+
+    await _backend.put(key, value, ttl)
+
+
+async def claim(key, owner, ttl):
+    """
+    Sets a key only if it isn't set yet, across every process that shares the backend.
+    :param key: The key.
+    :param owner: The value to set, usually who is claiming it.
+    :param ttl: Seconds until the claim expires.
+    :return: True iff the key was claimed by this call.
+    """
+
+    return await _backend.claim(key, owner, ttl)
+
+
+async def release(key, owner):
+    """
+    Gives up a claim, so the key can be claimed again.
+    :param key: The key.
+    :param owner: The value the key was claimed with. Claims held by anyone else are left alone.
+    :return: True iff the claim was released.
+    """
+
+    return await _backend.release(key, owner)
+
+
+async def incr(key):
+    """
+    Adds one to a counter, which starts at 0, across every process that shares the backend.
+    :param key: The key.
+    :return: The new value.
+    """
+
+    return await _backend.incr(key)
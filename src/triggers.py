@@ -0,0 +1,124 @@
+"""
+File triggers.py
+
+Matches incoming messages against a table of trigger rules. Each rule says which channels it applies to and
+what text sets it off - a prefix, a keyword anywhere in the message, or an exact message. For each channel,
+the rules are compiled into one case-insensitive regular expression, so every message is matched in a
+single pass without lowercasing or copying its content.
+"""
+
+import re
+
+
+class Rule:
+    """
+    A trigger rule. A rule with no prefix, keyword or exact text is a channel rule: it fires on every message in
+    its channels. Of the other rules, only the first one in the table that matches a message fires.
+    """
+
+    def __init__(self, name, handler, prefix=None, keyword=None, exact=None, channels=None, exclude_channels=()):
+        """
+        :param name: A name for the rule, used for metrics and logging.
+        :param handler: Coroutine function called with the message when the rule fires.
+        :param prefix: Text the message has to start with.
+        :param keyword: Text that has to appear anywhere in the message.
+        :param exact: Text the whole message has to be.
+        :param channels: Names of the only channels the rule applies in, or None for all channels.
+        :param exclude_channels: Names of channels the rule never applies in.
+        """
+        self.name = name
+        self.handler = handler
+        self.prefix = prefix
+        self.keyword = keyword
+        self.exact = exact
+        self.channels = None if channels is None else frozenset(channels)
+        self.exclude_channels = frozenset(exclude_channels)
+
+    def applies_in(self, channel_name):
+        """
+        :param channel_name: The name of a channel.
+        :return: True iff this rule may fire in that channel.
+        """
+        if channel_name in self.exclude_channels:
+            return False
+        return self.channels is None or channel_name in self.channels
+
+    def pattern(self):
+        """
+        :return: A regular expression fragment that matches at the start of a message that triggers this rule,
+                 or None for a channel rule.
+        """
+        if self.prefix is not None:
+            return re.escape(self.prefix)
+        if self.keyword is not None:
+            # Look ahead so the match stays anchored at the start and rules keep their priority order.
+            return "(?=[\\s\\S]*?" + re.escape(self.keyword) + ")"
+        if self.exact is not None:
+            return re.escape(self.exact) + "\\Z"
+        return None
+
+
+class Matcher:
+    """
+    The rules that apply in one channel, compiled.
+    """
+
+    def __init__(self, rules, channel_name):
+        applicable = [rule for rule in rules if rule.applies_in(channel_name)]
+
+        self.channel_rules = [rule for rule in applicable if rule.pattern() is None]
+        self.text_rules = [rule for rule in applicable if rule.pattern() is not None]
+
+        if self.text_rules:
+            alternatives = ["(?P<r" + str(i) + ">" + rule.pattern() + ")" for (i, rule) in enumerate(self.text_rules)]
+            self.regex = re.compile("\\A(?:" + "|".join(alternatives) + ")", re.IGNORECASE)
+        else:
+            self.regex = None
+
+    def match(self, content):
+        """
+        :param content: The text of a message.
+        :return: A list of the rules that fire for the message: every channel rule, then the first text rule
+                 that matches, if any.
+        """
+        if self.regex is not None:
+            found = self.regex.match(content)
+            if found is not None:
+                return self.channel_rules + [self.text_rules[int(found.lastgroup[1:])]]
+
+        return self.channel_rules
+
+
+class TriggerTable:
+    """
+    A table of trigger rules, compiled lazily per channel.
+    """
+
+    def __init__(self, rules):
+        """
+        :param rules: A list of Rules, highest priority first.
+        """
+        self.rules = list(rules)
+        self._matchers = {}
+
+    def add(self, rule):
+        """
+        Adds a rule at the lowest priority.
+        :param rule: The Rule to add.
+        :return: None
+        """
+        self.rules.append(rule)
+        self._matchers.clear()
+
+    def match(self, channel_name, content):
+        """
+        :param channel_name: The name of the channel the message was sent in.
+        :param content: The text of the message.
+        :return: A list of the rules that fire for the message, in the order they should run.
+        """
+        matcher = self._matchers.get(channel_name)
+        if matcher is None:
+            matcher = Matcher(self.rules, channel_name)
+            self._matchers[channel_name] = matcher
+
+        return matcher.match(content)
@@ -7,12 +7,19 @@ Contains helpful utility methods for the diddblebot.
 """
 
 import asyncio
+import collections
 import discord
-from datetime import date
+import functools
+import json
+import random
+import re
 import time
-import requests
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
 
-from src import client, ROLE_EBOARD
+from src import client, ROLE_EBOARD, log, metrics
+
+logger = log.get_logger("util")
 
 
 # The start date of the semester. Useful for calculating whether it's an even or odd week.
@@ -22,35 +29,200 @@ from src import client, ROLE_EBOARD
 # accounted for.
 SEMESTER_START_DATE = date(2019, 1, 14)
 
+# How many weeks from SEMESTER_START_DATE the semester calendar covers. Days outside of it are still answered,
+# just worked out on the spot instead of looked up.
+SEMESTER_WEEKS = 20
+
+# Which weeks of the semester a practice day has practice on.
+ALL_WEEKS = "all"
+ODD_WEEKS = "odd"
+EVEN_WEEKS = "even"
+
+# Weekday (as in date.weekday()) -> the weeks there is practice on that day.
+PRACTICE_SCHEDULE = {
+    1: ODD_WEEKS,   # Tuesday
+    3: ALL_WEEKS,   # Thursday
+    5: ALL_WEEKS,   # Saturday
+}
+
 # The base url of the ritdl-ws rest api.
 API_BASE_URL = "http://localhost:3000/api"
 
+# The most requests to ritdl-ws that may be in flight at once. This is also the size of the keep-alive
+# connection pool, so every worker thread can hold on to its own connection between requests.
+API_MAX_CONNECTIONS = 8
+
+# (connect, read) timeouts in seconds used when no entry in API_TIMEOUTS matches an endpoint.
+API_DEFAULT_TIMEOUT = (3.05, 10)
+
+# Per-endpoint (connect, read) timeouts. The longest endpoint prefix that matches a request wins.
+API_TIMEOUTS = {
+    "/quip": (3.05, 5),
+    "/cancellations": (3.05, 5),
+    "/attendance": (3.05, 15),
+}
+
+# How many times a GET is retried after a connection error, timeout or 5xx response, and the base of the
+# exponential backoff between tries in seconds. Each wait is a random amount up to the backoff ("full jitter").
+# Only GETs are retried, since they are safe to repeat.
+API_RETRIES = 2
+API_RETRY_BACKOFF = 0.2
+
+# Every request earns this fraction of a retry, up to API_RETRY_BUDGET_MAX saved up retries, and every retry
+# spends one. This keeps retries to about a tenth of the traffic, so they can't pile onto a struggling ritdl-ws.
+API_RETRY_BUDGET_RATIO = 0.1
+API_RETRY_BUDGET_MAX = 10
+
+# After this many failed requests in a row, the circuit breaker opens and requests fail right away for
+# API_BREAKER_COOLDOWN seconds. Then a single probe request is let through (half-open): if it works the
+# circuit closes, and if it fails the circuit opens again.
+API_BREAKER_THRESHOLD = 5
+API_BREAKER_COOLDOWN = 30
+
+# Endpoint prefixes whose GETs are single-flight: while one is in flight, identical GETs wait for it and share
+# its response instead of sending their own. Only endpoints where every caller wants the same answer belong
+# here - not /quip, which returns a different random quip every time.
+SINGLE_FLIGHT_ENDPOINTS = (
+    "/quips",
+    "/cancellations",
+    "/attendance/excuses",
+)
+
+# A parsed JSON response kept for conditional GETs: the ETag and Last-Modified validators ritdl-ws sent with it,
+# and the parsed body.
+Validated = collections.namedtuple("Validated", ["etag", "last_modified", "body"])
+
+# Matches endpoint path segments that contain a digit, see endpoint_label.
+_VARYING_SEGMENT = re.compile(r"/[^/]*[0-9][^/]*")
+
+# Index of server id -> channel name -> the channels in that server with that name.
+_channel_index = {}
+
+# Cache of server id -> (eboard role id, set of eboard member ids), kept current by member and role events.
+_eboard_cache = {}
+
+# A day of the semester calendar. parity is 1 on odd weeks and 0 on even weeks, practice is whether practice is
+# normally scheduled that day and cancelled is whether the day has been cancelled.
+DayInfo = collections.namedtuple("DayInfo", ["date", "week", "parity", "practice", "cancelled"])
+
+# The semester calendar: a DayInfo for every day, indexed by days since _calendar_start. Rebuilt when it is
+# None or SEMESTER_START_DATE no longer matches _calendar_start.
+_calendar = None
+_calendar_start = None
 
-def get_first_channel_by_name(name):
+# Day offsets of every practice that isn't cancelled, in order, and for every day offset, the index in
+# _practice_offsets of the first such practice on or after that day.
+_practice_offsets = []
+_next_practice = []
+
+# Every day practice is known to be cancelled on, kept current by the cancellations module.
+_cancelled_days = set()
+
+# Single-flight GETs in progress, by endpoint (with " json" added for http_get_json).
+_in_flight = {}
+
+# The last Validated response by endpoint, for http_get_json.
+_validated = {}
+
+# The shared requests session and the threads that drive it. Both are created the first time the api is used.
+_http_session = None
+_http_executor = None
+
+
+def build_channel_index():
     """
-    Gets the id of the channel with the given name. Will search all the channels the bot can see, but just
-    because the bot can see a channel does NOT mean the bot can message that channel.
-    NOTE: If the bot has access to multiple channels with the given name, returns the id of the first.
-    :param name: The name of the channel to find.
-    :return: The ID of the first channel with the given name, or None if there's no access to the given channel.
+    Builds the channel name index from every channel the bot can currently see. Should be called once the
+    client is ready - after that the index is kept up to date through the channel and server events.
+    :return: None
     """
 
+    _channel_index.clear()
+
     for chan in client.get_all_channels():
-        if chan.name == name:
-            return chan
+        index_channel(chan)
+
+
+def index_channel(channel):
+    """
+    Adds a channel to the channel name index.
+    :param channel: The Channel that was created or became visible.
+    :return: None
+    """
+
+    if channel.is_private or channel.server is None:
+        return
+
+    _channel_index.setdefault(channel.server.id, {}).setdefault(channel.name, []).append(channel)
 
-    return None
 
+def unindex_channel(channel):
+    """
+    Removes a channel from the channel name index.
+    :param channel: The Channel that was deleted, or the old version of a Channel that was updated.
+    :return: None
+    """
+
+    if channel.is_private or channel.server is None:
+        return
+
+    by_name = _channel_index.get(channel.server.id)
+    if by_name is None or channel.name not in by_name:
+        return
+
+    remaining = [chan for chan in by_name[channel.name] if chan.id != channel.id]
+    if remaining:
+        by_name[channel.name] = remaining
+    else:
+        del by_name[channel.name]
+
+
+def index_server(server):
+    """
+    Adds all of the channels in a server to the channel name index.
+    :param server: The Server that the bot joined or that became available.
+    :return: None
+    """
+
+    unindex_server(server)
+    for chan in server.channels:
+        index_channel(chan)
 
-def send_message_async(channel, text):
+
+def unindex_server(server):
     """
-    A convenience method for sending messages from synchronous methods.
-    :param channel: The Channel to send the message to
-    :param text: The text of the message
+    Removes all of the channels in a server from the channel name index.
+    :param server: The Server that the bot left or that became unavailable.
     :return: None
     """
 
-    asyncio.run_coroutine_threadsafe(client.send_message(channel, text), client.loop)
+    _channel_index.pop(server.id, None)
+
+
+def get_channel_by_name(server, name):
+    """
+    Gets the channel with the given name in the given server. Just because the bot can see a channel
+    does NOT mean the bot can message that channel.
+    :param server: The Server to look in.
+    :param name: The name of the channel to find.
+    :return: The first Channel in the server with the given name, or None if there is no such channel.
+    """
+
+    if server is None:
+        return None
+
+    chans = _channel_index.get(server.id, {}).get(name)
+    return chans[0] if chans else None
+
+
+def get_channels_by_name(name):
+    """
+    Gets the channel with the given name in every server that has one, for things like reminders that go
+    out to every server.
+    :param name: The name of the channels to find.
+    :return: A list with the first Channel of that name from each server.
+    """
+
+    return [by_name[name][0] for by_name in _channel_index.values() if name in by_name]
 
 
 def delta_weeks(date1, date2):
@@ -65,22 +237,140 @@ def delta_weeks(date1, date2):
     return (date2 - date1).days/7
 
 
-def get_week_number():
+def _day_info(day):
+    """
+    Works out the calendar entry for a day.
+    :param day: A date.
+    :return: The DayInfo for the day.
+    """
+
+    week = (delta_weeks(SEMESTER_START_DATE, day) // 1) + 1
+    parity = int(week % 2)
+    weeks = PRACTICE_SCHEDULE.get(day.weekday())
+    practice = weeks == ALL_WEEKS or (weeks == ODD_WEEKS and parity == 1) or (weeks == EVEN_WEEKS and parity == 0)
+
+    return DayInfo(day, int(week), parity, practice, day in _cancelled_days)
+
+
+def _get_calendar():
+    """
+    Gets the semester calendar, building it first if the semester or the cancellations have changed.
+    :return: A list with a DayInfo for every day of the semester.
+    """
+
+    global _calendar
+    global _calendar_start
+    global _practice_offsets
+    global _next_practice
+
+    if _calendar is not None and _calendar_start == SEMESTER_START_DATE:
+        return _calendar
+
+    calendar = [_day_info(SEMESTER_START_DATE + timedelta(days=offset)) for offset in range(SEMESTER_WEEKS * 7)]
+
+    practice_offsets = [offset for (offset, info) in enumerate(calendar) if info.practice and not info.cancelled]
+    next_practice = []
+    index = 0
+    for offset in range(len(calendar)):
+        while index < len(practice_offsets) and practice_offsets[index] < offset:
+            index += 1
+        next_practice.append(index)
+
+    (_calendar, _calendar_start, _practice_offsets, _next_practice) = \
+        (calendar, SEMESTER_START_DATE, practice_offsets, next_practice)
+
+    return _calendar
+
+
+def get_day(day=None):
+    """
+    Looks up a day in the semester calendar.
+    :param day: A date, or None for today.
+    :return: The DayInfo for the day.
+    """
+
+    if day is None:
+        day = date.today()
+
+    calendar = _get_calendar()
+    offset = (day - _calendar_start).days
+
+    if 0 <= offset < len(calendar):
+        return calendar[offset]
+
+    return _day_info(day)
+
+
+def get_week_number(day=None):
     """
     Determines what week of the semester it is.
+    :param day: A date, or None for today.
     :return: The week number of the semester
     """
 
-    stringtime = time.strftime("%Y,%m,%d")
-    datearray = stringtime.split(",")
+    return get_day(day).week
+
+
+def is_practice_on(day=None):
+    """
+    :param day: A date, or None for today.
+    :return: True iff practice is scheduled on the day and hasn't been cancelled.
+    """
+
+    info = get_day(day)
+    return info.practice and not info.cancelled
+
+
+def next_practices(count, day=None):
+    """
+    Finds the next practices that haven't been cancelled, within the semester calendar.
+    :param count: How many practices to find.
+    :param day: The date to start looking from, inclusive, or None for today.
+    :return: A list of up to count dates.
+    """
+
+    if day is None:
+        day = date.today()
+
+    calendar = _get_calendar()
+    offset = max(0, (day - _calendar_start).days)
+
+    if offset >= len(calendar):
+        return []
+
+    start = _next_practice[offset]
+    return [calendar[practice].date for practice in _practice_offsets[start:start + count]]
+
+
+def set_cancelled_days(days):
+    """
+    Replaces the days practice is cancelled on. The calendar is rebuilt the next time it is used.
+    :param days: An iterable of dates.
+    :return: None
+    """
+
+    global _cancelled_days
+    global _calendar
 
-    year = int(datearray[0])
-    month = int(datearray[1])
-    day = int(datearray[2])
+    _cancelled_days = set(days)
+    _calendar = None
+
+
+def set_cancelled(day, cancelled):
+    """
+    Marks practice on a day as cancelled or not. The calendar is rebuilt the next time it is used.
+    :param day: A date.
+    :param cancelled: Whether practice is cancelled that day.
+    :return: None
+    """
 
-    current_date = date(year, month, day)
+    global _calendar
 
-    return (delta_weeks(SEMESTER_START_DATE, current_date) // 1) + 1
+    if cancelled:
+        _cancelled_days.add(day)
+    else:
+        _cancelled_days.discard(day)
+    _calendar = None
 
 
 def is_member_eboard(member):
@@ -91,29 +381,492 @@ def is_member_eboard(member):
     """
 
     if type(member) is not discord.Member:
-        print("Given object is not a server member - make sure they're sending the message from a server and not DMs.")
+        logger.warning("Given object is not a server member - make sure they're sending the message from a server and "
+                       "not DMs.")
         return False
 
+    return member.id in _get_eboard_entry(member.server)[1]
+
+
+def get_eboard_members(server):
+    """
+    Gets everyone in the given server who is on eboard.
+    :param server: The Server to check.
+    :return: A frozenset of the ids of the eboard members.
+    """
+
+    return frozenset(_get_eboard_entry(server)[1])
+
+
+def _get_eboard_entry(server):
+    """
+    Gets the cached eboard membership for a server, resolving it from the ROLE_EBOARD role the first time.
+    :param server: The Server to get the eboard for.
+    :return: A (role id, set of member ids) tuple. The role id is None if the server has no eboard role.
+    """
+
+    entry = _eboard_cache.get(server.id)
+
+    if entry is None:
+        role = discord.utils.get(server.roles, name=ROLE_EBOARD)
+        if role is None:
+            entry = (None, set())
+        else:
+            entry = (role.id, set(member.id for member in server.members if _has_role(member, role.id)))
+        _eboard_cache[server.id] = entry
+
+    return entry
+
+
+def _has_role(member, role_id):
+    """
+    :param member: A Member object.
+    :param role_id: The id of a Role.
+    :return: True iff the member has the role.
+    """
+
     for role in member.roles:
-        if role.name == ROLE_EBOARD:
+        if role.id == role_id:
             return True
 
     return False
 
 
-def http_get(endpoint):
+def update_eboard_member(member):
+    """
+    Updates the cached eboard membership after a member's roles may have changed.
+    :param member: The Member as they are now.
+    :return: None
     """
-    Given an ritdl-ws enpoint, makes an HTTP GET request.
+
+    entry = _eboard_cache.get(member.server.id)
+    if entry is None or entry[0] is None:
+        return
+
+    (role_id, member_ids) = entry
+    if _has_role(member, role_id):
+        member_ids.add(member.id)
+    else:
+        member_ids.discard(member.id)
+
+
+def remove_eboard_member(member):
+    """
+    Drops a member who left a server from the cached eboard membership.
+    :param member: The Member who left.
+    :return: None
+    """
+
+    entry = _eboard_cache.get(member.server.id)
+    if entry is not None:
+        entry[1].discard(member.id)
+
+
+def invalidate_eboard_cache(server):
+    """
+    Forgets the cached eboard membership for a server, e.g. after the eboard role was renamed or deleted.
+    It is resolved again the next time it is needed.
+    :param server: The Server.
+    :return: None
+    """
+
+    _eboard_cache.pop(server.id, None)
+
+
+# Reply to commands that need ritdl-ws while it can't be reached.
+API_DOWN_TEXT = "ritdl-ws is down right now, so I couldn't do that - try again in a bit. ($db apistatus has more.)"
+
+
+class ApiUnavailable(OSError):
+    """
+    Raised instead of calling ritdl-ws while the circuit breaker is open. It is an OSError, like the errors
+    requests raises when ritdl-ws can't be reached, so callers that handle one handle both.
+    """
+    pass
+
+
+class CircuitBreaker:
+    """
+    Stops calling ritdl-ws for a while after it fails too many times in a row.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, threshold, cooldown):
+        """
+        :param threshold: How many failures in a row open the circuit.
+        :param cooldown: How many seconds the circuit stays open before a probe is let through.
+        """
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = CircuitBreaker.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.probe_started = 0.0
+        self.last_error = None
+
+    def allow(self):
+        """
+        :return: True iff a request may be sent now. In the half-open state only one probe is allowed at a time,
+                 unless a probe has gone unanswered for a whole cooldown.
+        """
+        if self.state == CircuitBreaker.CLOSED:
+            return True
+
+        if self.state == CircuitBreaker.OPEN:
+            if time.monotonic() - self.opened_at < self.cooldown:
+                return False
+            self.state = CircuitBreaker.HALF_OPEN
+            self.probing = False
+
+        if self.probing and time.monotonic() - self.probe_started < self.cooldown:
+            return False
+
+        self.probing = True
+        self.probe_started = time.monotonic()
+        return True
+
+    def record_success(self):
+        if self.state != CircuitBreaker.CLOSED:
+            logger.info("ritdl-ws is back, circuit closed")
+        self.state = CircuitBreaker.CLOSED
+        self.failures = 0
+        self.probing = False
+
+    def record_failure(self, error):
+        """
+        :param error: What went wrong, for the status report.
+        """
+        self.failures += 1
+        self.probing = False
+        self.last_error = error
+
+        if self.state == CircuitBreaker.HALF_OPEN or self.failures >= self.threshold:
+            if self.state != CircuitBreaker.OPEN:
+                logger.warning("ritdl-ws is failing, circuit opened", failures=self.failures, error=error,
+                               cooldown=self.cooldown)
+            self.state = CircuitBreaker.OPEN
+            self.opened_at = time.monotonic()
+
+    def seconds_until_probe(self):
+        """
+        :return: Seconds until the next probe is allowed while open, otherwise 0.
+        """
+        if self.state != CircuitBreaker.OPEN:
+            return 0.0
+        return max(0.0, self.cooldown - (time.monotonic() - self.opened_at))
+
+
+class RetryBudget:
+    """
+    Limits retries to a fraction of requests.
+    """
+
+    def __init__(self, ratio, maximum):
+        """
+        :param ratio: The fraction of a retry each request earns.
+        :param maximum: The most retries that can be saved up.
+        """
+        self.ratio = ratio
+        self.maximum = maximum
+        self.tokens = float(maximum)
+
+    def deposit(self):
+        self.tokens = min(self.maximum, self.tokens + self.ratio)
+
+    def withdraw(self):
+        """
+        :return: True iff there was a retry to spend.
+        """
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+# The circuit breaker and retry budget shared by every ritdl-ws call.
+_breaker = CircuitBreaker(API_BREAKER_THRESHOLD, API_BREAKER_COOLDOWN)
+_retry_budget = RetryBudget(API_RETRY_BUDGET_RATIO, API_RETRY_BUDGET_MAX)
+
+
+def get_api_status():
+    """
+    :return: A short human readable description of ritdl-ws's health, for $db apistatus.
+    """
+
+    if _breaker.state == CircuitBreaker.CLOSED:
+        text = "ritdl-ws looks healthy (circuit closed)"
+        if _breaker.failures:
+            text += ", " + str(_breaker.failures) + " failure(s) in a row so far"
+    elif _breaker.state == CircuitBreaker.OPEN and _breaker.seconds_until_probe() > 0:
+        text = "ritdl-ws is down (circuit open) - I'll try it again in %.0f seconds" % _breaker.seconds_until_probe()
+    else:
+        text = "ritdl-ws was down (circuit half-open) - " + \
+               ("checking whether it's back now" if _breaker.probing else "the next request will check if it's back")
+
+    if _breaker.last_error is not None:
+        text += "\nLast error: " + _breaker.last_error
+    text += "\nRetries available: %.1f of %d" % (_retry_budget.tokens, _retry_budget.maximum)
+
+    return text
+
+
+def get_http_session():
+    """
+    Gets the requests session shared by all ritdl-ws calls, creating it if needed. The session keeps
+    connections to the api alive between requests instead of opening a new one every time.
+    :return: A requests Session object.
+    """
+
+    global _http_session
+
+    if _http_session is None:
+        # requests is slow to import, so it's left until the api is first used instead of slowing down startup.
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=API_MAX_CONNECTIONS)
+        _http_session = requests.Session()
+        _http_session.mount("http://", adapter)
+        _http_session.mount("https://", adapter)
+
+    return _http_session
+
+
+def close_http_session():
+    """
+    Closes the shared session and its connections. The next api call will open a new one.
+    :return: None
+    """
+
+    global _http_session
+    global _http_executor
+
+    if _http_session is not None:
+        _http_session.close()
+        _http_session = None
+
+    if _http_executor is not None:
+        _http_executor.shutdown(wait=False)
+        _http_executor = None
+
+
+def get_timeout(endpoint):
+    """
+    Finds the timeouts to use for a request to the given endpoint.
+    :param endpoint: The api endpoint.
+    :return: A (connect, read) tuple of timeouts in seconds.
+    """
+
+    best = None
+    for prefix in API_TIMEOUTS:
+        if endpoint.startswith(prefix) and (best is None or len(prefix) > len(best)):
+            best = prefix
+
+    return API_DEFAULT_TIMEOUT if best is None else API_TIMEOUTS[best]
+
+
+async def http_request(method, endpoint, data=None, json=None, headers=None):
+    """
+    Makes an HTTP request to ritdl-ws without blocking the event loop. The request itself runs on one of
+    API_MAX_CONNECTIONS worker threads over the shared session, so many requests can be in flight at once.
+    GETs that fail are retried with jittered backoff while the retry budget allows, and nothing is sent while
+    the circuit breaker is open.
+    :param method: The HTTP method, e.g. "GET"
     :param endpoint: An endpoint string formatted as "/[endpoint][vars]" that will be appended to the
-                     API_BASE_ENDPOINT string.
+                     API_BASE_URL string.
+    :param data: A dictionary that represents the body of the request, or None.
+    :param json: An object to send as a JSON body instead of data, or None.
+    :param headers: A dictionary of extra request headers, or None.
     :return: A Response object: http://docs.python-requests.org/en/latest/api/#requests.Response
+    :raises OSError: If ritdl-ws couldn't be reached - ApiUnavailable if the circuit breaker is open.
     """
 
+    label = endpoint_label(endpoint)
+    attempts = 1 + (API_RETRIES if method == "GET" else 0)
+    _retry_budget.deposit()
+
+    for attempt in range(attempts):
+        if not _breaker.allow():
+            metrics.API_RESPONSES.inc(method=method, endpoint=label, status="circuit open")
+            raise ApiUnavailable("ritdl-ws is unavailable, not calling " + endpoint)
+
+        try:
+            res = await _send(method, endpoint, data, json, headers, label)
+        except OSError as e:
+            res = None
+            error = e
+            failure = repr(e)
+            logger.info("request failed", method=method, endpoint=label, attempt=attempt + 1, error=repr(e),
+                        sample=0.1)
+        else:
+            if res.status_code < 500:
+                _breaker.record_success()
+                return res
+            failure = "status " + str(res.status_code) + " from " + endpoint
+
+        # Out of tries, out of budget, or a probe that failed: count one failure for the whole request, however
+        # many attempts it took, and hand back the last answer we got.
+        if attempt + 1 == attempts or _breaker.state == CircuitBreaker.HALF_OPEN or not _retry_budget.withdraw():
+            _breaker.record_failure(failure)
+            if res is not None:
+                return res
+            raise error
+
+        metrics.API_RETRIES.inc(method=method, endpoint=label)
+        await asyncio.sleep(random.uniform(0, API_RETRY_BACKOFF * 2 ** attempt))
+
+
+async def _send(method, endpoint, data, json, headers, label):
+    """
+    Sends one request to ritdl-ws on the worker threads, and records how long it took.
+    :return: A Response object.
+    """
+
+    global _http_executor
+
+    if _http_executor is None:
+        _http_executor = ThreadPoolExecutor(max_workers=API_MAX_CONNECTIONS)
+
     url = API_BASE_URL + endpoint
-    return requests.get(url)
+    call = functools.partial(get_http_session().request, method, url, data=data, json=json, headers=headers,
+                             timeout=get_timeout(endpoint))
+
+    status = "error"
+    started = time.perf_counter()
+    try:
+        with metrics.Timer(metrics.API_SECONDS, method=method, endpoint=label):
+            res = await asyncio.get_event_loop().run_in_executor(_http_executor, call)
+        status = res.status_code
+        return res
+    finally:
+        metrics.API_RESPONSES.inc(method=method, endpoint=label, status=status)
+        logger.debug("request", method=method, endpoint=label, status=status,
+                     latency_ms=round((time.perf_counter() - started) * 1000, 1))
+
+
+def endpoint_label(endpoint):
+    """
+    Turns an endpoint into something to group metrics by, replacing the parts that vary (like dates) so that
+    e.g. every /cancellations/cancel/YYYY-MM-DD request is counted together.
+    :param endpoint: The api endpoint.
+    :return: The endpoint with every path segment that contains a digit replaced with ":arg".
+    """
+
+    return _VARYING_SEGMENT.sub("/:arg", endpoint.split("?", 1)[0])
+
+
+async def http_get(endpoint):
+    """
+    Given an ritdl-ws enpoint, makes an HTTP GET request. GETs to SINGLE_FLIGHT_ENDPOINTS share a request that
+    is already in flight for the same endpoint.
+    :param endpoint: An endpoint string formatted as "/[endpoint][vars]" that will be appended to the
+                     API_BASE_ENDPOINT string.
+    :return: A Response object: http://docs.python-requests.org/en/latest/api/#requests.Response
+    """
 
+    return await _single_flight(endpoint, functools.partial(_get, endpoint))
 
-def http_put(endpoint, data):
+
+async def http_get_json(endpoint):
+    """
+    Makes an HTTP GET request for a JSON body. When ritdl-ws sent an ETag or Last-Modified with the last body,
+    the request is conditional, and if the body hasn't changed ritdl-ws answers 304 and the body parsed last time
+    is reused instead of being downloaded and parsed again. Shares requests in flight like http_get.
+    :param endpoint: The api endpoint.
+    :return: A tuple of the Response and the parsed body, or None for the body if the status was neither 200 nor
+             304. The body may be shared with other callers, so don't modify it.
+    """
+
+    return await _single_flight(endpoint + " json", functools.partial(_get_json, endpoint), endpoint)
+
+
+async def _single_flight(key, get, endpoint=None):
+    """
+    Runs a GET, sharing it with identical GETs already in flight if the endpoint is in SINGLE_FLIGHT_ENDPOINTS.
+    :param key: What identical GETs have in common.
+    :param get: A coroutine function that makes the GET.
+    :param endpoint: The api endpoint, if it isn't the key.
+    :return: Whatever get returns.
+    """
+
+    endpoint = key if endpoint is None else endpoint
+    if not endpoint.startswith(SINGLE_FLIGHT_ENDPOINTS):
+        return await get()
+
+    shared = _in_flight.get(key)
+    if shared is not None:
+        metrics.API_COALESCED.inc(endpoint=endpoint_label(endpoint))
+    else:
+        shared = _in_flight[key] = asyncio.ensure_future(get())
+        shared.add_done_callback(functools.partial(_land, key))
+
+    # Shielded, so one caller giving up doesn't cancel the request for everyone else.
+    return await asyncio.shield(shared)
+
+
+async def _get(endpoint, headers=None):
+    """
+    Makes a GET request.
+    :param endpoint: The api endpoint.
+    :param headers: A dictionary of extra request headers, or None.
+    :return: A Response object.
+    """
+
+    return await http_request("GET", endpoint, headers=headers)
+
+
+async def _get_json(endpoint):
+    """
+    Makes a conditional GET request for a JSON body, see http_get_json.
+    :param endpoint: The api endpoint.
+    :return: A tuple of the Response and the parsed body, or None for the body.
+    """
+
+    cached = _validated.get(endpoint)
+
+    headers = {}
+    if cached is not None and cached.etag is not None:
+        headers["If-None-Match"] = cached.etag
+    if cached is not None and cached.last_modified is not None:
+        headers["If-Modified-Since"] = cached.last_modified
+
+    res = await _get(endpoint, headers)
+
+    if cached is not None and res.status_code == 304:
+        metrics.API_NOT_MODIFIED.inc(endpoint=endpoint_label(endpoint))
+        return res, cached.body
+    if res.status_code != 200:
+        return res, None
+
+    body = json.loads(res.content.decode("utf-8"))
+
+    etag = res.headers.get("ETag")
+    last_modified = res.headers.get("Last-Modified")
+    if etag is not None or last_modified is not None:
+        _validated[endpoint] = Validated(etag, last_modified, body)
+    else:
+        _validated.pop(endpoint, None)
+
+    return res, body
+
+
+def _land(key, future):
+    """
+    Done callback for single-flight GETs. Later identical GETs send a new request.
+    :param key: The key the GET was shared under.
+    :param future: The finished request.
+    :return: None
+    """
+
+    if _in_flight.get(key) is future:
+        del _in_flight[key]
+
+
+async def http_put(endpoint, data):
     """
     Makes an HTTP PUT request.
     :param endpoint: The api endpoint.
@@ -121,11 +874,10 @@ def http_put(endpoint, data):
     :return: A response object.
     """
 
-    url = API_BASE_URL + endpoint
-    return requests.put(url, data=data)
+    return await http_request("PUT", endpoint, data)
 
 
-def http_post(endpoint, data):
+async def http_post(endpoint, data):
     """
     Makes an HTTP POST request.
     :param endpoint: The api endpoint
@@ -133,5 +885,15 @@ def http_post(endpoint, data):
     :return: A response object.
     """
 
-    url = API_BASE_URL + endpoint
-    return requests.post(url, data=data)
+    return await http_request("POST", endpoint, data)
+
+
+async def http_post_json(endpoint, obj):
+    """
+    Makes an HTTP POST request with a JSON body.
+    :param endpoint: The api endpoint
+    :param obj: An object (usually a dict or list) to send as JSON.
+    :return: A response object.
+    """
+
+    return await http_request("POST", endpoint, json=obj)
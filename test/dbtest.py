@@ -1,5 +1,5 @@
 
-from test import test_attendance
+from test import test_attendance, test_outbound, test_scheduler, test_triggers, test_util, test_cancellations, test_quip, test_state, test_replica
 
 
 def test_all_modules():
@@ -9,6 +9,14 @@ def test_all_modules():
     """
 
     test_attendance.execute_all()
+    test_outbound.execute_all()
+    test_scheduler.execute_all()
+    test_triggers.execute_all()
+    test_util.execute_all()
+    test_cancellations.execute_all()
+    test_quip.execute_all()
+    test_state.execute_all()
+    test_replica.execute_all()
 
 
 test_all_modules()
@@ -4,7 +4,96 @@ Tests for the attendance module.
 """
 
 
-from src import attendance as a
+import asyncio
+import datetime
+import os
+import tempfile
+
+from src import attendance as a, diddlemail, replica, scheduler, util
+
+
+class TempReplica:
+    """
+    Points the replica at a database in a temporary directory for the length of a test.
+    """
+
+    def __init__(self):
+        self._scratch = None
+        self._saved = None
+
+    def __enter__(self):
+        self._saved = (replica.REPLICA_FILE, replica._db, replica._db_executor)
+        self._scratch = tempfile.TemporaryDirectory(prefix="diddlebot-test-")
+        (replica.REPLICA_FILE, replica._db, replica._db_executor) = \
+            (os.path.join(self._scratch.name, "replica.db"), None, None)
+        return self
+
+    def __exit__(self, *exc):
+        if replica._db is not None:
+            run(replica._run(lambda db: db.close()))
+            replica._db_executor.shutdown()
+        (replica.REPLICA_FILE, replica._db, replica._db_executor) = self._saved
+        self._scratch.cleanup()
+        return False
+
+
+class FakeEmail:
+    """
+    Stands in for diddlemail's outbox, and for the practice calendar, for the length of a test.
+    """
+
+    def __init__(self, no_practice):
+        self.subjects = []
+        self.working = True
+        self.no_practice = no_practice
+        self._saved = None
+
+    def queue_email_to_club(self, message, subject):
+        self.subjects.append(subject)
+        future = asyncio.get_event_loop().create_future()
+        future.set_result(self.working)
+        return future
+
+    def is_practice_on(self, day):
+        return day not in self.no_practice
+
+    def __enter__(self):
+        self._saved = (diddlemail.queue_email_to_club, util.is_practice_on, a.DIGEST_MODE, a.DIGEST_CUTOFFS,
+                       a.DIGEST_DEFAULT_CUTOFF)
+        (diddlemail.queue_email_to_club, util.is_practice_on) = (self.queue_email_to_club, self.is_practice_on)
+        a.DIGEST_MODE = True
+        return self
+
+    def __exit__(self, *exc):
+        (diddlemail.queue_email_to_club, util.is_practice_on, a.DIGEST_MODE, a.DIGEST_CUTOFFS,
+         a.DIGEST_DEFAULT_CUTOFF) = self._saved
+        return False
+
+
+def run(coroutine):
+    """
+    Runs a coroutine on a fresh event loop.
+    :param coroutine: The coroutine to run.
+    :return: What it returned.
+    """
+
+    loop = asyncio.new_event_loop()
+    try:
+        asyncio.set_event_loop(loop)
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+
+
+def digest_job(day):
+    """
+    :param day: The date of a practice.
+    :return: The scheduler job for the practice's digest, or None.
+    """
+
+    name = "excuse digest " + day.strftime(a.DB_DATE_FORMAT)
+    return next((job for job in scheduler.get_jobs() if job.name == name), None)
 
 
 def execute_all():
@@ -18,6 +107,12 @@ def execute_all():
     print("")
 
     test_excuse_type()
+    test_date_range()
+    test_excuse_year()
+    test_reply_length()
+    test_digest_cutoff()
+    test_digest_queue()
+    test_digest_retry()
 
 
 def test_excuse_type():
@@ -33,3 +128,165 @@ def test_excuse_type():
     # TODO
 
     print("PASS")
+
+
+def test_date_range():
+    """
+    Verifies that a range of dates is parsed and expanded into one date per day, and that backwards or overly
+    long ranges are rejected.
+    :return: None
+    """
+
+    print("")
+    print("test_date_range: Testing date ranges...")
+
+    (absence, date, first, last, reason) = a.parse_message("absent 3/4-3/6 Sam Kuzio sick")
+    assert date == "03/04-03/06"
+    assert a.expand_dates(date) == ["03/04", "03/05", "03/06"]
+    assert a.expand_dates("03/06-03/04") == []
+    assert a.expand_dates("01/01-02/01") == []
+    assert a.parse_message("absent 3/4-x Sam Kuzio")[1] is None
+
+    print("PASS")
+
+
+def test_excuse_year():
+    """
+    Verifies that excuses replayed from an earlier year are recorded in that year, and that ranges are checked
+    against it.
+    :return: None
+    """
+
+    print("")
+    print("test_excuse_year: Testing excuse years...")
+
+    assert a.excuse_record("absent", "12/20", "Sam", "Kuzio", None, year=2018)["date"] == "2018-12-20"
+    assert a.expand_dates("02/28-03/01", 2020) == ["02/28", "02/29", "03/01"]
+    assert a.expand_dates("02/28-03/01", 2019) == ["02/28", "03/01"]
+
+    (accepted, rejected, _) = a.parse_excuses("absent today Sam Kuzio", today=datetime.date(2018, 12, 20))
+    assert accepted[0][0].date == "12/20" and not rejected
+
+    print("PASS")
+
+
+def test_reply_length():
+    """
+    Verifies that lines past MAX_EXCUSE_LINES are reported as ignored, and that the reply to a message full of
+    long lines still fits in one discord message.
+    :return: None
+    """
+
+    print("")
+    print("test_reply_length: Testing excuse replies...")
+
+    word = "x" * 500
+    content = "\n".join(["absent 3/4 " + word + " " + word] * 15 + [word] * 10)
+
+    (accepted, rejected, ignored) = a.parse_excuses(content)
+    assert (len(accepted), len(rejected), ignored) == (15, 5, 5)
+
+    for statuses in (None, [False] * len(accepted), [True] * len(accepted)):
+        reply = a.describe_lines(accepted, rejected, statuses, ignored)
+        assert len(reply) < a.outbound.MAX_MESSAGE_LENGTH
+        assert "ignored the other 5" in reply
+
+    print("PASS")
+
+
+def test_digest_cutoff():
+    """
+    Verifies that a practice's digest is sent at its weekday's cutoff, or at the default cutoff.
+    :return: None
+    """
+
+    print("")
+    print("test_digest_cutoff: Testing digest cutoffs...")
+
+    # A Saturday and a Tuesday.
+    assert a.digest_cutoff(datetime.date(2019, 1, 19)) == datetime.datetime(2019, 1, 19, 8, 0)
+    assert a.digest_cutoff(datetime.date(2019, 1, 15)) == datetime.datetime(2019, 1, 15, 18, 0)
+
+    print("PASS")
+
+
+def test_digest_queue():
+    """
+    Verifies that in DIGEST_MODE excuses for a practice before its cutoff wait for the digest, which is
+    scheduled, and that excuses after the cutoff or for days without practice are emailed right away.
+    :return: None
+    """
+
+    print("")
+    print("test_digest_queue: Testing queueing excuses for digests...")
+
+    year = datetime.date.today().year
+    practice = datetime.date(year, 12, 31)
+    no_practice = datetime.date(year, 12, 30)
+
+    async def queue(email):
+        (a.DIGEST_CUTOFFS, a.DIGEST_DEFAULT_CUTOFF) = ({}, "23:59")
+        assert await a.queue_excuses_email([a.Excuse("absent", "12/31", "Sam", "Kuzio", "sick"),
+                                            a.Excuse("late", "12/30", "Sam", "Kuzio", None)])
+        assert len(email.subjects) == 1
+        assert [excuse for (_, excuse) in await replica.digest_excuses(practice.strftime(a.DB_DATE_FORMAT))] == \
+            [["absent", "12/31", "Sam", "Kuzio", "sick"]]
+        assert await replica.digest_dates() == [practice.strftime(a.DB_DATE_FORMAT)]
+        assert digest_job(practice).next_run == a.digest_cutoff(practice)
+
+        # The cutoff for a practice on January 1st has always passed by now.
+        (a.DIGEST_CUTOFFS, a.DIGEST_DEFAULT_CUTOFF) = ({}, "00:00")
+        assert await a.queue_excuses_email([a.Excuse("absent", "01/01", "Sam", "Kuzio", None)])
+        assert len(email.subjects) == 2
+        assert await replica.digest_dates() == [practice.strftime(a.DB_DATE_FORMAT)]
+
+    try:
+        with TempReplica(), FakeEmail([no_practice]) as email:
+            run(queue(email))
+    finally:
+        scheduler.remove_job("excuse digest " + practice.strftime(a.DB_DATE_FORMAT))
+
+    print("PASS")
+
+
+def test_digest_retry():
+    """
+    Verifies that a digest that can't be sent keeps its excuses and is tried again after DIGEST_RETRY_DELAY, and
+    that once it is sent its excuses are dropped.
+    :return: None
+    """
+
+    print("")
+    print("test_digest_retry: Testing sending digests...")
+
+    practice = datetime.date(2019, 1, 15)
+    date = practice.strftime(a.DB_DATE_FORMAT)
+
+    async def send(email):
+        await replica.add_to_digest(date, [["late", "01/15", "Sam", "Kuzio", None],
+                                           ["absent", "01/15", "Ann", "Other", "sick"]])
+
+        email.working = False
+        before = datetime.datetime.now()
+        await a.send_digest(practice)
+        assert email.subjects == ["Excuses for practice on 01/15 (2)"]
+        assert len(await replica.digest_excuses(date)) == 2
+        assert before + a.DIGEST_RETRY_DELAY <= digest_job(practice).next_run <= \
+            datetime.datetime.now() + a.DIGEST_RETRY_DELAY
+
+        email.working = True
+        await a.send_digest(practice)
+        assert len(email.subjects) == 2
+        assert await replica.digest_excuses(date) == []
+
+        # Nothing is waiting, so nothing is sent.
+        await a.send_digest(practice)
+        assert len(email.subjects) == 2
+
+    try:
+        with TempReplica(), FakeEmail([]) as email:
+            run(send(email))
+    finally:
+        scheduler.remove_job("excuse digest " + date)
+
+    print("PASS")
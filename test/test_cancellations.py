@@ -0,0 +1,183 @@
+"""
+Tests for the cancellations module.
+
+"""
+
+
+import asyncio
+import datetime
+
+from src import cancellations as c, replica, state, util
+
+
+class FakeResponse:
+    """
+    Stands in for a requests Response.
+    """
+
+    def __init__(self, status_code, content=b""):
+        self.status_code = status_code
+        self.content = content
+        self.headers = {}
+
+
+class FakeApi:
+    """
+    Stands in for ritdl-ws' cancellation endpoints, and the replica, for the length of a test.
+    """
+
+    def __init__(self, dates):
+        self.dates = list(dates)
+        self.gets = 0
+        self.post_status = 200
+        self.hold = None
+        self._saved = None
+
+    async def http_get_json(self, endpoint):
+        assert endpoint == "/cancellations"
+        self.gets += 1
+        dates = list(self.dates)
+        if self.hold is not None:
+            await self.hold.wait()
+        return FakeResponse(200), dates
+
+    async def http_post(self, endpoint, data):
+        if self.post_status == 200:
+            (action, date) = endpoint.split("/")[2:]
+            if action == "cancel" and date not in self.dates:
+                self.dates.append(date)
+            elif action == "uncancel" and date in self.dates:
+                self.dates.remove(date)
+        return FakeResponse(self.post_status, b"nope")
+
+    def __enter__(self):
+        async def nothing(*args):
+            return None
+
+        self._saved = (util.http_get_json, util.http_post, replica.load_cancellations, replica.save_cancellations,
+                       replica.set_cancelled, state.get_backend())
+        (util.http_get_json, util.http_post) = (self.http_get_json, self.http_post)
+        (replica.load_cancellations, replica.save_cancellations, replica.set_cancelled) = (nothing, nothing, nothing)
+        state.set_backend(state.MemoryBackend())
+        _reset()
+        return self
+
+    def __exit__(self, *exc):
+        (util.http_get_json, util.http_post, replica.load_cancellations, replica.save_cancellations,
+         replica.set_cancelled, backend) = self._saved
+        state.set_backend(backend)
+        _reset()
+        return False
+
+
+def _reset():
+    """
+    Forgets the local copy of the cancellations.
+    :return: None
+    """
+
+    (c._cancelled_dates, c._loaded_at, c._loaded_version, c._refresh_task) = (None, 0, 0, None)
+    (c._recent_writes, c._write_count) = ({}, 0)
+    util.set_cancelled_days(())
+
+
+def run(coroutine):
+    """
+    Runs a coroutine on a fresh event loop.
+    :param coroutine: The coroutine to run.
+    :return: What it returned.
+    """
+
+    loop = asyncio.new_event_loop()
+    try:
+        asyncio.set_event_loop(loop)
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+
+
+def execute_all():
+    """
+    Executes all tests for the cancellations module.
+    :return: None
+    """
+
+    print("")
+    print("----------------- CANCELLATIONS TESTS -----------------")
+    print("")
+
+    test_write_through()
+    test_refresh_keeps_writes()
+
+
+def test_write_through():
+    """
+    Verifies that cancellations are loaded once and then answered locally, that cancelling and uncancelling
+    update the local copy and the calendar without reloading, and that a failed write changes nothing.
+    :return: None
+    """
+
+    print("")
+    print("test_write_through: Testing cancellation write-through...")
+
+    async def scenario(api):
+        assert await c.get_cancellations() == ["2019-01-17"]
+        assert await c.is_cancelled_on("2019-01-17")
+        assert not await c.is_cancelled_on("2019-01-19")
+        assert api.gets == 1
+
+        assert await c.cancel_on_day("2019-01-19")
+        assert await c.get_cancellations() == ["2019-01-17", "2019-01-19"]
+        assert util.get_day(datetime.date(2019, 1, 19)).cancelled
+
+        assert await c.uncancel_on_date("2019-01-17")
+        assert await c.get_cancellations() == ["2019-01-19"]
+        assert not util.get_day(datetime.date(2019, 1, 17)).cancelled
+
+        api.post_status = 500
+        assert not await c.cancel_on_day("2019-01-22")
+        assert await c.get_cancellations() == ["2019-01-19"]
+        assert api.gets == 1
+
+        # Another shard changing a cancellation makes the local copy reload.
+        await state.incr(c.VERSION_KEY)
+        await c.get_cancellations()
+        assert api.gets == 2
+
+    with FakeApi(["2019-01-17"]) as api:
+        run(scenario(api))
+
+    print("PASS")
+
+
+def test_refresh_keeps_writes():
+    """
+    Verifies that a reload that started before a cancellation was written doesn't undo it when its older answer
+    comes back.
+    :return: None
+    """
+
+    print("")
+    print("test_refresh_keeps_writes: Testing reloads racing writes...")
+
+    async def race(api):
+        assert await c.refresh_cancellations()
+
+        hold = api.hold = asyncio.Event()
+        reload = c.start_refresh()
+        await asyncio.sleep(0)
+        api.hold = None
+
+        # The reload has its answer, from before this write, and is waiting to hand it back.
+        assert await c.cancel_on_day("2019-01-24")
+        hold.set()
+        assert await reload
+
+        assert await c.get_cancellations() == ["2019-01-17", "2019-01-24"]
+        assert util.get_day(datetime.date(2019, 1, 24)).cancelled
+
+    with FakeApi(["2019-01-17"]) as api:
+        run(race(api))
+
+    print("PASS")
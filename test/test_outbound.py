@@ -0,0 +1,114 @@
+"""
+Tests for the outbound module.
+
+"""
+
+
+import collections
+
+from src import outbound as o
+
+
+def execute_all():
+    """
+    Executes all tests for the outbound module.
+    :return: None
+    """
+
+    print("")
+    print("------------------- OUTBOUND TESTS --------------------")
+    print("")
+
+    test_split_at_limit()
+    test_split_long_line()
+    test_take_batch()
+    test_token_bucket()
+
+
+def test_split_at_limit():
+    """
+    Verifies that text of exactly MAX_MESSAGE_LENGTH characters is sent as is, and that one character more splits
+    it at a line boundary.
+    :return: None
+    """
+
+    print("")
+    print("test_split_at_limit: Testing messages at the length limit...")
+
+    text = "a" * 999 + "\n" + "b" * 1000
+    assert len(text) == o.MAX_MESSAGE_LENGTH
+    assert o.split_message(text) == [text]
+
+    assert o.split_message(text + "b") == ["a" * 999, "b" * 1001]
+
+    print("PASS")
+
+
+def test_split_long_line():
+    """
+    Verifies that a single line longer than MAX_MESSAGE_LENGTH is cut into pieces that fit, without losing any of
+    it or the lines around it.
+    :return: None
+    """
+
+    print("")
+    print("test_split_long_line: Testing lines over the length limit...")
+
+    line = "x" * (o.MAX_MESSAGE_LENGTH * 2 + 10)
+    chunks = o.split_message("before\n" + line + "\nafter")
+
+    assert chunks == ["before", "x" * o.MAX_MESSAGE_LENGTH, "x" * o.MAX_MESSAGE_LENGTH, "x" * 10 + "\nafter"]
+    assert all(len(chunk) <= o.MAX_MESSAGE_LENGTH for chunk in chunks)
+
+    print("PASS")
+
+
+def test_take_batch():
+    """
+    Verifies that queued messages are merged up to the length limit, and that messages queued with
+    coalesce=False are always sent on their own.
+    :return: None
+    """
+
+    print("")
+    print("test_take_batch: Testing message batching...")
+
+    queue = collections.deque([o.Outgoing("one", True, None), o.Outgoing("two", True, None),
+                               o.Outgoing("edit me", False, None), o.Outgoing("three", True, None),
+                               o.Outgoing("y" * o.MAX_MESSAGE_LENGTH, True, None)])
+
+    assert [m.text for m in o._take_batch(queue)] == ["one", "two"]
+    assert [m.text for m in o._take_batch(queue)] == ["edit me"]
+    assert [m.text for m in o._take_batch(queue)] == ["three"]
+    assert len(o._take_batch(queue)) == 1
+    assert not queue
+
+    queue = collections.deque([o.Outgoing("edit me", False, None), o.Outgoing("four", True, None)])
+    assert [m.text for m in o._take_batch(queue)] == ["edit me"]
+
+    print("PASS")
+
+
+def test_token_bucket():
+    """
+    Verifies that a TokenBucket allows a burst of its capacity, then makes each send wait its turn, and refills
+    over time without going past its capacity.
+    :return: None
+    """
+
+    print("")
+    print("test_token_bucket: Testing rate limiting...")
+
+    bucket = o.TokenBucket(2, 1.0)
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == 0.0
+    assert 0.9 < bucket.reserve() <= 1.0
+    assert 1.9 < bucket.reserve() <= 2.0
+
+    # Ten seconds later the debt is paid off, but only a burst of two is saved up.
+    bucket.updated -= 10
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() > 0.9
+
+    print("PASS")
@@ -0,0 +1,167 @@
+"""
+Tests for the quip module.
+
+"""
+
+
+import asyncio
+
+from src import quip as q, replica
+
+
+class FakeResponse:
+    """
+    Stands in for a requests Response.
+    """
+
+    def __init__(self, status_code, content=b""):
+        self.status_code = status_code
+        self.content = content
+        self.headers = {}
+
+
+class FakeApi:
+    """
+    Stands in for ritdl-ws' quip endpoints, and the replica, for the length of a test.
+    """
+
+    def __init__(self, quips):
+        self.quips = list(quips)
+        self.bulk = True
+        self.gets = 0
+        self.saved = []
+        self._saved = None
+
+    async def http_get_json(self, endpoint):
+        assert endpoint == q.QUIPS_BULK_ENDPOINT
+        self.gets += 1
+        if not self.bulk:
+            return FakeResponse(404), None
+        return FakeResponse(200), list(self.quips)
+
+    async def http_get(self, endpoint):
+        assert endpoint == "/quip"
+        self.gets += 1
+        return FakeResponse(200, self.quips[self.gets % len(self.quips)].encode("utf-8"))
+
+    async def load_quips(self):
+        return None
+
+    async def save_quips(self, quips, complete=False):
+        self.saved.append((sorted(quips), complete))
+
+    def __enter__(self):
+        self._saved = (q.http_get_json, q.http_get, replica.load_quips, replica.save_quips)
+        (q.http_get_json, q.http_get, replica.load_quips, replica.save_quips) = \
+            (self.http_get_json, self.http_get, self.load_quips, self.save_quips)
+        _reset()
+        return self
+
+    def __exit__(self, *exc):
+        (q.http_get_json, q.http_get, replica.load_quips, replica.save_quips) = self._saved
+        _reset()
+        return False
+
+
+def _reset():
+    """
+    Empties the quip pool.
+    :return: None
+    """
+
+    (q._quips, q._known, q._bag, q._last_quip) = ([], set(), [], None)
+    (q._bulk_supported, q._refill_task) = (True, None)
+
+
+def run(coroutine):
+    """
+    Runs a coroutine on a fresh event loop.
+    :param coroutine: The coroutine to run.
+    :return: What it returned.
+    """
+
+    loop = asyncio.new_event_loop()
+    try:
+        asyncio.set_event_loop(loop)
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+
+
+def execute_all():
+    """
+    Executes all tests for the quip module.
+    :return: None
+    """
+
+    print("")
+    print("--------------------- QUIP TESTS ----------------------")
+    print("")
+
+    test_shuffle_bag()
+    test_refill()
+
+
+def test_shuffle_bag():
+    """
+    Verifies that every quip is used once before any quip repeats, that a new round never starts with the quip
+    that ended the last one, and that a refill starts when the bag runs low.
+    :return: None
+    """
+
+    print("")
+    print("test_shuffle_bag: Testing the quip shuffle bag...")
+
+    quips = ["quip " + str(i) for i in range(8)]
+
+    async def draw(api):
+        last = None
+        for _ in range(20):
+            drawn = [await q.next_quip() for _ in quips]
+            assert sorted(drawn) == quips
+            assert drawn[0] != last
+            last = drawn[-1]
+
+            # Let the refills that started when the bag ran low finish.
+            await asyncio.sleep(0)
+
+        assert api.gets > 1
+
+    with FakeApi(quips) as api:
+        run(draw(api))
+
+    print("PASS")
+
+
+def test_refill():
+    """
+    Verifies that a refill adds new quips to the current round, drops quips deleted from ritdl-ws from the pool
+    and the replica, and falls back on single quips when ritdl-ws has no bulk endpoint.
+    :return: None
+    """
+
+    print("")
+    print("test_refill: Testing quip refills...")
+
+    async def refill(api):
+        assert await q.refill_quips() == 3
+        await q.next_quip()
+
+        api.quips = ["a", "b", "d"]
+        assert await q.refill_quips() == 1
+        assert q._known == {"a", "b", "d"}
+        assert "c" not in q._bag and "d" in q._bag
+        assert api.saved[-1] == (["a", "b", "d"], True)
+
+        api.bulk = False
+        api.quips = ["e"]
+        assert await q.refill_quips() == 1
+        assert not q._bulk_supported
+        assert q._known == {"a", "b", "d", "e"}
+        assert api.saved[-1] == (["e"], False)
+
+    with FakeApi(["a", "b", "c"]) as api:
+        run(refill(api))
+
+    print("PASS")
@@ -0,0 +1,183 @@
+"""
+Tests for the replica module.
+
+"""
+
+
+import asyncio
+import os
+import tempfile
+
+from src import attendance, replica
+
+
+class TempReplica:
+    """
+    Points the replica at a database in a temporary directory for the length of a test.
+    """
+
+    def __init__(self):
+        self._scratch = None
+        self._saved = None
+
+    def __enter__(self):
+        self._saved = (replica.REPLICA_FILE, replica._db, replica._db_executor)
+        self._scratch = tempfile.TemporaryDirectory(prefix="diddlebot-test-")
+        (replica.REPLICA_FILE, replica._db, replica._db_executor) = \
+            (os.path.join(self._scratch.name, "replica.db"), None, None)
+        return self
+
+    def __exit__(self, *exc):
+        if replica._db is not None:
+            run(replica._run(lambda db: db.close()))
+            replica._db_executor.shutdown()
+        (replica.REPLICA_FILE, replica._db, replica._db_executor) = self._saved
+        self._scratch.cleanup()
+        return False
+
+
+def run(coroutine):
+    """
+    Runs a coroutine on a fresh event loop.
+    :param coroutine: The coroutine to run.
+    :return: What it returned.
+    """
+
+    loop = asyncio.new_event_loop()
+    try:
+        asyncio.set_event_loop(loop)
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+
+
+def rowids(table, column):
+    """
+    :param table: A replica table.
+    :param column: Its key column.
+    :return: A dict of the table's keys to their rowids, so tests can tell which rows were rewritten.
+    """
+
+    return run(replica._run(lambda db: dict(db.execute("SELECT " + column + ", rowid FROM " + table))))
+
+
+def execute_all():
+    """
+    Executes all tests for the replica module.
+    :return: None
+    """
+
+    print("")
+    print("-------------------- REPLICA TESTS --------------------")
+    print("")
+
+    test_cancellations_diff()
+    test_quips_complete()
+    test_journal_replay()
+
+
+def test_cancellations_diff():
+    """
+    Verifies that cancellations read as never pulled until the first full list is saved, and that saving a full
+    list only adds and deletes the dates that changed.
+    :return: None
+    """
+
+    print("")
+    print("test_cancellations_diff: Testing cancellation diff syncs...")
+
+    with TempReplica():
+        assert run(replica.load_cancellations()) is None
+
+        run(replica.save_cancellations(["2019-01-17", "2019-01-22", "2019-01-24"]))
+        assert run(replica.load_cancellations()) == ["2019-01-17", "2019-01-22", "2019-01-24"]
+        before = rowids("cancellations", "date")
+
+        run(replica.save_cancellations(["2019-01-24", "2019-01-31", "2019-01-17"]))
+        assert run(replica.load_cancellations()) == ["2019-01-17", "2019-01-24", "2019-01-31"]
+        after = rowids("cancellations", "date")
+        assert after["2019-01-17"] == before["2019-01-17"] and after["2019-01-24"] == before["2019-01-24"]
+
+        run(replica.set_cancelled("2019-01-17", False))
+        run(replica.set_cancelled("2019-02-05", True))
+        assert run(replica.load_cancellations()) == ["2019-01-24", "2019-01-31", "2019-02-05"]
+
+        run(replica.save_cancellations([]))
+        assert run(replica.load_cancellations()) == []
+
+    print("PASS")
+
+
+def test_quips_complete():
+    """
+    Verifies that saving quips only adds to the replica, unless the quips are every quip ritdl-ws has.
+    :return: None
+    """
+
+    print("")
+    print("test_quips_complete: Testing saving quips...")
+
+    with TempReplica():
+        assert run(replica.load_quips()) is None
+
+        run(replica.save_quips(["a", "b"]))
+        run(replica.save_quips(["b", "c"]))
+        assert sorted(run(replica.load_quips())) == ["a", "b", "c"]
+
+        run(replica.save_quips(["c", "d"], complete=True))
+        assert sorted(run(replica.load_quips())) == ["c", "d"]
+
+    print("PASS")
+
+
+def test_journal_replay():
+    """
+    Verifies that excuses that never reached ritdl-ws are journaled, and that pushing the journal only forgets the
+    excuses ritdl-ws created.
+    :return: None
+    """
+
+    print("")
+    print("test_journal_replay: Testing the excuse journal...")
+
+    records = [{"name": name} for name in ("alice", "bob", "carol", "dave")]
+    posted = []
+    answers = []
+
+    async def post_excuse_records(batch):
+        posted.append([record["name"] for record in batch])
+        answer = answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    saved = attendance.post_excuse_records
+    attendance.post_excuse_records = post_excuse_records
+
+    try:
+        with TempReplica():
+            # Refused excuses aren't journaled, only the ones that couldn't be sent.
+            answers.append([True, False, None, None])
+            assert run(attendance.save_excuse_records(records)) == [True, False, True, True]
+            assert [record for (_, record) in run(replica.pending_excuses())] == records[2:]
+
+            answers.append(ConnectionError("ritdl-ws is not there"))
+            assert run(attendance.save_excuse_records(records[:1])) == [True]
+            pending = run(replica.pending_excuses())
+            assert [record["name"] for (_, record) in pending] == ["carol", "dave", "alice"]
+
+            answers.append([True, None, True])
+            assert run(attendance.push_journal()) == 2
+            assert posted[-1] == ["carol", "dave", "alice"]
+            assert run(replica.pending_excuses()) == [pending[1]]
+
+            answers.append([True])
+            assert run(attendance.push_journal()) == 1
+            assert run(replica.pending_excuses()) == []
+            assert run(attendance.push_journal()) == 0
+            assert not answers
+    finally:
+        attendance.post_excuse_records = saved
+
+    print("PASS")
@@ -0,0 +1,152 @@
+"""
+Tests for the scheduler module.
+
+"""
+
+
+import asyncio
+import datetime
+
+from src import scheduler as s
+
+
+def execute_all():
+    """
+    Executes all tests for the scheduler module.
+    :return: None
+    """
+
+    print("")
+    print("------------------- SCHEDULER TESTS -------------------")
+    print("")
+
+    test_rules()
+    test_jobs()
+    test_run()
+
+
+def test_rules():
+    """
+    Verifies that Weekly, Ahead and Once find the next time they fire, strictly after the moment they are given.
+    :return: None
+    """
+
+    print("")
+    print("test_rules: Testing schedule rules...")
+
+    # A Monday.
+    monday = datetime.datetime(2019, 1, 14, 12, 0)
+
+    weekly = s.Weekly(s.TUESDAY, "18:30")
+    assert weekly.next_after(monday) == datetime.datetime(2019, 1, 15, 18, 30)
+    assert weekly.next_after(datetime.datetime(2019, 1, 15, 18, 30)) == datetime.datetime(2019, 1, 22, 18, 30)
+    assert weekly.next_after(datetime.datetime(2019, 1, 15, 18, 29)) == datetime.datetime(2019, 1, 15, 18, 30)
+
+    weekly = s.Weekly([s.SATURDAY, s.MONDAY], "09:00")
+    assert weekly.next_after(monday) == datetime.datetime(2019, 1, 19, 9, 0)
+    assert weekly.next_after(datetime.datetime(2019, 1, 14, 8, 0)) == datetime.datetime(2019, 1, 14, 9, 0)
+
+    ahead = s.Ahead(s.Weekly(s.TUESDAY, "00:30"), datetime.timedelta(hours=1))
+    assert ahead.next_after(monday) == datetime.datetime(2019, 1, 14, 23, 30)
+    assert ahead.next_after(datetime.datetime(2019, 1, 14, 23, 30)) == datetime.datetime(2019, 1, 21, 23, 30)
+
+    once = s.Once(monday)
+    assert once.next_after(monday - datetime.timedelta(seconds=1)) == monday
+    assert once.next_after(monday) is None
+
+    print("PASS")
+
+
+def test_jobs():
+    """
+    Verifies that adding a job with a name that is taken replaces the old job, that removed jobs are marked so
+    the heap skips them, and that a job whose rule never fires again isn't scheduled.
+    :return: None
+    """
+
+    print("")
+    print("test_jobs: Testing adding and removing jobs...")
+
+    async def job():
+        pass
+
+    later = datetime.datetime.now() + datetime.timedelta(days=1)
+
+    try:
+        first = s.add_job("test job", s.Once(later), job)
+        second = s.add_job("test job", s.Once(later + datetime.timedelta(hours=1)), job)
+        assert first.removed and not second.removed
+        assert [j for j in s.get_jobs() if j.name == "test job"] == [second]
+
+        sooner = s.add_job("test sooner", s.Once(later - datetime.timedelta(hours=1)), job)
+        names = [j.name for j in s.get_jobs()]
+        assert names.index("test sooner") < names.index("test job")
+
+        assert s.remove_job("test job")
+        assert second.removed
+        assert not s.remove_job("test job")
+        assert "test job" not in [j.name for j in s.get_jobs()]
+
+        past = s.add_job("test past", s.Once(datetime.datetime.now() - datetime.timedelta(hours=1)), job)
+        assert past.next_run is None
+        assert "test past" not in [j.name for j in s.get_jobs()]
+        assert not sooner.removed
+    finally:
+        s.remove_job("test job")
+        s.remove_job("test sooner")
+
+    print("PASS")
+
+
+def test_run():
+    """
+    Verifies that the scheduler loop runs jobs when they are due, drops one-off jobs after they run, skips jobs
+    that were removed, and keeps going after a job fails.
+    :return: None
+    """
+
+    print("")
+    print("test_run: Testing the scheduler loop...")
+
+    ran = []
+
+    async def record(name):
+        ran.append(name)
+
+    async def fail():
+        raise RuntimeError("test job failure")
+
+    async def run():
+        s._wakeup = asyncio.Event()
+        runner = asyncio.ensure_future(s._run_forever())
+
+        soon = datetime.datetime.now() + datetime.timedelta(seconds=0.05)
+        s.add_job("test fail", s.Once(soon), fail)
+        s.add_job("test removed", s.Once(soon), lambda: record("removed"))
+        s.add_job("test once", s.Once(soon + datetime.timedelta(seconds=0.05)), lambda: record("once"))
+        s.remove_job("test removed")
+
+        # Added while the loop is asleep, and due before anything else.
+        await asyncio.sleep(0.01)
+        s.add_job("test first", s.Once(datetime.datetime.now() + datetime.timedelta(seconds=0.01)),
+                  lambda: record("first"))
+
+        await asyncio.sleep(0.3)
+        runner.cancel()
+
+    loop = asyncio.new_event_loop()
+    try:
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(run())
+    finally:
+        s._wakeup = None
+        for name in ("test fail", "test removed", "test once", "test first"):
+            s.remove_job(name)
+        loop.close()
+        asyncio.set_event_loop(None)
+
+    assert ran == ["first", "once"]
+    assert not [j for j in s.get_jobs() if j.name.startswith("test ")]
+    assert not s._running
+
+    print("PASS")
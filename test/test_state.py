@@ -0,0 +1,185 @@
+"""
+Tests for the state module.
+
+"""
+
+
+import asyncio
+import multiprocessing
+import os
+import tempfile
+
+from src import outbound, reminders, state
+
+
+class FakeChannel:
+    """
+    Stands in for a discord Channel.
+    """
+
+    def __init__(self, name, id):
+        self.name = name
+        self.id = id
+        self.server = None
+
+
+def run(coroutine):
+    """
+    Runs a coroutine on a fresh event loop.
+    :param coroutine: The coroutine to run.
+    :return: What it returned.
+    """
+
+    loop = asyncio.new_event_loop()
+    try:
+        asyncio.set_event_loop(loop)
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+
+
+def _shard(path, number, results):
+    """
+    One shard process for test_sqlite_processes. Claims a key and bumps a counter through the state file.
+    :param path: The state file.
+    :param number: Which shard this is.
+    :param results: A Queue to put whether the claim was won on.
+    :return: None
+    """
+
+    backend = state.SqliteBackend(path)
+
+    async def shard():
+        won = await backend.claim("test claim", "shard " + str(number), 60)
+        for _ in range(25):
+            await backend.incr("test counter")
+        return won
+
+    results.put(run(shard()))
+
+
+def execute_all():
+    """
+    Executes all tests for the state module.
+    :return: None
+    """
+
+    print("")
+    print("--------------------- STATE TESTS ---------------------")
+    print("")
+
+    test_backends()
+    test_sqlite_processes()
+    test_reminder_claim()
+
+
+def test_backends():
+    """
+    Verifies that both backends only let a key be claimed once, only let the owner release a claim, let keys
+    expire, and count.
+    :return: None
+    """
+
+    print("")
+    print("test_backends: Testing the shared state backends...")
+
+    async def check(backend):
+        assert await backend.get("test key") is None
+        await backend.put("test key", {"value": 1})
+        assert await backend.get("test key") == {"value": 1}
+
+        assert await backend.claim("test claim", "shard 0", 60)
+        assert not await backend.claim("test claim", "shard 1", 60)
+        assert not await backend.release("test claim", "shard 1")
+        assert await backend.get("test claim") == "shard 0"
+        assert await backend.release("test claim", "shard 0")
+        assert await backend.claim("test claim", "shard 1", 60)
+
+        await backend.put("test expiring", 1, ttl=0.01)
+        assert await backend.claim("test expiring claim", "shard 0", 0.01)
+        await asyncio.sleep(0.05)
+        assert await backend.get("test expiring") is None
+        assert not await backend.release("test expiring claim", "shard 0")
+        assert await backend.claim("test expiring claim", "shard 1", 60)
+
+        assert [await backend.incr("test counter") for _ in range(3)] == [1, 2, 3]
+
+    run(check(state.MemoryBackend()))
+
+    with tempfile.TemporaryDirectory(prefix="diddlebot-test-") as scratch:
+        run(check(state.SqliteBackend(os.path.join(scratch, "state.db"))))
+
+    print("PASS")
+
+
+def test_sqlite_processes():
+    """
+    Verifies that claims and counters in a SQLite state file are atomic across processes sharing it.
+    :return: None
+    """
+
+    print("")
+    print("test_sqlite_processes: Testing SQLite state shared by processes...")
+
+    shards = 4
+
+    with tempfile.TemporaryDirectory(prefix="diddlebot-test-") as scratch:
+        path = os.path.join(scratch, "state.db")
+        results = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=_shard, args=(path, number, results)) for number in range(shards)]
+        for process in processes:
+            process.start()
+        won = [results.get(timeout=30) for _ in processes]
+        for process in processes:
+            process.join()
+
+        assert won.count(True) == 1
+        assert run(state.SqliteBackend(path).get("test counter")) == shards * 25
+
+    print("PASS")
+
+
+def test_reminder_claim():
+    """
+    Verifies that only the shard that claims a reminder sends it, and that a reminder that can't be sent gives up
+    its claim so it can be tried again.
+    :return: None
+    """
+
+    print("")
+    print("test_reminder_claim: Testing claiming reminders...")
+
+    channel = FakeChannel("general", "1")
+    sent = []
+    failing = [True]
+
+    async def send_message(channel, text, coalesce=True):
+        if failing[0]:
+            raise ConnectionError("discord is not there")
+        sent.append(text)
+
+    async def claim():
+        assert not await reminders._send_claimed(channel, "test reminder", "hello")
+        assert await state.get("test reminder") is None
+
+        failing[0] = False
+        assert await reminders._send_claimed(channel, "test reminder", "hello")
+        assert sent == ["hello"]
+
+        # Another shard finds the reminder claimed.
+        assert not await reminders._send_claimed(channel, "test reminder", "hello")
+        assert sent == ["hello"]
+
+    saved = (outbound.send_message, reminders.REMINDER_SEND_ATTEMPTS, reminders.REMINDER_RETRY_DELAY,
+             state.get_backend())
+    (outbound.send_message, reminders.REMINDER_SEND_ATTEMPTS, reminders.REMINDER_RETRY_DELAY) = (send_message, 2, 0)
+    state.set_backend(state.MemoryBackend())
+
+    try:
+        run(claim())
+    finally:
+        (outbound.send_message, reminders.REMINDER_SEND_ATTEMPTS, reminders.REMINDER_RETRY_DELAY, backend) = saved
+        state.set_backend(backend)
+
+    print("PASS")
@@ -0,0 +1,106 @@
+"""
+Tests for the triggers module.
+
+"""
+
+
+from src import triggers as t
+
+
+async def handler(message):
+    """
+    A rule handler that does nothing.
+    """
+    pass
+
+
+def execute_all():
+    """
+    Executes all tests for the triggers module.
+    :return: None
+    """
+
+    print("")
+    print("------------------- TRIGGERS TESTS --------------------")
+    print("")
+
+    test_rule_kinds()
+    test_priority()
+    test_channels()
+
+
+def names(rules):
+    """
+    :param rules: A list of Rules.
+    :return: Their names.
+    """
+    return [rule.name for rule in rules]
+
+
+def test_rule_kinds():
+    """
+    Verifies that prefix, keyword and exact rules match the text they should, ignoring case, and nothing else.
+    :return: None
+    """
+
+    print("")
+    print("test_rule_kinds: Testing prefix, keyword and exact rules...")
+
+    table = t.TriggerTable([t.Rule("command", handler, prefix="$db"),
+                            t.Rule("keyword", handler, keyword="diddle"),
+                            t.Rule("exact", handler, exact="ping.")])
+
+    assert names(table.match("general", "$DB help")) == ["command"]
+    assert names(table.match("general", "hey $db help")) == []
+    assert names(table.match("general", "so much\nDIDDLE today")) == ["keyword"]
+    assert names(table.match("general", "PING.")) == ["exact"]
+    assert names(table.match("general", "ping. pong")) == []
+    assert names(table.match("general", "pingX")) == []
+
+    print("PASS")
+
+
+def test_priority():
+    """
+    Verifies that only the first text rule in the table that matches fires, and that channel rules fire on every
+    message ahead of it.
+    :return: None
+    """
+
+    print("")
+    print("test_priority: Testing rule priority...")
+
+    table = t.TriggerTable([t.Rule("everything", handler),
+                            t.Rule("keyword", handler, keyword="db"),
+                            t.Rule("command", handler, prefix="$db")])
+
+    assert names(table.match("general", "$db help")) == ["everything", "keyword"]
+    assert names(table.match("general", "hello")) == ["everything"]
+
+    table = t.TriggerTable([t.Rule("command", handler, prefix="$db")])
+    assert names(table.match("general", "quip")) == []
+    table.add(t.Rule("quip", handler, exact="quip"))
+    assert names(table.match("general", "quip")) == ["quip"]
+
+    print("PASS")
+
+
+def test_channels():
+    """
+    Verifies that rules only fire in their channels and never in their excluded channels.
+    :return: None
+    """
+
+    print("")
+    print("test_channels: Testing channel restrictions...")
+
+    table = t.TriggerTable([t.Rule("attendance", handler, channels=["attendance"]),
+                            t.Rule("quip", handler, keyword="quip", exclude_channels=["attendance"]),
+                            t.Rule("command", handler, prefix="$db")])
+
+    assert names(table.match("attendance", "quip")) == ["attendance"]
+    assert names(table.match("attendance", "$db quip")) == ["attendance", "command"]
+    assert names(table.match("general", "$db quip")) == ["quip"]
+    assert names(table.match("general", "hello")) == []
+
+    print("PASS")
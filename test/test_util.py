@@ -0,0 +1,295 @@
+"""
+Tests for the util module.
+
+"""
+
+
+import asyncio
+import datetime
+
+from src import util as u
+
+
+class FakeResponse:
+    """
+    Stands in for a requests Response.
+    """
+
+    def __init__(self, status_code, content=b"", headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+
+def execute_all():
+    """
+    Executes all tests for the util module.
+    :return: None
+    """
+
+    print("")
+    print("--------------------- UTIL TESTS ----------------------")
+    print("")
+
+    test_calendar()
+    test_next_practices()
+    test_circuit_breaker()
+    test_breaker_counts_requests()
+    test_not_modified()
+    test_single_flight()
+
+
+def run(coroutine):
+    """
+    Runs a coroutine on a fresh event loop.
+    :param coroutine: The coroutine to run.
+    :return: What it returned.
+    """
+
+    loop = asyncio.new_event_loop()
+    try:
+        asyncio.set_event_loop(loop)
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+
+
+def test_calendar():
+    """
+    Verifies that practice days follow PRACTICE_SCHEDULE, odd weeks included, and that cancelled days aren't
+    practice days.
+    :return: None
+    """
+
+    print("")
+    print("test_calendar: Testing the semester calendar...")
+
+    start = u.SEMESTER_START_DATE
+
+    try:
+        # Week 1 is odd, so the first Tuesday has practice and the second doesn't.
+        tuesday = start + datetime.timedelta(days=(1 - start.weekday()) % 7)
+        assert u.get_week_number(tuesday) == 1
+        assert u.is_practice_on(tuesday)
+        assert not u.is_practice_on(tuesday + datetime.timedelta(days=7))
+        assert u.is_practice_on(tuesday + datetime.timedelta(days=14))
+        assert not u.is_practice_on(tuesday + datetime.timedelta(days=1))
+
+        # Days past the end of the calendar are still worked out.
+        far = tuesday + datetime.timedelta(weeks=u.SEMESTER_WEEKS * 2)
+        assert u.get_day(far).practice
+
+        u.set_cancelled_days([tuesday])
+        assert u.get_day(tuesday).cancelled and not u.is_practice_on(tuesday)
+        u.set_cancelled(tuesday, False)
+        assert u.is_practice_on(tuesday)
+    finally:
+        u.set_cancelled_days(())
+
+    print("PASS")
+
+
+def test_next_practices():
+    """
+    Verifies that next_practices counts from the given day, skips cancelled practices, and stops at the end of
+    the semester.
+    :return: None
+    """
+
+    print("")
+    print("test_next_practices: Testing upcoming practices...")
+
+    start = u.SEMESTER_START_DATE
+    end = start + datetime.timedelta(weeks=u.SEMESTER_WEEKS)
+
+    try:
+        practices = u.next_practices(4, start - datetime.timedelta(days=30))
+        assert len(practices) == 4
+        assert practices == sorted(practices) and practices[0] >= start
+        assert all(u.is_practice_on(day) for day in practices)
+        assert u.next_practices(3, practices[1]) == practices[1:4]
+
+        u.set_cancelled(practices[1], True)
+        assert u.next_practices(3, practices[0]) == [practices[0]] + practices[2:4]
+
+        assert u.next_practices(3, end) == []
+        assert len(u.next_practices(1000, start)) < 1000
+    finally:
+        u.set_cancelled_days(())
+
+    print("PASS")
+
+
+def test_circuit_breaker():
+    """
+    Verifies that the breaker opens after its threshold of failures, lets a single probe through once the
+    cooldown has passed, and closes or opens again depending on how the probe went.
+    :return: None
+    """
+
+    print("")
+    print("test_circuit_breaker: Testing the circuit breaker...")
+
+    breaker = u.CircuitBreaker(2, 30)
+    assert breaker.allow()
+    breaker.record_failure("boom")
+    assert breaker.state == u.CircuitBreaker.CLOSED
+    breaker.record_failure("boom")
+    assert breaker.state == u.CircuitBreaker.OPEN
+    assert not breaker.allow()
+    assert 0 < breaker.seconds_until_probe() <= 30
+
+    # Once the cooldown is over, one probe goes through. A failed probe opens the circuit again right away.
+    breaker.opened_at -= 30
+    assert breaker.allow()
+    assert breaker.state == u.CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_failure("still broken")
+    assert breaker.state == u.CircuitBreaker.OPEN and breaker.last_error == "still broken"
+
+    breaker.opened_at -= 30
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == u.CircuitBreaker.CLOSED and breaker.failures == 0
+    assert breaker.allow()
+
+    print("PASS")
+
+
+def test_breaker_counts_requests():
+    """
+    Verifies that a GET that is retried counts as one failure towards opening the circuit, and that requests are
+    refused with ApiUnavailable once it is open.
+    :return: None
+    """
+
+    print("")
+    print("test_breaker_counts_requests: Testing breaker failures per request...")
+
+    attempts = []
+
+    async def unreachable(method, endpoint, data, json, headers, label):
+        attempts.append(endpoint)
+        raise ConnectionError("ritdl-ws is not there")
+
+    async def request():
+        try:
+            await u.http_request("GET", "/test")
+        except OSError as e:
+            return e
+
+    saved = (u._send, u._breaker, u._retry_budget, u.API_RETRY_BACKOFF)
+    (u._send, u._breaker, u._retry_budget, u.API_RETRY_BACKOFF) = \
+        (unreachable, u.CircuitBreaker(2, 30), u.RetryBudget(1, 10), 0)
+
+    try:
+        assert isinstance(run(request()), ConnectionError)
+        assert len(attempts) == 1 + u.API_RETRIES
+        assert u._breaker.failures == 1 and u._breaker.state == u.CircuitBreaker.CLOSED
+
+        run(request())
+        assert u._breaker.state == u.CircuitBreaker.OPEN
+
+        del attempts[:]
+        assert isinstance(run(request()), u.ApiUnavailable)
+        assert not attempts
+    finally:
+        (u._send, u._breaker, u._retry_budget, u.API_RETRY_BACKOFF) = saved
+
+    print("PASS")
+
+
+def test_not_modified():
+    """
+    Verifies that a JSON GET is made conditional once ritdl-ws sent an ETag, and that a 304 answer reuses the
+    body parsed the last time.
+    :return: None
+    """
+
+    print("")
+    print("test_not_modified: Testing conditional GETs...")
+
+    sent = []
+    answers = [FakeResponse(200, b'{"quips": ["one"]}', {"ETag": '"v1"'}), FakeResponse(304),
+               FakeResponse(200, b'{"quips": ["two"]}')]
+
+    async def answer(method, endpoint, data=None, json=None, headers=None):
+        sent.append(headers)
+        return answers.pop(0)
+
+    saved = u.http_request
+    u.http_request = answer
+
+    try:
+        (res, first) = run(u.http_get_json("/test/quips"))
+        assert res.status_code == 200 and first == {"quips": ["one"]}
+        assert "If-None-Match" not in sent[0]
+
+        (res, second) = run(u.http_get_json("/test/quips"))
+        assert res.status_code == 304 and second is first
+        assert sent[1]["If-None-Match"] == '"v1"'
+
+        # No validator this time, so the next GET isn't conditional any more.
+        (res, third) = run(u.http_get_json("/test/quips"))
+        assert third == {"quips": ["two"]}
+        assert "/test/quips" not in u._validated
+    finally:
+        u.http_request = saved
+        u._validated.pop("/test/quips", None)
+
+    print("PASS")
+
+
+def test_single_flight():
+    """
+    Verifies that identical GETs to a single-flight endpoint share the request in flight, that one caller giving up
+    doesn't cancel it for the others, that a GET after it lands sends a new request, and that other endpoints are
+    never shared.
+    :return: None
+    """
+
+    print("")
+    print("test_single_flight: Testing shared GETs...")
+
+    assert "/cancellations".startswith(u.SINGLE_FLIGHT_ENDPOINTS)
+    assert not "/quip".startswith(u.SINGLE_FLIGHT_ENDPOINTS)
+
+    sent = []
+
+    async def share():
+        release = asyncio.Event()
+
+        async def answer(method, endpoint, data=None, json=None, headers=None):
+            sent.append(endpoint)
+            await release.wait()
+            return FakeResponse(200, str(len(sent)).encode("utf-8"))
+
+        u.http_request = answer
+
+        callers = [asyncio.ensure_future(u.http_get("/cancellations")) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        assert sent == ["/cancellations"]
+
+        callers[0].cancel()
+        await asyncio.sleep(0.01)
+        release.set()
+
+        assert [(await caller).content for caller in callers[1:]] == [b"1", b"1"]
+        assert callers[0].cancelled()
+        assert "/cancellations" not in u._in_flight
+
+        assert (await u.http_get("/cancellations")).content == b"2"
+
+        await asyncio.gather(u.http_get("/quip"), u.http_get("/quip"))
+        assert sent == ["/cancellations"] * 2 + ["/quip"] * 2
+
+    saved = u.http_request
+
+    try:
+        run(share())
+    finally:
+        u.http_request = saved
+        u._in_flight.clear()
+
+    print("PASS")